@@ -1,5 +1,6 @@
 import os
 import shelve
+import typing
 
 import click
 import dill
@@ -26,17 +27,67 @@ def create_app(test_config: dict = None):
     app.config.from_mapping(
         SECRET_KEY='dev',
         STORAGE_BACKEND='shelve',
-        SHELVE_PATH=os.path.join(app.instance_path, 'chantilly')
+        SHELVE_PATH=os.path.join(app.instance_path, 'chantilly'),
+        MEMORY_PATH=os.path.join(app.instance_path, 'chantilly-memory'),
+        MEMORY_FSYNC_INTERVAL=100,
+        MEMORY_COMPACT_EVERY=10_000,
+        EVENT_LOG_DIR=None,
+        EVENT_LOG_SEGMENT_SIZE=100_000,
+        SHADOW_MODE=False,
+        SHADOW_WORKERS=4,
+        METRICS_WINDOW_SIZE=1000,
+        METRICS_WINDOW_PERIOD=3600,
+        WORKER_TIMEOUT=3600,
+        FEATURE_CACHE_SIZE=10_000,
+        FEATURE_CACHE_TTL=60,
+        PREDICTION_CACHE_SIZE=0,
+        PREDICTION_BATCH_WAIT=0,
+        PREDICTION_BATCH_SIZE=64,
+        COMPILED_MODELS=False,
+        COMPILED_CHECK_RATE=.01,
+        MODEL_MEMORY_BUDGET=0,
+        MODEL_EVICTION_POLICY='lru',
+        MODEL_WRITE_BACK=False,
+        MODEL_FLUSH_INTERVAL=10,
+        MODEL_UPDATE_RETRIES=5,
+        PARALLEL_LEARNERS=0,
+        MERGE_INTERVAL=10,
+        PREDICT_CONCURRENCY=0,
+        LEARN_CONCURRENCY=0,
+        ADMISSION_QUEUE_SIZE=16,
+        ADMISSION_TIMEOUT=1,
+        LATENCY_SLO=0,
+        RETRY_AFTER=1,
+        LEARN_SAMPLING='none',
+        LEARN_SAMPLING_RATE=1,
+        LEARN_SAMPLING_BACKLOG=4,
+        IDEMPOTENCY_WINDOW=0,
+        IDEMPOTENCY_CAPACITY=100_000
     )
 
     # Read environment variables
-    config = {}
+    config: typing.Dict[str, typing.Any] = {}
     for var in ['STORAGE_BACKEND', 'SHELVE_PATH', 'STORAGE_BACKEND', 'REDIS_HOST', 'REDIS_PORT',
-                'REDIS_DB']:
+                'REDIS_DB', 'MEMORY_PATH', 'MEMORY_FSYNC_INTERVAL', 'MEMORY_COMPACT_EVERY',
+                'EVENT_LOG_DIR', 'EVENT_LOG_SEGMENT_SIZE', 'SHADOW_MODE', 'SHADOW_WORKERS',
+                'METRICS_WINDOW_SIZE', 'METRICS_WINDOW_PERIOD', 'WORKER_TIMEOUT',
+                'FEATURE_CACHE_SIZE',
+                'FEATURE_CACHE_TTL', 'PREDICTION_CACHE_SIZE', 'PREDICTION_BATCH_WAIT',
+                'PREDICTION_BATCH_SIZE', 'COMPILED_MODELS', 'COMPILED_CHECK_RATE',
+                'MODEL_MEMORY_BUDGET',
+                'MODEL_EVICTION_POLICY', 'MODEL_WRITE_BACK', 'MODEL_FLUSH_INTERVAL',
+                'MODEL_UPDATE_RETRIES', 'PARALLEL_LEARNERS', 'MERGE_INTERVAL',
+                'PREDICT_CONCURRENCY', 'LEARN_CONCURRENCY', 'ADMISSION_QUEUE_SIZE',
+                'ADMISSION_TIMEOUT', 'LATENCY_SLO', 'RETRY_AFTER', 'LEARN_SAMPLING',
+                'LEARN_SAMPLING_RATE', 'LEARN_SAMPLING_BACKLOG', 'IDEMPOTENCY_WINDOW',
+                'IDEMPOTENCY_CAPACITY']:
         try:
             config[var] = os.environ[var]
         except KeyError:
             pass
+    for var in ['SHADOW_MODE', 'MODEL_WRITE_BACK', 'COMPILED_MODELS']:
+        if var in config:
+            config[var] = config[var].lower() in ('1', 'true', 'yes')
     app.config.from_mapping(config)
 
     if test_config is None:
@@ -56,6 +107,9 @@ def create_app(test_config: dict = None):
     app.cli.add_command(cli.init)
     app.cli.add_command(cli.add_model)
     app.cli.add_command(cli.delete_model)
+    app.cli.add_command(cli.replay)
+    app.cli.add_command(cli.evaluate)
+    app.cli.add_command(cli.bench_storage)
 
     from . import api
     app.register_blueprint(api.bp)
@@ -69,6 +123,7 @@ def create_app(test_config: dict = None):
     def handle_invalid_usage(error):
         response = flask.jsonify(error.to_dict())
         response.status_code = error.status_code
+        response.headers.update(error.headers)
         return response
 
     # https://flask.palletsprojects.com/en/1.1.x/patterns/favicon/
@@ -0,0 +1,183 @@
+"""Admission control, which turns requests away instead of letting them pile up.
+
+Each endpoint may process a limited number of requests at once. The requests which exceed the limit
+wait in a bounded queue, and are rejected with a 429 once the queue is full, or with a 503 once they
+have waited for too long. Requests to `@/api/learn` are rejected as soon as predictions are waiting
+or the 99th percentile of the prediction latency goes over the latency objective, so that
+predictions keep being served when the server is overwhelmed. Everything is per process.
+
+"""
+import collections
+import math
+import threading
+import time
+import typing
+
+from . import exceptions
+
+
+class LatencyWindow:
+    """Durations of the requests made over the last `period` seconds, of which at most `maxlen`
+    are kept.
+
+    >>> window = LatencyWindow()
+    >>> for duration in range(1, 101):
+    ...     window.record(duration)
+    >>> window.quantile(.99)
+    99
+
+    """
+
+    def __init__(self, period=10., maxlen=1000):
+        self.period = period
+        self._durations: typing.Deque[typing.Tuple[float, float]] = (
+            collections.deque(maxlen=maxlen)
+        )
+        self._lock = threading.Lock()
+
+    def record(self, duration: float, n=1):
+        """Record `n` requests which each took `duration`."""
+        with self._lock:
+            now = time.monotonic()
+            self._durations.extend((now, duration) for _ in range(n))
+
+    def quantile(self, q: float) -> float:
+        """Return a quantile of the recent durations, or 0 if there are none."""
+        with self._lock:
+            expired = time.monotonic() - self.period
+            while self._durations and self._durations[0][0] < expired:
+                self._durations.popleft()
+            durations = sorted(duration for _, duration in self._durations)
+        if not durations:
+            return 0
+        return durations[max(math.ceil(q * len(durations)) - 1, 0)]
+
+
+class Limiter:
+    """Limits the number of requests processed at once, and makes the others wait in a queue.
+    There is no limit if `limit` is 0, in which case requests are only counted."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, limit: int, queue_size: int, timeout: float, retry_after: int):
+        """Wait for a request to be processed, raising `Overloaded` if it is turned away."""
+
+        with self._cond:
+            if not limit or self.in_flight < limit:
+                self.in_flight += 1
+                return
+
+            if self.waiting >= queue_size:
+                self.rejected += 1
+                raise exceptions.Overloaded(
+                    message='Too many requests are waiting, please retry later.',
+                    status_code=429,
+                    retry_after=retry_after
+                )
+
+            self.waiting += 1
+            try:
+                admitted = self._cond.wait_for(lambda: self.in_flight < limit, timeout=timeout)
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                self.rejected += 1
+                raise exceptions.Overloaded(
+                    message='The request waited for too long, please retry later.',
+                    retry_after=retry_after
+                )
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+
+ENDPOINTS = ('predict', 'learn')
+
+_LIMITERS = {endpoint: Limiter() for endpoint in ENDPOINTS}
+_LATENCIES = {endpoint: LatencyWindow() for endpoint in ENDPOINTS}
+_SHED: typing.Counter[str] = collections.Counter()
+_lock = threading.Lock()
+
+
+def admit(endpoint: str, config):
+    """Decide whether a request to an endpoint is processed, and wait for its turn if necessary.
+
+    The request then takes a slot, which has to be released once the request is processed. Raises
+    `Overloaded` if the request is turned away.
+
+    Parameters:
+        endpoint: Either 'predict' or 'learn'.
+        config: The configuration of the app.
+
+    """
+
+    slo = float(config['LATENCY_SLO'])
+    retry_after = int(config['RETRY_AFTER'])
+
+    # Learning is the first thing to give up on when predictions suffer
+    if endpoint == 'learn':
+        overdue = slo and _LATENCIES['predict'].quantile(.99) > slo
+        if overdue or _LIMITERS['predict'].waiting:
+            with _lock:
+                _SHED[endpoint] += 1
+            raise exceptions.Overloaded(
+                message='Predictions are being prioritized, please retry later.',
+                retry_after=retry_after
+            )
+
+    # Requests don't queue up when the latency objective is already missed
+    queue_size = int(config['ADMISSION_QUEUE_SIZE'])
+    if slo and _LATENCIES[endpoint].quantile(.99) > slo:
+        queue_size = 0
+
+    _LIMITERS[endpoint].acquire(
+        limit=int(config[f'{endpoint.upper()}_CONCURRENCY']),
+        queue_size=queue_size,
+        timeout=float(config['ADMISSION_TIMEOUT']),
+        retry_after=retry_after
+    )
+
+
+def release(endpoint: str):
+    _LIMITERS[endpoint].release()
+
+
+def backlog(endpoint: str) -> int:
+    """Return the number of requests to an endpoint which are being processed or waiting."""
+    limiter = _LIMITERS[endpoint]
+    return limiter.in_flight + limiter.waiting
+
+
+def observe(endpoint: str, duration: float, n_items=1):
+    """Record the number of seconds it took to process a request. The items of a batch request
+    are recorded individually, and each take a share of the duration."""
+    if n_items:
+        _LATENCIES[endpoint].record(duration / n_items, n=n_items)
+
+
+def stats() -> dict:
+    return {
+        endpoint: {
+            'in_flight': _LIMITERS[endpoint].in_flight,
+            'waiting': _LIMITERS[endpoint].waiting,
+            'rejected': _LIMITERS[endpoint].rejected + _SHED[endpoint],
+            'p99_duration': _LATENCIES[endpoint].quantile(.99)
+        }
+        for endpoint in ENDPOINTS
+    }
+
+
+def clear():
+    """Forget the recorded latencies and counts."""
+    for endpoint in ENDPOINTS:
+        _LATENCIES[endpoint] = LatencyWindow()
+        _LIMITERS[endpoint].rejected = 0
+    with _lock:
+        _SHED.clear()
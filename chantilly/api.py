@@ -1,15 +1,38 @@
-import copy
+import concurrent.futures
+import collections
+import contextlib
+import functools
+import gzip
+import hashlib
 import json
+import math
 import queue
+import random
+import threading
 import time
+import typing
 
 import cerberus
 import river
-from river.metrics.base import ClassificationMetric
 import dill
 import flask
-
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from . import admission
+from . import averaging
+from . import batching
+from . import caching
+from . import columns
+from . import compiling
+from . import dedup
+from . import events
 from . import exceptions
+from . import history
+from . import immutable
+from . import sampling
 from . import storage
 
 
@@ -38,6 +61,12 @@ METRICS_ANNOUNCER = MessageAnnouncer()
 
 EVENTS_ANNOUNCER = MessageAnnouncer()
 
+METRICS_HISTORY = history.History()
+
+# When the merged metrics were last reported, globally and for each model
+_REPORTED_AT: typing.Dict[typing.Optional[str], float] = {}
+_REPORTED_AT_LOCK = threading.Lock()
+
 
 def format_sse(data: str, event=None) -> str:
     """
@@ -52,31 +81,50 @@ def format_sse(data: str, event=None) -> str:
     return msg
 
 
+# The endpoints whose calls are timed, and the name under which they are recorded
+TIMED_ENDPOINTS = {
+    'api.learn': 'learn',
+    'api.predict': 'predict',
+    'api.batch_learn': 'learn',
+    'api.batch_predict': 'predict',
+}
+
+
 @bp.before_request
 def before_request_func():
-    if flask.request.endpoint in ('api.learn', 'api.predict'):
-        flask.request.started_at = time.perf_counter_ns()
+    try:
+        endpoint = TIMED_ENDPOINTS[flask.request.endpoint]
+    except KeyError:
+        return
+
+    # The time spent waiting to be admitted is part of the duration of a call
+    flask.request.started_at = time.perf_counter_ns()
+    admission.admit(endpoint, flask.current_app.config)
+    flask.g.admitted = True
 
 
 @bp.after_request
 def after_request_func(response):
 
-    if flask.request.endpoint not in ('api.learn', 'api.predict'):
+    try:
+        endpoint = TIMED_ENDPOINTS[flask.request.endpoint]
+    except KeyError:
+        return response
+    if not flask.g.get('admitted'):
         return response
 
+    # The calls which are part of a batch are counted individually
     duration = time.perf_counter_ns() - flask.request.started_at
-    db = storage.get_db()
-    stats = db['stats']
+    n_items = flask.g.get('n_items', 1)
+    storage.record_call(endpoint, duration, n_calls=n_items)
+    admission.observe(endpoint, duration / 1e9, n_items=n_items)
+    return response
 
-    if flask.request.endpoint == 'api.learn':
-        stats['learn_mean'].update(duration)
-        stats['learn_ewm'].update(duration)
-    elif flask.request.endpoint == 'api.predict':
-        stats['predict_mean'].update(duration)
-        stats['predict_ewm'].update(duration)
 
-    db['stats'] = stats
-    return response
+@bp.teardown_request
+def teardown_request_func(exc):
+    if flask.g.get('admitted'):
+        admission.release(TIMED_ENDPOINTS[flask.request.endpoint])
 
 
 InitSchema = {
@@ -115,6 +163,15 @@ def init():
         storage.set_flavor(flavor=payload['flavor'])
     except exceptions.UnknownFlavor as err:
         raise exceptions.InvalidUsage(message=str(err))
+    METRICS_HISTORY.clear()
+    _REPORTED_AT.clear()
+    reset_caches()
+    averaging.clear()
+    admission.clear()
+    sampling.clear()
+    dedup.clear()
+    compiling.clear()
+    columns.clear()
 
     return {}, 201
 
@@ -127,10 +184,11 @@ def model(name=None):
 
     # DELETE: drop the model
     if flask.request.method == 'DELETE':
-        key = f'models/{name}'
-        if key not in db:
+        if f'models/{name}' not in db:
             return {}, 404
-        del db[key]
+        storage.delete_model(name)
+        averaging.forget(name)
+        columns.forget(name)
         return {}, 204
 
     # POST: set the model
@@ -147,22 +205,427 @@ def model(name=None):
         if not ok:
             raise exceptions.InvalidUsage(message=error)
         name = storage.add_model(model, name=name)
+        averaging.forget(name)
+        columns.forget(name)
         db['default_model_name'] = name  # the most recent model becomes the default
         return {'name': name}, 201
 
     # GET: return the current model
     name = db['default_model_name'] if name is None else name
-    model = db[f'models/{name}']
-    return dill.dumps(model)
+    if f'models/{name}' not in db:
+        return {}, 404
+
+    # The version of the model is used as an ETag, which spares sending a model that the client
+    # already has. It is a weak ETag because making predictions may slightly modify a model
+    # without changing its version.
+    version = storage.model_version(name)
+    if version is not None and flask.request.if_none_match.contains_weak(version):
+        response = flask.Response(status=304)
+        response.set_etag(version, weak=True)
+        return response
+
+    # The model is sent as it is stored, without being deserialized
+    blob = storage.load_raw_model(name)
+    response = flask.Response(blob, mimetype='application/octet-stream')
+    if version is not None:
+        response.set_etag(version, weak=True)
+
+    encodings = ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+    encoding = flask.request.accept_encodings.best_match(encodings)
+    if encoding == 'zstd':
+        response.set_data(zstandard.ZstdCompressor().compress(blob))
+    elif encoding == 'gzip':
+        response.set_data(gzip.compress(blob))
+    if encoding is not None:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+
+    return response
 
 
 @bp.route('/models', methods=['GET'])
 def models():
     db = storage.get_db()
-    model_names = sorted([k.split('/', 1)[1] for k in db if k.startswith('models/')])
+
+    # The list of models can be paginated
+    args = flask.request.args
+    offset = args.get('offset', 0, type=int)
+    limit = args.get('limit', type=int)
+    if offset < 0 or (limit is not None and limit < 0):
+        raise exceptions.InvalidUsage(message='offset and limit must not be negative.')
+    model_names = storage.model_names(offset=offset, limit=limit)
+
+    # The metadata of each model is only returned if it is asked for
+    if args.get('details', 'false').lower() == 'true':
+        return {
+            'models': [storage.model_meta(name) for name in model_names],
+            'default': db.get('default_model_name')
+        }, 200
+
     return {'models': model_names, 'default': db.get('default_model_name')}, 200
 
 
+_SHADOW_POOL = None
+
+
+def shadow_pool() -> concurrent.futures.ThreadPoolExecutor:
+    """Return the process-wide pool used to update the challenger models in shadow mode."""
+    global _SHADOW_POOL
+    if _SHADOW_POOL is None:
+        workers = int(flask.current_app.config['SHADOW_WORKERS'])
+        _SHADOW_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    return _SHADOW_POOL
+
+
+def record_mutation(name: str) -> typing.Callable[[str], None]:
+    """Return a function which records that a method of a model unexpectedly modified its input, so
+    that the features are copied for that method from then on."""
+    return lambda method: storage.record_mutation(name, method)
+
+
+def load_challengers(db, champion: str,
+                     locks: contextlib.ExitStack) -> typing.Tuple[dict, dict]:
+    """Load every registered model apart from the champion, along with their versions. The lock of
+    each model is entered into `locks`, in the order of the names so that requests which load the
+    same challengers don't wait on each other forever."""
+    challengers, versions = {}, {}
+    for name in sorted(storage.model_names()):
+        if name == champion:
+            continue
+        locks.enter_context(storage.model_lock(name))
+        try:
+            challengers[name], versions[name] = storage.checkout_model(name)
+        except KeyError:  # the model was deleted in the meantime
+            continue
+    return challengers, versions
+
+
+def shadow_predict(challengers: dict, flavor, features) -> dict:
+    """Make a prediction with each challenger. Challengers which fail are left out."""
+
+    features = immutable.freeze(features)
+    mutates = {name: storage.mutating_methods(name) for name in challengers}
+    mutations: typing.Dict[str, typing.List[str]] = {name: [] for name in challengers}
+
+    def predict_one(name, model):
+        return immutable.call(
+            model, flavor.pred_func, features,
+            mutates=mutates[name], on_mutation=mutations[name].append
+        )
+
+    futures = {
+        name: shadow_pool().submit(predict_one, name, model)
+        for name, model in challengers.items()
+    }
+    predictions = {}
+    for name, future in futures.items():
+        error = future.exception()
+        for method in mutations[name]:
+            storage.record_mutation(name, method)
+        if error is not None:
+            flask.current_app.logger.warning(f'Challenger {name} failed to predict: {error!r}')
+            continue
+        predictions[name] = future.result()
+    return predictions
+
+
+def shadow_learn(challengers: dict, versions: dict, flavor, features, ground_truth,
+                 predictions: dict) -> dict:
+    """Update each challenger and then its metrics. Returns the updated metric values of the
+    challengers which succeeded."""
+
+    features = immutable.freeze(features)
+    mutates = {name: storage.mutating_methods(name) for name in challengers}
+    mutations: typing.Dict[str, typing.List[str]] = {name: [] for name in challengers}
+
+    def learn_one(name, model):
+        on_mutation = mutations[name].append
+        prediction = predictions.get(name)
+        if prediction is None:
+            prediction = immutable.call(
+                model, flavor.pred_func, features,
+                mutates=mutates[name], on_mutation=on_mutation
+            )
+        immutable.call(
+            model, 'learn_one', features,
+            mutates=mutates[name], on_mutation=on_mutation, y=ground_truth
+        )
+        return prediction
+
+    futures = {
+        name: shadow_pool().submit(learn_one, name, model)
+        for name, model in challengers.items()
+    }
+    updated = {}
+    for name, future in futures.items():
+        error = future.exception()
+        for method in mutations[name]:
+            storage.record_mutation(name, method)
+        if error is not None:
+            flask.current_app.logger.warning(f'Challenger {name} failed to learn: {error!r}')
+            storage.revert_model(name)
+            continue
+        prediction = future.result()
+        try:
+            storage.commit_model(
+                name, challengers[name],
+                based_on=versions[name],
+                reapply=lambda model, name=name: immutable.call(
+                    model, 'learn_one', features, mutates=mutates[name], y=ground_truth
+                )
+            )
+        except Exception as e:
+            flask.current_app.logger.warning(f'Challenger {name} failed to be stored: {e!r}')
+            storage.revert_model(name)
+            continue
+        updated[name] = storage.update_worker_metrics(ground_truth, prediction, name)
+    return updated
+
+
+_FEATURE_CACHE = None
+
+
+def feature_cache() -> caching.LRUCache:
+    """Return the process-wide cache of entities from the feature store."""
+    global _FEATURE_CACHE
+    if _FEATURE_CACHE is None:
+        config = flask.current_app.config
+        ttl = config['FEATURE_CACHE_TTL']
+        _FEATURE_CACHE = caching.LRUCache(
+            maxsize=int(config['FEATURE_CACHE_SIZE']),
+            ttl=None if ttl is None else float(ttl)
+        )
+    return _FEATURE_CACHE
+
+
+def resolve_features(db, features):
+    """Replace the key of an entity with the entity's features.
+
+    Strings which are not the key of an entity, such as text input, are left untouched.
+
+    """
+    if not isinstance(features, str):
+        return features
+    entity = feature_cache().get(features)
+    if entity is not None:
+        return entity
+    try:
+        entity = db[f'features/{features}']
+    except KeyError:
+        return features
+    feature_cache()[features] = entity
+    return entity
+
+
+FeaturesSchema = {
+    'features': {'type': 'dict', 'required': True, 'valuesrules': {'type': 'dict'}},
+}
+
+
+@bp.route('/features', methods=['POST'])
+@bp.route('/features/<key>', methods=['GET', 'DELETE'])
+def features(key=None):
+
+    db = storage.get_db()
+
+    # GET: return the features of an entity
+    if flask.request.method == 'GET':
+        try:
+            return db[f'features/{key}']
+        except KeyError:
+            return {}, 404
+
+    # DELETE: drop an entity
+    if flask.request.method == 'DELETE':
+        try:
+            del db[f'features/{key}']
+        except KeyError:
+            return {}, 404
+        feature_cache().pop(key)
+        return {}, 204
+
+    # POST: insert or replace entities in bulk
+    payload = flask.request.json
+    v = cerberus.Validator(FeaturesSchema)
+    ok = v.validate(payload)
+    if not ok:
+        raise exceptions.InvalidUsage(message=v.errors)
+
+    for key, entity in payload['features'].items():
+        db[f'features/{key}'] = entity
+        feature_cache().pop(key)
+
+    return {'n_entities': len(payload['features'])}, 201
+
+
+_PREDICTION_CACHE = None
+_PREDICTION_COALESCER = None
+
+
+def prediction_cache() -> typing.Optional[caching.LRUCache]:
+    """Return the process-wide prediction cache, or `None` if predictions are not cached."""
+    global _PREDICTION_CACHE
+    size = int(flask.current_app.config['PREDICTION_CACHE_SIZE'])
+    if not size:
+        return None
+    if _PREDICTION_CACHE is None:
+        _PREDICTION_CACHE = caching.LRUCache(maxsize=size)
+    return _PREDICTION_CACHE
+
+
+def hash_features(features) -> bytes:
+    """Return a digest which doesn't depend on the order of the features.
+
+    >>> hash_features({'a': 1, 'b': 2}) == hash_features({'b': 2, 'a': 1})
+    True
+
+    """
+    return hashlib.blake2b(json.dumps(features, sort_keys=True).encode(), digest_size=16).digest()
+
+
+def reset_caches():
+    """Drop the process-wide caches, which is necessary when the database is wiped out."""
+    global _FEATURE_CACHE, _PREDICTION_CACHE, _PREDICTION_COALESCER
+    _FEATURE_CACHE = _PREDICTION_CACHE = _PREDICTION_COALESCER = None
+
+
+# Below this number of features, scoring a batch one set of features at a time is faster than
+# building a matrix
+VECTORIZE_MIN_FEATURES = 10
+
+
+def index_batch(model_name: str, batch: list) -> columns.Matrix:
+    """Convert a batch of features to a matrix along the feature index of a model. The index is
+    stored if new feature names are added to it, in which case the matrix is built again if the
+    index has adopted the stored order in the meantime."""
+    index = storage.feature_index(model_name)
+    size = len(index)
+    matrix = index.matrix(batch)
+    if len(index) > size:
+        storage.store_feature_index(model_name, index)
+        if matrix.names is not index.names:
+            matrix = index.matrix(batch)
+    return matrix
+
+
+def make_predictions(model_name: str, batch: list) -> list:
+    """Make a prediction for each set of features with a single copy of a model. A prediction which
+    fails is replaced with the error.
+
+    The compiled form of the model is used when there is one. The actual model is then only loaded
+    for the features which the compiled form can't handle, and for a sample of the predictions,
+    which are compared with the ones of the compiled form.
+
+    """
+
+    flavor = storage.get_db()['flavor']
+    config = flask.current_app.config
+    preds: list = [None] * len(batch)
+    pending = list(range(len(batch)))  # the predictions which the actual model has to make
+    checks = []  # the predictions of the compiled form which are checked
+
+    compiled = compiled_version = None
+    if config['COMPILED_MODELS']:
+        compiled, compiled_version = storage.load_compiled_model(model_name)
+        if compiled is not None and (
+            compiled_version is None or
+            compiled.method != flavor.pred_func or
+            compiling.is_disabled(model_name, compiled_version)
+        ):
+            compiled = None
+
+    if compiled is not None:
+
+        # Batches of many features are scored at once, as a matrix
+        vectorize = len(batch) > 1 and len(compiled.index) >= VECTORIZE_MIN_FEATURES
+        if vectorize and not compiled.one_hot:
+            matrix = index_batch(model_name, batch)
+            preds = compiled.predict_many(matrix, matrix.names)
+            pending = matrix.skipped
+        else:
+            pending = []
+            for i, raw_features in enumerate(batch):
+                try:
+                    preds[i] = compiled.predict(raw_features)
+                except compiling.NotCompilable:
+                    pending.append(i)
+
+        check_rate = float(config['COMPILED_CHECK_RATE'])
+        fallbacks = set(pending)
+        checks = [
+            i for i in range(len(batch))
+            if i not in fallbacks and random.random() < check_rate
+        ]
+        compiling.count(
+            predictions=len(batch) - len(pending),
+            fallbacks=len(pending),
+            checks=len(checks)
+        )
+        if not pending and not checks:
+            return preds
+
+    with storage.model_lock(model_name):
+
+        try:
+            model, version = storage.checkout_model(model_name)
+        except KeyError:
+            raise exceptions.InvalidUsage(message=f"No model named '{model_name}'.")
+        mutates = storage.mutating_methods(model_name)
+
+        def predict(raw_features):
+
+            # The features are made read-only because the model might modify them in-place while
+            # we want to be able to store an identical copy. They are only copied if the model
+            # needs to modify them.
+            features = immutable.freeze(raw_features)
+
+            try:
+                return immutable.call(
+                    model, flavor.pred_func, features,
+                    mutates=mutates, on_mutation=record_mutation(model_name)
+                )
+            except Exception as e:
+                return exceptions.InvalidUsage(message=repr(e))
+
+        for i in pending:
+            preds[i] = predict(batch[i])
+
+        # The compiled form isn't used anymore if it doesn't agree with the model it was compiled
+        # from
+        for i in checks:
+            pred = predict(batch[i])
+            if not compiling.agree(preds[i], pred):
+                if compiled_version is not None and version == compiled_version:
+                    compiling.disable(model_name, compiled_version)
+                preds[i] = pred
+
+        # The unsupervised parts of the model might be updated after a prediction, so we need to
+        # store it, unless the model has been updated in the meantime. A model whose prediction
+        # failed might have been left half-updated, in which case it isn't stored.
+        if any(isinstance(pred, Exception) for pred in preds):
+            storage.revert_model(model_name)
+        else:
+            storage.commit_model(model_name, model, based_on=version, bump=False)
+
+    return preds
+
+
+def prediction_coalescer() -> typing.Optional[batching.Coalescer]:
+    """Return the process-wide coalescer of predictions, or `None` if predictions are made one by
+    one."""
+    global _PREDICTION_COALESCER
+    max_wait = float(flask.current_app.config['PREDICTION_BATCH_WAIT'])
+    if not max_wait:
+        return None
+    if _PREDICTION_COALESCER is None:
+        _PREDICTION_COALESCER = batching.Coalescer(
+            make_predictions,
+            max_wait=max_wait,
+            max_size=int(flask.current_app.config['PREDICTION_BATCH_SIZE'])
+        )
+    return _PREDICTION_COALESCER
+
+
 PredictSchema = {
     'features': {'anyof': [{'type': 'dict'}, {'type': 'string'}], 'required': True},
     'id': {'anyof': [{'type': 'integer'}, {'type': 'string'}]},
@@ -172,9 +635,13 @@ PredictSchema = {
 
 @bp.route('/predict', methods=['POST'])
 def predict():
+    return predict_one(flask.request.json)
+
+
+def predict_one(payload: dict, pred=None) -> typing.Tuple[dict, int]:
+    """Handle a call to `@/api/predict`. The prediction is made here unless `pred` is given."""
 
     # Validate the payload
-    payload = flask.request.json
     v = cerberus.Validator(PredictSchema)
     ok = v.validate(payload)
     if not ok:
@@ -188,26 +655,37 @@ def predict():
         raise exceptions.InvalidUsage(message='No default model has been set.')
 
     model_name = payload.get('model', default_model_name)
-    try:
-        model = db[f'models/{model_name}']
-    except KeyError:
-        raise exceptions.InvalidUsage(message=f"No model named '{model_name}'.")
 
-    # We make a copy because the model might modify the features in-place while we want to be able
-    # to store an identical copy
-    features = copy.deepcopy(payload['features'])
+    # Features may be retrieved from the feature store
+    raw_features = resolve_features(db, payload['features'])
 
-    # Make the prediction
+    # The prediction might have already been made with the current version of the model
     flavor = db['flavor']
-    pred_func = getattr(model, flavor.pred_func)
-    try:
-        pred = pred_func(x=features)
-    except Exception as e:
-        raise exceptions.InvalidUsage(message=repr(e))
+    cache, cache_key = prediction_cache(), None
+    if isinstance(pred, Exception):
+        raise pred
+    if pred is None and cache is not None:
+        version = storage.model_version(model_name)
+        if version is not None:
+            cache_key = (model_name, version, hash_features(raw_features))
+            pred = cache.get(cache_key)
+
+    if pred is None:
+
+        # Concurrent predictions for the same model may be made together. The other requests
+        # couldn't join the batch if the storage backend was still lent to this one.
+        coalescer = prediction_coalescer()
+        if coalescer is not None:
+            storage.release_db()
+            pred = coalescer.submit(model_name, raw_features)
+            db = storage.get_db()
+        else:
+            pred, = make_predictions(model_name, [raw_features])
+            if isinstance(pred, Exception):
+                raise pred
 
-    # The unsupervised parts of the model might be updated after a prediction, so we need to store
-    # it
-    db[f'models/{model_name}'] = model
+        if cache is not None and cache_key is not None:
+            cache[cache_key] = pred
 
     # Announce the prediction
     if EVENTS_ANNOUNCER.listeners:
@@ -224,11 +702,30 @@ def predict():
     # further down the line.
     status_code = 200
     if 'id' in payload:
-        db['#%s' % payload['id']] = {
+        memory = {
             'model': model_name,
-            'features': payload['features'],
+            'features': raw_features,
             'prediction': pred
         }
+        # In shadow mode, the challengers also make a prediction, so that their metrics are
+        # computed with the predictions they would have made at this point in time
+        if flask.current_app.config['SHADOW_MODE']:
+            with contextlib.ExitStack() as locks:
+                challengers, versions = load_challengers(db, champion=model_name, locks=locks)
+                shadow_predictions = shadow_predict(challengers, flavor, raw_features)
+                for name, challenger in challengers.items():
+                    if name not in shadow_predictions:
+                        storage.revert_model(name)
+                        continue
+                    try:
+                        storage.commit_model(name, challenger, based_on=versions[name], bump=False)
+                    except Exception as e:
+                        flask.current_app.logger.warning(
+                            f'Challenger {name} failed to be stored: {e!r}'
+                        )
+                        storage.revert_model(name)
+            memory['shadow_predictions'] = shadow_predictions
+        db['#%s' % payload['id']] = memory
         status_code = 201
 
     return {'model': model_name, 'prediction': pred}, status_code
@@ -239,19 +736,83 @@ LearnSchema = {
     'id': {'anyof': [{'type': 'integer'}, {'type': 'string'}]},
     'ground_truth': {'required': True},
     'model': {'type': 'string'},
+    'idempotency_key': {'type': 'string'},
 }
 
 
+def report_metrics(model_name: str):
+    """Record the metrics of every worker merged together in the history, and announce the global
+    ones to the listeners. Merging the metrics involves reading the ones of every worker, so this
+    is done at most once per second, which is the finest resolution of the history."""
+    interval = METRICS_HISTORY.tiers[0][0]
+    now = time.monotonic()
+    for name in (None, model_name):
+        with _REPORTED_AT_LOCK:
+            if now - _REPORTED_AT.get(name, -math.inf) < interval:
+                continue
+            _REPORTED_AT[name] = now
+        values = storage.get_metrics(name).get()
+        METRICS_HISTORY.record(values, model=name)
+        if name is None and METRICS_ANNOUNCER.listeners:
+            METRICS_ANNOUNCER.announce(format_sse(data=json.dumps(values)))
+
+
 @bp.route('/learn', methods=['POST'])
 def learn():
+    return learn_one(flask.request.json, flask.request.headers.get('Idempotency-Key'))
+
+
+def learn_one(payload: dict,
+              idempotency_key: typing.Optional[str] = None) -> typing.Tuple[dict, int]:
 
     # Validate the payload
-    payload = flask.request.json
     v = cerberus.Validator(LearnSchema)
     ok = v.validate(payload)
     if not ok:
        raise exceptions.InvalidUsage(message=v.errors)
 
+    # An event which has already been learnt from is acknowledged without being learnt again, which
+    # makes it safe for clients to retry. The key is claimed while the event is being learnt from,
+    # so that a retry which arrives in the meantime isn't learnt from either.
+    recent_keys = dedup.recent_keys(flask.current_app.config, r=storage.redis_client())
+    key = payload.get('idempotency_key', idempotency_key)
+    if key is None:
+        key = payload.get('id')
+    if recent_keys is None or key is None:
+        return learn_event(payload)
+
+    claim = recent_keys.claim(key)
+    if claim == dedup.DUPLICATE:
+        return {'duplicate': True}, 200
+    if claim == dedup.IN_FLIGHT:
+        raise exceptions.InvalidUsage(
+            message='The event is already being learnt from, please retry.',
+            status_code=409
+        )
+    try:
+        response = learn_event(payload)
+    except BaseException:
+        recent_keys.release(key)
+        raise
+    recent_keys.add(key)
+    return response
+
+
+def merge_replicas(app: flask.Flask, idle_for: float):
+    """Merge the replicas of the process which are due, outside of any request."""
+    with app.app_context():
+        try:
+            storage.merge_replicas(
+                weight=1 / int(app.config['PARALLEL_LEARNERS']),
+                idle_for=idle_for
+            )
+        except Exception as e:
+            app.logger.warning(f'The replicas could not be merged: {e!r}')
+
+
+def learn_event(payload: dict) -> typing.Tuple[dict, int]:
+    """Learn from an event which has been validated by `learn_one`."""
+
     # Unpack the information provided in the request
     model_name = payload.get('model')
     features = payload.get('features')
@@ -266,10 +827,12 @@ def learn():
     model_name = memory.get('model', model_name)
     features = memory.get('features', features)
     prediction = memory.get('prediction', prediction)
+    shadow_predictions = memory.get('shadow_predictions', {})
 
     # Raise an error if no features are provided
     if features is None:
         raise exceptions.InvalidUsage(message='No features are stored and none were provided.')
+    features = resolve_features(db, features)
 
     # Load the model
     if model_name is None:
@@ -278,46 +841,115 @@ def learn():
         except KeyError:
             raise exceptions.InvalidUsage(message='No default model has been set.')
         model_name = default_model_name
+    # With parallel learning, each process learns with its own replica of the model. Otherwise the
+    # model is locked until it is committed, in case it is shared by the requests of the process.
+    learners = int(flask.current_app.config['PARALLEL_LEARNERS'])
     try:
-        model = db[f'models/{model_name}']
+        with storage.model_lock(model_name):
+            replica = (
+                averaging.get_replica(model_name, storage.checkout_replica) if learners else None
+            )
     except KeyError:
         raise exceptions.InvalidUsage(message=f"No model named '{model_name}'.")
 
-    # Obtain a prediction if none was made earlier
-    if prediction is None:
-        flavor = db['flavor']
-        pred_func = getattr(model, flavor.pred_func)
-        try:
-            prediction = pred_func(x=copy.deepcopy(features))
-        except Exception as e:
-            raise exceptions.InvalidUsage(message=repr(e))
-
-    # Update the metrics
-    metrics = db['metrics']
-    for metric in metrics:
-        # If the metrics requires labels but the prediction is a dict, then we need to retrieve the
-        # predicted label with the highest probability
-        if (
-            isinstance(metric, ClassificationMetric) and
-            metric.requires_labels and
-            isinstance(prediction, dict)
-        ):
-            # At this point prediction is a dict, but it might be empty because no training data
-            # has been seen
-            if len(prediction) == 0:
-                continue
-            pred = max(prediction, key=prediction.get)
-            metric.update(y_true=payload['ground_truth'], y_pred=pred)
+    # The replicas are also merged in the background, and when the process exits, so that the
+    # updates of a process which stops learning aren't lost
+    interval = float(flask.current_app.config['MERGE_INTERVAL'])
+    if replica is not None:
+        app = flask.current_app._get_current_object()  # type: ignore
+        averaging.schedule_merges(functools.partial(merge_replicas, app), interval=interval)
+
+    with replica.lock if replica is not None else storage.model_lock(model_name):
+
+        if replica is not None:
+            model = replica.model
         else:
-            metric.update(y_true=payload['ground_truth'], y_pred=prediction)
-    db['metrics'] = metrics
+            try:
+                model, version = storage.checkout_model(model_name)
+            except KeyError:
+                raise exceptions.InvalidUsage(message=f"No model named '{model_name}'.")
 
-    # Update the model
-    try:
-        model.learn_one(x=copy.deepcopy(features), y=payload['ground_truth'])
-    except Exception as e:
-        raise exceptions.InvalidUsage(message=repr(e))
-    db[f'models/{model_name}'] = model
+        try:
+
+            # The features are only copied if the model needs to modify them
+            frozen_features = immutable.freeze(features)
+            mutates = storage.mutating_methods(model_name)
+
+            # Obtain a prediction if none was made earlier
+            flavor = db['flavor']
+            if prediction is None:
+                try:
+                    prediction = immutable.call(
+                        model, flavor.pred_func, frozen_features,
+                        mutates=mutates, on_mutation=record_mutation(model_name)
+                    )
+                except Exception as e:
+                    raise exceptions.InvalidUsage(message=repr(e))
+
+            # Under heavy load, the model might only learn from some of the samples
+            sampler = sampling.get_sampler(flask.current_app.config, flavor)
+            if sampler is None or sampler.keep(
+                payload['ground_truth'],
+                backlog=admission.backlog('learn')
+            ):
+
+                # Update the model
+                def update(model):
+                    immutable.call(
+                        model, 'learn_one', frozen_features,
+                        mutates=mutates,
+                        on_mutation=record_mutation(model_name),
+                        y=payload['ground_truth']
+                    )
+
+                try:
+                    update(model)
+                except Exception as e:
+                    raise exceptions.InvalidUsage(message=repr(e))
+
+                # If another worker updates the model in the meantime, then the update is applied
+                # again to the latest model. A replica is only merged into the shared model every
+                # so often.
+                if replica is None:
+                    storage.commit_model(model_name, model, based_on=version, reapply=update)
+                else:
+                    replica.n_samples += 1
+                    if time.monotonic() - replica.forked_at >= interval:
+                        storage.merge_replica(model_name, replica, weight=1 / learners)
+
+        except Exception:
+            # A shared model isn't left half-updated by an update which failed partway
+            if replica is None:
+                storage.revert_model(model_name)
+            raise
+
+    # The metrics of this worker are only updated once the model has been stored, so that a request
+    # which fails and is retried by the client isn't counted twice
+    storage.update_worker_metrics(payload['ground_truth'], prediction)
+    storage.update_worker_metrics(payload['ground_truth'], prediction, model_name)
+
+    # In shadow mode, every other model learns from the event too
+    if flask.current_app.config['SHADOW_MODE']:
+        with contextlib.ExitStack() as locks:
+            challengers, versions = load_challengers(db, champion=model_name, locks=locks)
+            shadow_learn(
+                challengers=challengers,
+                versions=versions,
+                flavor=flavor,
+                features=features,
+                ground_truth=payload['ground_truth'],
+                predictions=shadow_predictions
+            )
+
+    # Log the event, so that models can be trained on past events later on
+    event_log = events.get_event_log()
+    if event_log is not None:
+        event_log.append({
+            't': time.time(),
+            'model': model_name,
+            'features': features,
+            'ground_truth': payload['ground_truth']
+        })
 
     # Announce the event
     if EVENTS_ANNOUNCER.listeners:
@@ -331,10 +963,8 @@ def learn():
             event='learn'
         ))
 
-    # Announce the current metric values
-    if METRICS_ANNOUNCER.listeners:
-        msg = json.dumps({metric.__class__.__name__: metric.get() for metric in metrics})
-        METRICS_ANNOUNCER.announce(format_sse(data=msg))
+    # Record and announce the current metric values
+    report_metrics(model_name)
 
     # Delete the payload from the db
     if 'id' in payload:
@@ -346,15 +976,159 @@ def learn():
     return {}, 201
 
 
-@bp.route('/metrics', methods=['GET'])
-def metrics():
+BatchSchema = {
+    'items': {'type': 'list', 'required': True, 'schema': {'type': 'dict'}},
+}
+
+
+def run_batch(func: typing.Callable) -> dict:
+    """Process each item of a batch independently. The result of each item contains its status
+    code, as well as either what would have been returned for it or an error message."""
+
+    payload = flask.request.json
+    v = cerberus.Validator(BatchSchema)
+    if not v.validate(payload):
+        raise exceptions.InvalidUsage(message=v.errors)
+    flask.g.n_items = len(payload['items'])
+
+    results = []
+    for item in payload['items']:
+        try:
+            body, status_code = func(item)
+        except exceptions.InvalidUsage as e:
+            body, status_code = e.to_dict(), e.status_code
+        results.append({'status': status_code, **body})
+
+    return {'results': results}
+
+
+def premake_predictions(items: list) -> list:
+    """Make the predictions of a batch in advance, with one call to `make_predictions` per model, so
+    that the predictions for the same model are made together. The items which aren't handled here,
+    such as invalid ones, get `None`, in which case the prediction is made by `predict_one`."""
+
+    db = storage.get_db()
+    default_model_name = db.get('default_model_name')
+
+    # Invalid items are left to predict_one, which reports their errors one by one
+    v = cerberus.Validator(PredictSchema)
+    groups = collections.defaultdict(list)
+    for i, item in enumerate(items):
+        if isinstance(item, dict) and v.validate(item):
+            model_name = item.get('model', default_model_name)
+            if model_name is not None:
+                groups[model_name].append(i)
+
+    preds: list = [None] * len(items)
+    for model_name, positions in groups.items():
+        batch = [resolve_features(db, items[i]['features']) for i in positions]
+        try:
+            made = make_predictions(model_name, batch)
+        except exceptions.InvalidUsage:
+            continue
+        for i, pred in zip(positions, made):
+            preds[i] = pred
+    return preds
+
+
+@bp.route('/batch/predict', methods=['POST'])
+def batch_predict():
+
+    # Cached predictions are looked up one by one
+    items = (flask.request.json or {}).get('items')
+    if prediction_cache() is not None or not isinstance(items, list):
+        return run_batch(predict_one)
+
+    preds = iter(premake_predictions(items))
+    return run_batch(lambda item: predict_one(item, pred=next(preds)))
+
+
+ColumnsSchema = {
+    'items': {
+        'type': 'list',
+        'required': True,
+        'schema': {'anyof': [{'type': 'dict'}, {'type': 'string'}]}
+    },
+    'model': {'type': 'string'},
+}
+
+
+@bp.route('/batch/columns', methods=['POST'])
+def batch_columns():
+    """Lay out a batch of features in columns, along the feature index of a model. The columns of a
+    feature are the same from one batch to the next."""
+
+    payload = flask.request.json
+    v = cerberus.Validator(ColumnsSchema)
+    if not v.validate(payload):
+        raise exceptions.InvalidUsage(message=v.errors)
+
     db = storage.get_db()
     try:
-        metrics = db['metrics']
+        model_name = payload.get('model') or db['default_model_name']
     except KeyError:
+        raise exceptions.InvalidUsage(message='No default model has been set.')
+    if f'models/{model_name}' not in db:
+        raise exceptions.InvalidUsage(message=f"No model named '{model_name}'.")
+
+    batch = [resolve_features(db, features) for features in payload['items']]
+    matrix = index_batch(model_name, batch)
+    if matrix.skipped:
+        raise exceptions.InvalidUsage(
+            message=f'Items {matrix.skipped} are not made of numbers.'
+        )
+
+    X = matrix.dense()
+    return {
+        'names': matrix.names[:X.shape[1]],
+        'columns': [[None if math.isnan(v) else v for v in col] for col in X.T.tolist()]
+    }
+
+
+@bp.route('/batch/learn', methods=['POST'])
+def batch_learn():
+    return run_batch(learn_one)
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    db = storage.get_db()
+
+    # The metrics of a particular model can be requested
+    model_name = flask.request.args.get('model')
+    if model_name is not None and f'models/{model_name}' not in db:
+        raise exceptions.InvalidUsage(message=f"No model named '{model_name}'.")
+
+    # The metrics of each worker are merged together
+    metrics = storage.get_metrics(model_name)
+
+    # The metrics can be computed over all time or over a window of recent samples
+    window = flask.request.args.get('window', 'all')
+    if window not in metrics.windows:
+        allowed = ', '.join(f"'{w}'" for w in metrics.windows)
+        raise exceptions.InvalidUsage(
+            message=f"Unknown window '{window}'. Allowed windows are {allowed}."
+        )
+
+    return metrics.get(window)
+
+
+@bp.route('/metrics/history', methods=['GET'])
+def metrics_history():
+    """Return the history of the metrics. The history is kept in memory by each process rather than
+    in the storage backend, so it is lost on restart, and it only covers the times when the process
+    which handles the request was learning."""
+    db = storage.get_db()
+    if 'flavor' not in db:
         raise exceptions.FlavorNotSet
 
-    return {metric.__class__.__name__: metric.get() for metric in metrics}
+    args = flask.request.args
+    return METRICS_HISTORY.query(
+        model=args.get('model'),
+        start=args.get('start', type=float),
+        end=args.get('end', type=float),
+        resolution=args.get('resolution', type=float)
+    )
 
 
 @bp.route('/stream/metrics', methods=['GET'])
@@ -403,23 +1177,57 @@ def humanize_ns(ns: int) -> str:
 @bp.route('/stats', methods=['GET'])
 def stats():
     db = storage.get_db()
-    try:
-        stats = db['stats']
-    except KeyError:
+    if 'flavor' not in db:
         raise exceptions.InvalidUsage(message='No flavor has been set.')
-    return {
-        'predict': {
-            'n_calls': int(stats['predict_mean'].n),
-            'mean_duration': int(stats['predict_mean'].get()),
-            'mean_duration_human': humanize_ns(int(stats['predict_mean'].get())),
-            'ewm_duration': int(stats['predict_ewm'].get()),
-            'ewm_duration_human': humanize_ns(int(stats['predict_ewm'].get()))
-        },
-        'learn': {
-            'n_calls': int(stats['learn_mean'].n),
-            'mean_duration': int(stats['learn_mean'].get()),
-            'mean_duration_human': humanize_ns(int(stats['learn_mean'].get())),
-            'ewm_duration': int(stats['learn_ewm'].get()),
-            'ewm_duration_human': humanize_ns(int(stats['learn_ewm'].get()))
+
+    body = {}
+    for endpoint in ('predict', 'learn'):
+        stats = storage.get_stats(endpoint)
+        body[endpoint] = {
+            'n_calls': int(stats['n_calls']),
+            'mean_duration': int(stats['mean_duration']),
+            'mean_duration_human': humanize_ns(int(stats['mean_duration'])),
+            'ewm_duration': int(stats['ewm_duration']),
+            'ewm_duration_human': humanize_ns(int(stats['ewm_duration']))
         }
+
+    cache = prediction_cache()
+    if cache is not None:
+        body['prediction_cache'] = {'hits': cache.hits, 'misses': cache.misses, 'size': len(cache)}
+
+    coalescer = prediction_coalescer()
+    if coalescer is not None:
+        body['prediction_batches'] = coalescer.stats()
+
+    config = flask.current_app.config
+    if float(config['LATENCY_SLO']) or any(
+        int(config[f'{endpoint.upper()}_CONCURRENCY']) for endpoint in admission.ENDPOINTS
+    ):
+        body['admission'] = admission.stats()
+
+    sampler = sampling.get_sampler(config, db['flavor'])
+    if sampler is not None:
+        body['learn_sampling'] = sampler.stats()
+
+    recent_keys = dedup.recent_keys(config, r=storage.redis_client())
+    if recent_keys is not None:
+        body['idempotency'] = recent_keys.stats()
+
+    if config['COMPILED_MODELS']:
+        body['compiled_models'] = compiling.stats()
+
+    indexes = columns.stats()
+    if indexes:
+        body['feature_indexes'] = indexes
+
+    counters = db.counters('counters')
+    body['updates'] = {
+        'conflicts': counters.get('update_conflicts', 0),
+        'retries': counters.get('update_retries', 0)
     }
+
+    manager = storage.model_manager()
+    if manager is not None:
+        body['models'] = manager.stats()
+
+    return body
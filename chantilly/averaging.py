@@ -0,0 +1,190 @@
+import atexit
+import copy
+import os
+import threading
+import time
+import typing
+
+from river import compose
+from river import linear_model
+from river import preprocessing
+
+
+def supports(model) -> bool:
+    """Whether the updates made to a model can be merged into another model.
+
+    >>> supports(preprocessing.StandardScaler() | linear_model.LinearRegression())
+    True
+    >>> supports(preprocessing.MinMaxScaler() | linear_model.LinearRegression())
+    False
+
+    """
+    if isinstance(model, compose.Pipeline):
+        return all(supports(step) for step in model.steps.values())
+    if isinstance(model, linear_model.base.GLM):
+        return True
+    if isinstance(model, preprocessing.StandardScaler):
+        return model.window_size is None
+    return False
+
+
+def merge_delta(target, base, replica, weight: float):
+    """Apply to `target` the updates that turned `base` into `replica`.
+
+    The weights of linear models are moved by `weight` times the difference between `replica` and
+    `base`. If several replicas which were copied from the same model each merge their updates with
+    a `weight` of 1 over the number of replicas, then the result is the average of the replicas.
+    The statistics of a `StandardScaler` are merged exactly, regardless of `weight`.
+
+    """
+
+    if isinstance(target, compose.Pipeline):
+        for name, step in target.steps.items():
+            merge_delta(step, base[name], replica[name], weight)
+
+    elif isinstance(target, linear_model.base.GLM):
+        for feature in set(replica._weights.keys()) | set(base._weights.keys()):
+            delta = replica._weights.get(feature, 0.) - base._weights.get(feature, 0.)
+            target._weights[feature] = target._weights.get(feature, 0.) + weight * delta
+        target.intercept += weight * (replica.intercept - base.intercept)
+        target.optimizer.n_iterations += (
+            replica.optimizer.n_iterations - base.optimizer.n_iterations
+        )
+
+    elif isinstance(target, preprocessing.StandardScaler):
+        for feature, n_replica in replica.counts.items():
+
+            # Recover the statistics of the samples the replica has seen since it was copied
+            n_base = base.counts.get(feature, 0)
+            n = n_replica - n_base
+            if n <= 0:
+                continue
+            mean_base, mean_replica = base.means.get(feature, 0.), replica.means[feature]
+            mean = (mean_replica * n_replica - mean_base * n_base) / n
+            m2 = (
+                replica.vars[feature] * n_replica - base.vars.get(feature, 0.) * n_base -
+                (mean - mean_base) ** 2 * n_base * n / n_replica
+            )
+
+            # Combine them with the statistics of the target
+            n_target = target.counts.get(feature, 0)
+            mean_target = target.means.get(feature, 0.)
+            total = n_target + n
+            delta = mean - mean_target
+            m2 += target.vars.get(feature, 0.) * n_target + delta ** 2 * n_target * n / total
+            target.counts[feature] = total
+            target.means[feature] = mean_target + delta * n / total
+            target.vars[feature] = m2 / total
+
+    else:
+        raise TypeError(f'Updates to {type(target).__name__} models cannot be merged')
+
+
+class Replica:
+    """Copy of a model which a process learns from on its own, before merging its updates into the
+    shared model.
+
+    Parameters:
+        model: The shared model, which is copied.
+        version: The version of the shared model.
+        generation: The generation of the shared model, which changes when the model is replaced.
+
+    """
+
+    def __init__(self, model, version: typing.Optional[str], generation: typing.Optional[str]):
+        self.lock = threading.Lock()
+        self.reset(model, version, generation)
+
+    def reset(self, model, version: typing.Optional[str], generation: typing.Optional[str]):
+        """Start over from the current state of the shared model."""
+        self.base = copy.deepcopy(model)
+        self.model = copy.deepcopy(model)
+        self.version = version
+        self.generation = generation
+        self.n_samples = 0
+        self.forked_at = time.monotonic()
+
+    def merge_into(self, model, weight: float):
+        merge_delta(model, self.base, self.model, weight)
+
+
+# The replicas of the current process, indexed by model name. Models which aren't supported are
+# recorded with None.
+_REPLICAS: typing.Dict[str, typing.Optional[Replica]] = {}
+_lock = threading.Lock()
+
+
+def get_replica(name: str, checkout: typing.Callable) -> typing.Optional[Replica]:
+    """Return the replica of a model, creating it from the model, version, and generation returned
+    by `checkout` if there is none. Returns `None` if the model is not supported."""
+    with _lock:
+        if name not in _REPLICAS:
+            model, version, generation = checkout(name)
+            _REPLICAS[name] = Replica(model, version, generation) if supports(model) else None
+        return _REPLICAS[name]
+
+
+def replicas() -> typing.List[typing.Tuple[str, Replica]]:
+    """Return the replicas of the current process along with the names of their models."""
+    with _lock:
+        return [(name, replica) for name, replica in _REPLICAS.items() if replica is not None]
+
+
+# The function which merges the replicas of the current process, along with the number of seconds
+# after which a replica is merged
+_MERGE: typing.Optional[typing.Tuple[typing.Callable[[float], typing.Any], float]] = None
+_MERGER_PID: typing.Optional[int] = None
+_RESCHEDULED = threading.Event()
+
+
+def schedule_merges(merge: typing.Callable[[float], typing.Any], interval: float):
+    """Have the replicas merged even if the process stops learning.
+
+    `merge` is given a number of seconds, and is expected to merge the replicas which were forked
+    at least that long ago. It is called from a background thread with `interval`, and with 0 when
+    the process exits. Only the latest `merge` and `interval` are used.
+
+    """
+    global _MERGE, _MERGER_PID
+    with _lock:
+        if _MERGE is None or _MERGE[1] != interval:
+            _RESCHEDULED.set()
+        _MERGE = (merge, interval)
+        if _MERGER_PID != os.getpid():
+            _MERGER_PID = os.getpid()
+            threading.Thread(target=_merge_loop, daemon=True).start()
+
+
+def _merge_loop():
+    """Look for replicas to merge every second, or more often if the interval is shorter."""
+    while True:
+        scheduled = _MERGE
+        timeout = min(scheduled[1], 1.) if scheduled is not None and scheduled[1] > 0 else 1.
+        if _RESCHEDULED.wait(timeout):
+            _RESCHEDULED.clear()
+            continue
+        scheduled = _MERGE
+        if scheduled is not None and scheduled[1] > 0:
+            merge, interval = scheduled
+            merge(interval)
+
+
+@atexit.register
+def _merge_at_exit():
+    scheduled = _MERGE
+    if scheduled is not None and _MERGER_PID == os.getpid():
+        merge, _ = scheduled
+        merge(0.)
+
+
+def forget(name: str):
+    """Drop the replica of a model, which is necessary when the model is replaced."""
+    with _lock:
+        _REPLICAS.pop(name, None)
+
+
+def clear():
+    global _MERGE
+    with _lock:
+        _REPLICAS.clear()
+        _MERGE = None
@@ -0,0 +1,97 @@
+import concurrent.futures
+import threading
+import time
+import typing
+
+from river import stats
+
+
+class Coalescer:
+    """Groups the calls that are made concurrently for the same key, and processes them at once.
+
+    The first call for a key waits for other calls to join it, and then processes all of them with
+    `func`, on behalf of the others. It stops waiting once `max_size` calls have joined, once it has
+    waited for `max_wait` seconds, or once no call has joined for twice the usual time between two
+    calls. The latter means that calls barely wait when they arrive sparsely.
+
+    Parameters:
+        func: Function which is given a key and a list of items. It returns a list with a result
+            for each item, which is raised instead of returned if it is an exception.
+        max_wait: Maximum number of seconds a call may wait for others to join it.
+        max_size: Maximum number of calls that are processed at once.
+
+    >>> coalescer = Coalescer(lambda key, items: [key * item for item in items], .001, 8)
+    >>> coalescer.submit(2, 21)
+    42
+
+    """
+
+    def __init__(self, func: typing.Callable, max_wait: float, max_size: int):
+        self.func = func
+        self.max_wait = max_wait
+        self.max_size = max_size
+        self.n_batches = 0
+        self.n_items = 0
+        self._pending: typing.Dict[typing.Hashable, list] = {}
+        self._gaps: typing.Dict[typing.Hashable, stats.EWMean] = {}
+        self._last_arrival: typing.Dict[typing.Hashable, float] = {}
+        self._cond = threading.Condition()
+
+    def submit(self, key: typing.Hashable, item):
+        """Process an item along with the items submitted concurrently for the same key, and return
+        its result."""
+
+        future: concurrent.futures.Future = concurrent.futures.Future()
+
+        with self._cond:
+            now = time.monotonic()
+            gap = self._gaps.setdefault(key, stats.EWMean(.2))
+            if key in self._last_arrival:
+                gap.update(now - self._last_arrival[key])
+            self._last_arrival[key] = now
+
+            batch = self._pending.get(key)
+            if batch is not None and len(batch) < self.max_size:
+                batch.append((item, future))
+                self._cond.notify_all()
+                leader = False
+            else:
+                batch = self._pending[key] = [(item, future)]
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        # Wait for other calls to join, as long as they're expected to arrive soon enough
+        with self._cond:
+            deadline = now + self.max_wait
+            while len(batch) < self.max_size:
+                timeout = min(2 * gap.get(), deadline - time.monotonic())
+                if timeout <= 0:
+                    break
+                n = len(batch)
+                self._cond.wait(timeout)
+                if len(batch) == n:
+                    break
+            if self._pending.get(key) is batch:
+                del self._pending[key]
+            self.n_batches += 1
+            self.n_items += len(batch)
+
+        try:
+            results = self.func(key, [item for item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, f), result in zip(batch, results):
+            if isinstance(result, Exception):
+                f.set_exception(result)
+            else:
+                f.set_result(result)
+
+        return future.result()
+
+    def stats(self) -> dict:
+        return {
+            'n_batches': self.n_batches,
+            'mean_batch_size': self.n_items / (self.n_batches or 1)
+        }
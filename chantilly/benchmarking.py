@@ -0,0 +1,166 @@
+"""Measures the latency and the throughput of the storage backends, so that they can be compared."""
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import threading
+import time
+import typing
+
+from river import linear_model
+from river import preprocessing
+import dill
+
+from . import storage
+
+OPERATIONS = ('set', 'get', 'iterate', 'delete')
+
+# The prefix of the keys which are written, so that they can be removed from a database in use
+PREFIX = 'bench/'
+
+
+def backend_config(config, backend: str, directory: str) -> dict:
+    """Return a copy of a configuration which points to a scratch database."""
+    config = dict(config)
+    config['STORAGE_BACKEND'] = backend
+    config['SHELVE_PATH'] = os.path.join(directory, 'shelve')
+    config['MEMORY_PATH'] = os.path.join(directory, 'memory')
+    return config
+
+
+def default_model() -> bytes:
+    return dill.dumps(preprocessing.StandardScaler() | linear_model.LinearRegression())
+
+
+def default_payload() -> dict:
+    return {'features': {f'x{i}': float(i) for i in range(10)}, 'ground_truth': 1.}
+
+
+def _summarize(latencies: typing.List[float], duration: float) -> dict:
+    latencies = sorted(latencies)
+    quantile = lambda q: latencies[max(int(q * len(latencies)) - 1, 0)] * 1e6
+    return {
+        'n_ops': len(latencies),
+        'throughput': len(latencies) / duration,
+        'p50': quantile(.5),
+        'p99': quantile(.99)
+    }
+
+
+def _run(config: dict, concurrency: int, work: typing.Callable[..., typing.Iterable[float]]):
+    """Run `work` in `concurrency` threads, each with its own handle to the backend, and summarize
+    the latencies it yields."""
+
+    barrier = threading.Barrier(concurrency)
+
+    def worker(w):
+        db = storage.open_db(config)
+        try:
+            barrier.wait()
+            return list(work(db, w))
+        finally:
+            db.close()
+
+    tic = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(concurrency)))
+    duration = time.perf_counter() - tic
+
+    return _summarize([latency for latencies in results for latency in latencies], duration)
+
+
+def _timed(func: typing.Callable, n: int) -> typing.Iterator[float]:
+    for i in range(n):
+        tic = time.perf_counter()
+        func(i)
+        yield time.perf_counter() - tic
+
+
+def bench_operations(config: dict, size: int, concurrency: int, n_ops: int) -> dict:
+    """Measure each basic operation, with values of `size` bytes."""
+
+    blob = os.urandom(size)
+    key = lambda w, i: f'{PREFIX}{w}/{i}'
+
+    work = {
+        'set': lambda db, w: _timed(lambda i: db.set_raw(key(w, i), blob), n_ops),
+        'get': lambda db, w: _timed(lambda i: db.get_raw(key(w, i)), n_ops),
+        'iterate': lambda db, w: _timed(lambda i: sum(1 for _ in db), max(n_ops // 20, 1)),
+        'delete': lambda db, w: _timed(lambda i: db.__delitem__(key(w, i)), n_ops)
+    }
+    return {op: _run(config, concurrency, work[op]) for op in OPERATIONS}
+
+
+def bench_learn(config: dict, model: bytes, payload: dict, concurrency: int, n_ops: int) -> dict:
+    """Measure the accesses made by a learning request which follows a prediction: the features are
+    stored and read back, the model is loaded, updated and stored, the counters are incremented,
+    and the features are deleted."""
+
+    db = storage.open_db(config)
+    db.set_raw(f'{PREFIX}model', model)
+    db.close()
+
+    def learn(db, w, i):
+        db[f'#{PREFIX}{w}/{i}'] = {'features': payload['features'], 'prediction': None}
+        memory = db[f'#{PREFIX}{w}/{i}']
+        model = dill.loads(db.get_raw(f'{PREFIX}model'))
+        model.learn_one(memory['features'], payload['ground_truth'])
+        db.set_raw(f'{PREFIX}model', dill.dumps(model))
+        db.incr(f'{PREFIX}counters', {'learn_calls': 1})
+        del db[f'#{PREFIX}{w}/{i}']
+
+    return _run(config, concurrency, lambda db, w: _timed(lambda i: learn(db, w, i), n_ops))
+
+
+def _cleanup(config: dict):
+    if config['STORAGE_BACKEND'] == 'memory':
+        storage.MemoryBackend.drop(config['MEMORY_PATH'])
+    elif config['STORAGE_BACKEND'] == 'redis':
+        db = storage.open_db(config)
+        for key in list(db):
+            if key.startswith(PREFIX) or key.startswith(f'#{PREFIX}'):
+                del db[key]
+        db.close()
+
+
+def bench_storage(config, backends: typing.Iterable[str], sizes: typing.Iterable[int],
+                  concurrencies: typing.Iterable[int], n_ops: int,
+                  model: typing.Optional[bytes] = None,
+                  payload: typing.Optional[dict] = None) -> typing.List[dict]:
+    """Benchmark storage backends, and return one row per backend, operation, size, and number of
+    threads. Latencies are in microseconds, and throughputs in operations per second.
+
+    The shelve backend can't be used by several threads at once, so it is only measured with one.
+    The Redis backend is measured with the configured database, and the keys which are written are
+    removed afterwards.
+
+    """
+
+    model = model or default_model()
+    payload = payload or default_payload()
+    rows = []
+
+    for backend in backends:
+        for concurrency in concurrencies:
+            if backend == 'shelve' and concurrency > 1:
+                continue
+
+            directory = tempfile.mkdtemp()
+            cfg = backend_config(config, backend, directory)
+            try:
+                for size in sizes:
+                    for op, summary in bench_operations(cfg, size, concurrency, n_ops).items():
+                        rows.append({
+                            'backend': backend, 'operation': op, 'size': size,
+                            'concurrency': concurrency, **summary
+                        })
+                summary = bench_learn(cfg, model, payload, concurrency, n_ops)
+                rows.append({
+                    'backend': backend, 'operation': 'learn', 'size': len(model),
+                    'concurrency': concurrency, **summary
+                })
+            finally:
+                _cleanup(cfg)
+                shutil.rmtree(directory, ignore_errors=True)
+
+    return rows
@@ -1,7 +1,15 @@
+import concurrent.futures
+import json
+import os
+
 import click
 import dill
 import flask
 
+from . import benchmarking
+from . import evaluation
+from . import events
+from . import exceptions
 from . import storage
 
 
@@ -37,3 +45,165 @@ def add_model(path, name):
 def delete_model(name):
     storage.delete_model(name)
     click.echo(f'{name} has been deleted')
+
+
+@click.command('replay', short_help='train models on the event log')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--source', type=str, default=None, help='Only use the events of this model.')
+@click.option('--batch-size', type=int, default=512, help='Use 1 to replay events one by one.')
+@click.option('--workers', type=int, default=None, help='Number of processes.')
+@click.option('--events', 'directory', type=click.Path(file_okay=False), default=None,
+              help='Defaults to EVENT_LOG_DIR.')
+@flask.cli.with_appcontext
+def replay(paths, source, batch_size, workers, directory):
+    """Trains pickled/dilled models on the logged learning events and stores them.
+
+    Each model is named after its file, without the extension. Models are trained in parallel, each
+    in its own process.
+
+    """
+
+    directory = directory or flask.current_app.config.get('EVENT_LOG_DIR')
+    if not directory:
+        raise click.UsageError('No event log directory was given and EVENT_LOG_DIR is not set.')
+
+    blobs = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            blobs.append(f.read())
+    args = ([directory] * len(blobs), [source] * len(blobs), [batch_size] * len(blobs))
+
+    if len(blobs) > 1 and workers != 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            trained = list(pool.map(events._learn_from_log, blobs, *args))
+    else:
+        trained = list(map(events._learn_from_log, blobs, *args))
+
+    for path, blob in zip(paths, trained):
+        name = os.path.splitext(os.path.basename(path))[0]
+        storage.add_model(model=dill.loads(blob), name=name)
+        click.echo(f'{name} has been trained and stored')
+
+
+@click.command('evaluate', short_help='evaluate models on past events')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--source', type=str, default=None, help='Only use the events of this model.')
+@click.option('--events', 'directory', type=click.Path(file_okay=False), default=None,
+              help='Defaults to EVENT_LOG_DIR.')
+@click.option('--dataset', type=str, default=None,
+              help='Name of a river dataset to use instead of the event log.')
+@click.option('--limit', type=int, default=None, help='Maximum number of samples.')
+@click.option('--flavor', type=str, default=None, help='Defaults to the current flavor.')
+@click.option('--workers', type=int, default=None, help='Number of processes.')
+@click.option('--json', 'as_json', is_flag=True, help='Output JSON instead of a table.')
+@flask.cli.with_appcontext
+def evaluate(paths, source, directory, dataset, limit, flavor, workers, as_json):
+    """Evaluates pickled/dilled models with progressive validation.
+
+    Each model makes a prediction for each sample before learning from it. The models are not
+    stored, and are each evaluated in a separate process.
+
+    """
+
+    if flavor is None:
+        try:
+            flavor = storage.get_db()['flavor'].name
+        except KeyError:
+            raise click.UsageError(exceptions.FlavorNotSet().message)
+
+    directory = directory or flask.current_app.config.get('EVENT_LOG_DIR')
+    if dataset is None and not directory:
+        raise click.UsageError('No dataset or event log directory was given and EVENT_LOG_DIR is not set.')
+
+    blobs = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            blobs.append(f.read())
+    n = len(blobs)
+    args = ([flavor] * n, [directory] * n, [source] * n, [dataset] * n, [limit] * n)
+
+    if n > 1 and workers != 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            reports = list(pool.map(evaluation._evaluate, blobs, *args))
+    else:
+        reports = list(map(evaluation._evaluate, blobs, *args))
+
+    names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+
+    if as_json:
+        click.echo(json.dumps(dict(zip(names, reports)), indent=4))
+        return
+
+    columns = ['model', 'samples', *reports[0]['metrics'], 'predict/s', 'learn/s']
+    rows = [
+        [
+            name,
+            str(report['n_samples']),
+            *(f'{value:.4f}' for value in report['metrics'].values()),
+            f"{report['predict_throughput']:,.0f}",
+            f"{report['learn_throughput']:,.0f}"
+        ]
+        for name, report in zip(names, reports)
+    ]
+    widths = [max(len(cell) for cell in column) for column in zip(columns, *rows)]
+    for row in [columns, *rows]:
+        click.echo('  '.join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+@click.command('bench-storage', short_help='compare the storage backends')
+@click.option('--backend', 'backends', multiple=True, type=click.Choice(['shelve', 'memory', 'redis']),
+              help='Defaults to shelve and memory.')
+@click.option('--size', 'sizes', multiple=True, type=int,
+              help='Size of the stored values, in bytes. Defaults to 1KB, 100KB, and 1MB.')
+@click.option('--concurrency', 'concurrencies', multiple=True, type=int,
+              help='Number of threads. Defaults to 1 and 8.')
+@click.option('--ops', 'n_ops', type=int, default=200, help='Number of operations per thread.')
+@click.option('--model', 'model_file', type=click.File('rb'), default=None,
+              help='A pickled/dilled model to learn with. Defaults to a linear regression.')
+@click.option('--payload', 'payload_file', type=click.File('r'), default=None,
+              help='JSON file with the features and the ground truth of a learning request.')
+@click.option('--json', 'as_json', is_flag=True, help='Output JSON instead of a table.')
+@click.option('--output', type=click.File('w'), default=None, help='Also write JSON to a file.')
+@flask.cli.with_appcontext
+def bench_storage(backends, sizes, concurrencies, n_ops, model_file, payload_file, as_json, output):
+    """Measures the latency and the throughput of the storage backends.
+
+    Values of each size are set, read, and deleted, and the keys are iterated over. The accesses
+    made by a learning request are also measured, with the given model and payload. The shelve and
+    in-memory backends use a scratch database, whereas Redis uses the configured one.
+
+    """
+
+    rows = benchmarking.bench_storage(
+        config=flask.current_app.config,
+        backends=backends or ('shelve', 'memory'),
+        sizes=sizes or (1_000, 100_000, 1_000_000),
+        concurrencies=concurrencies or (1, 8),
+        n_ops=n_ops,
+        model=model_file.read() if model_file else None,
+        payload=json.load(payload_file) if payload_file else None
+    )
+
+    if output is not None:
+        json.dump(rows, output, indent=4)
+
+    if as_json:
+        click.echo(json.dumps(rows, indent=4))
+        return
+
+    columns = ['backend', 'operation', 'size', 'threads', 'ops/s', 'p50 (µs)', 'p99 (µs)']
+    table = [
+        [
+            row['backend'],
+            row['operation'],
+            f"{row['size']:,}",
+            str(row['concurrency']),
+            f"{row['throughput']:,.0f}",
+            f"{row['p50']:,.1f}",
+            f"{row['p99']:,.1f}"
+        ]
+        for row in rows
+    ]
+    widths = [max(len(cell) for cell in column) for column in zip(columns, *table)]
+    for row in [columns, *table]:
+        click.echo('  '.join(cell.rjust(width) for cell, width in zip(row, widths)))
@@ -0,0 +1,347 @@
+"""Python client for a chantilly server.
+
+`Client` reuses its connections to the server instead of opening a new one for each call, and
+`AsyncClient` does the same for asyncio applications. Both of them can also group the calls that
+are made within a few milliseconds of each other, and send them in a single request to the batch
+endpoints. Each call then returns a future, which is resolved once the batch has been processed.
+
+"""
+import asyncio
+import concurrent.futures
+import queue
+import threading
+import time
+import typing
+
+import dill
+
+try:
+    import httpx
+except ImportError:
+    httpx = None  # type: ignore
+
+
+class ChantillyError(Exception):
+    """Raised when the server rejects a call.
+
+    Parameters:
+        status_code: The HTTP status code of the response.
+        message: The error message returned by the server.
+
+    """
+
+    def __init__(self, status_code: int, message):
+        super().__init__(f'{status_code}: {message}')
+        self.status_code = status_code
+        self.message = message
+
+
+def _predict_payload(features, id=None, model=None) -> dict:
+    payload = {'features': features}
+    if id is not None:
+        payload['id'] = id
+    if model is not None:
+        payload['model'] = model
+    return payload
+
+
+def _learn_payload(ground_truth, features=None, id=None, model=None, prediction=None) -> dict:
+    payload = {'ground_truth': ground_truth}
+    if features is not None:
+        payload['features'] = features
+    if id is not None:
+        payload['id'] = id
+    if model is not None:
+        payload['model'] = model
+    if prediction is not None:
+        payload['prediction'] = prediction
+    return payload
+
+
+def _unwrap(response) -> dict:
+    try:
+        body = response.json() if response.content else {}
+    except ValueError:  # such as the HTML error page of a proxy
+        body = {'message': response.text}
+    if response.is_error:
+        raise ChantillyError(response.status_code, body.get('message', response.reason_phrase))
+    return body
+
+
+def _unwrap_item(result: dict) -> dict:
+    status_code = result.pop('status')
+    if status_code >= 400:
+        raise ChantillyError(status_code, result.get('message'))
+    return result
+
+
+def _check_httpx():
+    if httpx is None:
+        raise ImportError('httpx is required for the client, please run pip install httpx')
+
+
+class Client:
+    """Synchronous client, which keeps its connections to the server alive.
+
+    A client is thread-safe. With `batch_size` greater than 1, `predict` and `learn` return a
+    `concurrent.futures.Future` instead of a result. The calls are buffered by a background thread,
+    and are sent once `batch_size` calls have been made, or once the oldest one has been waiting
+    for `batch_wait` seconds. The calls to `predict` are sent before the calls to `learn` from the
+    same batch.
+
+    Parameters:
+        url: The address of the server.
+        timeout: Number of seconds after which a request is abandoned.
+        max_connections: Maximum number of connections kept open at the same time.
+        batch_size: Maximum number of calls sent at once. Calls are sent one by one by default.
+        batch_wait: Maximum number of seconds a call waits for others to be batched with.
+        transport: An `httpx` transport, which is useful for testing.
+
+    """
+
+    def __init__(self, url='http://localhost:5000', timeout=5., max_connections=10,
+                 batch_size=1, batch_wait=.005, transport=None):
+        _check_httpx()
+        self.http = httpx.Client(
+            base_url=url,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            ),
+            transport=transport
+        )
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: typing.Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def init(self, flavor: str):
+        return _unwrap(self.http.post('/api/init', json={'flavor': flavor}))
+
+    def upload_model(self, model, name: typing.Optional[str] = None) -> str:
+        """Upload a model and return its name."""
+        path = '/api/model' if name is None else f'/api/model/{name}'
+        return _unwrap(self.http.post(path, content=dill.dumps(model)))['name']
+
+    def download_model(self, name: typing.Optional[str] = None):
+        path = '/api/model' if name is None else f'/api/model/{name}'
+        response = self.http.get(path)
+        if response.is_error:
+            _unwrap(response)
+        return dill.loads(response.content)
+
+    def metrics(self, model: typing.Optional[str] = None) -> dict:
+        return _unwrap(self.http.get('/api/metrics', params={'model': model} if model else None))
+
+    def predict(self, features, id=None, model=None):
+        payload = _predict_payload(features, id=id, model=model)
+        if self.batch_size > 1:
+            return self._submit('predict', payload)
+        return _unwrap(self.http.post('/api/predict', json=payload))
+
+    def learn(self, ground_truth, features=None, id=None, model=None, prediction=None):
+        payload = _learn_payload(ground_truth, features, id=id, model=model, prediction=prediction)
+        if self.batch_size > 1:
+            return self._submit('learn', payload)
+        return _unwrap(self.http.post('/api/learn', json=payload))
+
+    def predict_many(self, payloads: typing.List[dict]) -> typing.List[dict]:
+        """Send several prediction payloads in one request. Each result contains the status code
+        of its item."""
+        body = _unwrap(self.http.post('/api/batch/predict', json={'items': payloads}))
+        return body['results']
+
+    def learn_many(self, payloads: typing.List[dict]) -> typing.List[dict]:
+        """Send several learning payloads in one request. Each result contains the status code of
+        its item."""
+        body = _unwrap(self.http.post('/api/batch/learn', json={'items': payloads}))
+        return body['results']
+
+    def _submit(self, kind: str, payload: dict) -> concurrent.futures.Future:
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._queue.put((kind, payload, future))
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+
+            # Wait for more calls, until the batch is full or the first call has waited enough
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # stop once the batch has been sent
+                    break
+                batch.append(item)
+
+            for kind, send in (('predict', self.predict_many), ('learn', self.learn_many)):
+                calls = [(payload, future) for k, payload, future in batch if k == kind]
+                if calls:
+                    self._send(send, calls)
+
+    @staticmethod
+    def _send(send: typing.Callable, calls: list):
+        try:
+            results = send([payload for payload, _ in calls])
+        except Exception as e:
+            for _, future in calls:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(calls, results):
+            try:
+                future.set_result(_unwrap_item(result))
+            except ChantillyError as e:
+                future.set_exception(e)
+
+    def close(self):
+        """Send the calls that are waiting to be batched, and close the connections."""
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+        self.http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncClient:
+    """Asynchronous client, which keeps its connections to the server alive.
+
+    The methods are coroutines, and are otherwise the same as those of `Client`. With `batch_size`
+    greater than 1, the calls to `predict` and `learn` are batched by a background task, and are
+    resolved once their batch has been processed.
+
+    Parameters:
+        url: The address of the server.
+        timeout: Number of seconds after which a request is abandoned.
+        max_connections: Maximum number of connections kept open at the same time.
+        batch_size: Maximum number of calls sent at once. Calls are sent one by one by default.
+        batch_wait: Maximum number of seconds a call waits for others to be batched with.
+        transport: An asynchronous `httpx` transport, which is useful for testing.
+
+    """
+
+    def __init__(self, url='http://localhost:5000', timeout=5., max_connections=10,
+                 batch_size=1, batch_wait=.005, transport=None):
+        _check_httpx()
+        self.http = httpx.AsyncClient(
+            base_url=url,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            ),
+            transport=transport
+        )
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._queue: typing.Optional[asyncio.Queue] = None
+        self._task: typing.Optional[asyncio.Task] = None
+
+    async def init(self, flavor: str):
+        return _unwrap(await self.http.post('/api/init', json={'flavor': flavor}))
+
+    async def upload_model(self, model, name: typing.Optional[str] = None) -> str:
+        path = '/api/model' if name is None else f'/api/model/{name}'
+        return _unwrap(await self.http.post(path, content=dill.dumps(model)))['name']
+
+    async def metrics(self, model: typing.Optional[str] = None) -> dict:
+        params = {'model': model} if model else None
+        return _unwrap(await self.http.get('/api/metrics', params=params))
+
+    async def predict(self, features, id=None, model=None):
+        payload = _predict_payload(features, id=id, model=model)
+        if self.batch_size > 1:
+            return await self._submit('predict', payload)
+        return _unwrap(await self.http.post('/api/predict', json=payload))
+
+    async def learn(self, ground_truth, features=None, id=None, model=None, prediction=None):
+        payload = _learn_payload(ground_truth, features, id=id, model=model, prediction=prediction)
+        if self.batch_size > 1:
+            return await self._submit('learn', payload)
+        return _unwrap(await self.http.post('/api/learn', json=payload))
+
+    async def predict_many(self, payloads: typing.List[dict]) -> typing.List[dict]:
+        body = _unwrap(await self.http.post('/api/batch/predict', json={'items': payloads}))
+        return body['results']
+
+    async def learn_many(self, payloads: typing.List[dict]) -> typing.List[dict]:
+        body = _unwrap(await self.http.post('/api/batch/learn', json={'items': payloads}))
+        return body['results']
+
+    async def _submit(self, kind: str, payload: dict):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.ensure_future(self._run())
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((kind, payload, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+
+            loop = asyncio.get_event_loop()
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    item = await asyncio.wait_for(
+                        self._queue.get(),
+                        timeout=max(deadline - loop.time(), 0)
+                    )
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    self._queue.put_nowait(None)
+                    break
+                batch.append(item)
+
+            for kind, send in (('predict', self.predict_many), ('learn', self.learn_many)):
+                calls = [(payload, future) for k, payload, future in batch if k == kind]
+                if not calls:
+                    continue
+                try:
+                    results = await send([payload for payload, _ in calls])
+                except Exception as e:
+                    for _, future in calls:
+                        future.set_exception(e)
+                    continue
+                for (_, future), result in zip(calls, results):
+                    try:
+                        future.set_result(_unwrap_item(result))
+                    except ChantillyError as e:
+                        future.set_exception(e)
+
+    async def close(self):
+        if self._queue is not None and self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._queue = self._task = None
+        await self.http.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,186 @@
+"""Feature indexes, which turn batches of features into matrices.
+
+Each model has an index which gives a column to each feature name. The index only ever grows, so
+that the columns of a feature stay the same from one batch to the next. It is stored along with the
+model, so that it survives restarts and is shared by the other processes. The stored order is the
+one which counts: a process which stores new names adopts the order of the stored index, to which
+its new names are appended.
+
+"""
+import operator
+import threading
+import typing
+
+import numpy as np
+
+
+# The types of the values which can be put in a matrix
+_NUMBERS = {int, float, bool}
+
+
+class Matrix(typing.NamedTuple):
+    """A batch of features in coordinate format.
+
+    Parameters:
+        rows: Row of each value.
+        cols: Column of each value.
+        values: The values.
+        shape: Number of rows and columns.
+        skipped: The rows which are left empty because they aren't made of numbers.
+        names: The names of the index the matrix was built with. Its first `shape[1]` names are
+            the ones of the columns.
+
+    """
+
+    rows: np.ndarray
+    cols: np.ndarray
+    values: np.ndarray
+    shape: typing.Tuple[int, int]
+    skipped: typing.List[int]
+    names: typing.List[str]
+
+    def dense(self) -> np.ndarray:
+        """Return the batch as a dense matrix, in which missing values are NaNs."""
+        X = np.full(self.shape, np.nan)
+        X[self.rows, self.cols] = self.values
+        return X
+
+
+class FeatureIndex:
+    """Column of each feature name, which grows as new names show up.
+
+    Parameters:
+        names: The names which are already indexed, in column order.
+
+    >>> index = FeatureIndex()
+    >>> index.matrix([{'a': 1, 'b': 2}, {'b': 3, 'c': 4}]).dense()
+    array([[ 1.,  2., nan],
+           [nan,  3.,  4.]])
+    >>> index.names
+    ['a', 'b', 'c']
+    >>> index.unseen_rate
+    0.75
+
+    """
+
+    def __init__(self, names: typing.Iterable[str] = ()):
+        self.names = list(names)
+        self.positions = {name: pos for pos, name in enumerate(self.names)}
+        self.n_lookups = 0
+        self.n_unseen = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def unseen_rate(self) -> float:
+        """The fraction of the features looked up which weren't indexed yet."""
+        return self.n_unseen / (self.n_lookups or 1)
+
+    def matrix(self, batch: typing.List[dict]) -> Matrix:
+        """Convert a batch of features to a matrix in one pass, indexing the new feature names along
+        the way. Sets of features which aren't dictionaries of numbers are skipped."""
+
+        kept: typing.List[int] = []
+        lengths: typing.List[int] = []
+        cols: typing.List[int] = []
+        values: typing.List[float] = []
+        skipped = []
+        n_lookups = n_unseen = 0
+
+        with self._lock:
+            for i, x in enumerate(batch):
+                if not isinstance(x, dict) or not _NUMBERS.issuperset(map(type, x.values())):
+                    skipped.append(i)
+                    continue
+                try:
+                    positions = operator.itemgetter(*x)(self.positions) if x else ()
+                    if len(x) == 1:
+                        positions = (positions,)
+                except KeyError:
+                    n_names = len(self.names)
+                    positions = tuple(
+                        self.positions[name] if name in self.positions else self._add(name)
+                        for name in x
+                    )
+                    n_unseen += len(self.names) - n_names
+                kept.append(i)
+                lengths.append(len(x))
+                cols.extend(positions)
+                values.extend(x.values())
+                n_lookups += len(x)
+            self.n_lookups += n_lookups
+            self.n_unseen += n_unseen
+            shape = (len(batch), len(self.names))
+            names = self.names
+
+        rows = np.repeat(np.array(kept, dtype=int), lengths)
+        cols_array = np.fromiter(cols, dtype=int, count=len(cols))
+        values_array = np.fromiter(values, dtype=float, count=len(values))
+
+        # NaNs stand for missing values in dense matrices, and so can't be values
+        nans = np.isnan(values_array)
+        if nans.any():
+            skipped = sorted(set(skipped) | set(rows[nans].tolist()))
+            keep = ~np.isin(rows, skipped)
+            rows, cols_array, values_array = rows[keep], cols_array[keep], values_array[keep]
+
+        return Matrix(
+            rows=rows,
+            cols=cols_array,
+            values=values_array,
+            shape=shape,
+            skipped=skipped,
+            names=names
+        )
+
+    def _add(self, name: str) -> int:
+        pos = self.positions[name] = len(self.names)
+        self.names.append(name)
+        return pos
+
+    def rebase(self, names: typing.List[str]):
+        """Adopt the order of names which were indexed elsewhere, such as the stored ones. The names
+        which are only indexed here come after them. The list of names is replaced rather than
+        modified when the order changes, so that the matrices which were built with the previous
+        order keep their names."""
+        with self._lock:
+            known = set(names)
+            rebased = list(names) + [name for name in self.names if name not in known]
+            if rebased != self.names:
+                self.names = rebased
+                self.positions = {name: pos for pos, name in enumerate(self.names)}
+
+    def stats(self) -> dict:
+        return {'size': len(self), 'unseen_rate': self.unseen_rate}
+
+
+# The feature indexes of the current process, indexed by model name
+_INDEXES: typing.Dict[str, FeatureIndex] = {}
+_lock = threading.Lock()
+
+
+def get_index(name: str, load: typing.Callable[[str], typing.List[str]]) -> FeatureIndex:
+    """Return the feature index of a model, creating it from the names returned by `load` if there
+    is none."""
+    with _lock:
+        if name not in _INDEXES:
+            _INDEXES[name] = FeatureIndex(load(name))
+        return _INDEXES[name]
+
+
+def forget(name: str):
+    """Drop the feature index of a model, which is necessary when the model is replaced."""
+    with _lock:
+        _INDEXES.pop(name, None)
+
+
+def stats() -> typing.Dict[str, dict]:
+    with _lock:
+        return {name: index.stats() for name, index in sorted(_INDEXES.items())}
+
+
+def clear():
+    with _lock:
+        _INDEXES.clear()
@@ -0,0 +1,280 @@
+"""Inference-only forms of common models, which make predictions without going through river's
+generic pipeline machinery.
+
+A compiled model is a snapshot: it is produced each time a model is stored, and is only used as
+long as the model hasn't been updated since. Features which a compiled model can't handle, such as
+non-numeric values, are left to the actual model.
+
+"""
+import collections
+import math
+import threading
+import typing
+
+from river import compose
+from river import linear_model
+from river import preprocessing
+import numpy as np
+
+from . import columns
+
+
+class NotCompilable(Exception):
+    """Raised when a compiled model can't handle a set of features."""
+
+
+class CompiledLinearModel:
+    """Linear model, possibly preceded by a `StandardScaler` or a `OneHotEncoder`, with its
+    parameters laid out in arrays.
+
+    Parameters:
+        method: Name of the prediction method of the actual model, which this replaces.
+        index: Position of each feature in the arrays. The features are the one-hot encoded ones
+            when `one_hot` is set.
+        weights: Weight of each feature.
+        intercept: The intercept of the linear model.
+        loss: The loss of the linear model, which turns the dot product into a prediction.
+        means: Mean of each feature, if the features are standardized.
+        stds: Standard deviation of each feature, if the features are scaled.
+        one_hot: Whether or not the features are one-hot encoded.
+
+    """
+
+    def __init__(self, method: str, index: typing.Dict[str, int], weights: np.ndarray,
+                 intercept: float, loss, means: typing.Optional[np.ndarray] = None,
+                 stds: typing.Optional[np.ndarray] = None,
+                 one_hot=False):
+        self.method = method
+        self.index = index
+        self.weights = weights
+        self.intercept = intercept
+        self.loss = loss
+        self.means = means
+        self.stds = stds
+        self.one_hot = one_hot
+        self._coefs = self._make_coefs()
+        self._aligned: typing.Optional[tuple] = None
+
+    def _make_coefs(self) -> dict:
+        """Gather the parameters of each feature, which is faster than indexing the arrays when
+        features come one set at a time."""
+        if self.one_hot:
+            return {name: float(self.weights[pos]) for name, pos in self.index.items()}
+        return {
+            name: (
+                0. if self.means is None else float(self.means[pos]),
+                None if self.stds is None else float(self.stds[pos]),
+                float(self.weights[pos])
+            )
+            for name, pos in self.index.items()
+        }
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_coefs'], state['_aligned']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._coefs = self._make_coefs()
+        self._aligned = None
+
+    def _align(self, names: typing.List[str]) -> tuple:
+        """Lay out the parameters along the columns of a feature index. Indexes only grow, and
+        replace their names when they are reordered, so the layout is kept until new names are
+        indexed."""
+
+        aligned = self._aligned
+        if aligned is not None and aligned[0] is names and aligned[1] == len(names):
+            return aligned[2]
+
+        # Unknown features are pointed at a trailing zero
+        positions = np.array([self.index.get(name, -1) for name in names], dtype=int)
+        align = lambda a: None if a is None else np.append(a, 0.)[positions]
+        params = (align(self.weights), align(self.means), align(self.stds))
+        self._aligned = (names, len(names), params)
+        return params
+
+    def _dot(self, x: dict) -> float:
+
+        dot = 0.
+
+        if self.one_hot:
+            names: typing.Set[str] = set()
+            for i, xi in x.items():
+                if isinstance(xi, (list, set)):
+                    names.update(f'{i}_{xj}' for xj in xi)
+                else:
+                    names.add(f'{i}_{xi}')
+            for name in names:
+                dot += self._coefs.get(name, 0.)
+            return dot
+
+        # Features which are unknown to the model don't contribute to the dot product
+        for name, value in x.items():
+            if not isinstance(value, (int, float)):
+                raise NotCompilable(f'{name} is not a number')
+            try:
+                mean, std, weight = self._coefs[name]
+            except KeyError:
+                continue
+            if std is None:
+                dot += (value - mean) * weight
+            elif std:
+                dot += (value - mean) / std * weight
+        return dot
+
+    def _output(self, dot: float):
+        y_pred = self.loss.mean_func(dot + self.intercept)
+        if self.method == 'predict_proba_one':
+            return {False: 1. - y_pred, True: y_pred}
+        return y_pred
+
+    def predict(self, x):
+        """Make the same prediction as the actual model, up to floating point rounding."""
+        if not isinstance(x, dict):
+            raise NotCompilable('the features are not a dictionary')
+        return self._output(self._dot(x))
+
+    def predict_many(self, matrix: columns.Matrix, names: typing.List[str]) -> list:
+        """Make a prediction for each row of a matrix, whose columns are named by `names`. The rows
+        which were skipped when building the matrix get `None`."""
+
+        if self.one_hot:
+            raise NotCompilable('one-hot encoded features are not laid out in columns')
+
+        # The index may have grown since the matrix was built, but its first columns stay the same
+        n_cols = matrix.shape[1]
+        weights, means, stds = (
+            None if a is None else a[:n_cols] for a in self._align(names)
+        )
+
+        X = matrix.dense()
+        Z = np.where(np.isnan(X), 0., X if means is None else X - means)
+        if stds is not None:
+            Z = np.divide(Z, stds, out=np.zeros_like(Z), where=stds > 0)
+
+        skipped = set(matrix.skipped)
+        return [
+            None if i in skipped else self._output(dot)
+            for i, dot in enumerate((Z @ weights).tolist())
+        ]
+
+
+# The linear models which can be compiled, along with the prediction method that is compiled
+_LINEAR_MODELS: typing.Dict[type, str] = {
+    linear_model.LinearRegression: 'predict_one',
+    linear_model.LogisticRegression: 'predict_proba_one'
+}
+
+
+def compile_model(model) -> typing.Optional[CompiledLinearModel]:
+    """Return the compiled form of a model, or `None` if the model can't be compiled.
+
+    The supported models are `LinearRegression` and `LogisticRegression`, on their own or preceded
+    by a `StandardScaler` or a `OneHotEncoder`. The exact types are checked, because subclasses
+    might behave differently.
+
+    >>> from river import datasets
+    >>> model = preprocessing.StandardScaler() | linear_model.LinearRegression()
+    >>> for x, y in datasets.TrumpApproval().take(100):
+    ...     model.learn_one(x, y)
+    >>> compiled = compile_model(model)
+    >>> math.isclose(compiled.predict(x), model.predict_one(x))
+    True
+
+    """
+
+    steps = list(model.steps.values()) if isinstance(model, compose.Pipeline) else [model]
+    *transformers, estimator = steps
+    method = _LINEAR_MODELS.get(type(estimator))
+    if method is None or len(transformers) > 1:
+        return None
+
+    weights = dict(estimator._weights)
+    scaler = None
+    one_hot = False
+    if transformers:
+        transformer, = transformers
+        if type(transformer) is preprocessing.StandardScaler and transformer.window_size is None:
+            scaler = transformer
+        elif (type(transformer) is preprocessing.OneHotEncoder and
+              transformer.categories is None and not transformer.drop_first):
+            one_hot = True
+        else:
+            return None
+
+    names = list(weights)
+    if scaler is not None:
+        names.extend(name for name in scaler.means if name not in weights)
+    index = {name: pos for pos, name in enumerate(names)}
+
+    # The statistics are read with `get`, because the scaler's dictionaries insert missing keys
+    means = stds = None
+    if scaler is not None:
+        means = np.array([scaler.means.get(name, 0.) for name in names], dtype=float)
+        if scaler.with_std:
+            stds = np.sqrt([scaler.vars.get(name, 0.) for name in names])
+
+    return CompiledLinearModel(
+        method=method,
+        index=index,
+        weights=np.array([weights.get(name, 0.) for name in names], dtype=float),
+        intercept=estimator.intercept,
+        loss=estimator.loss,
+        means=means,
+        stds=stds,
+        one_hot=one_hot
+    )
+
+
+def agree(a, b) -> bool:
+    """Whether two predictions are the same, up to floating point rounding.
+
+    >>> agree({False: .2, True: .8}, {False: .2, True: .8 + 1e-15})
+    True
+    >>> agree(1., 1.001)
+    False
+
+    """
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(agree(a[k], b[k]) for k in a)
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12)
+    return a == b
+
+
+# The model versions whose compiled form disagreed with the actual model, and usage counts
+_DISABLED: typing.Set[typing.Tuple[str, str]] = set()
+_COUNTS: typing.Counter[str] = collections.Counter()
+_lock = threading.Lock()
+
+
+def disable(name: str, version: str):
+    """Stop using the compiled form of a version of a model, after it disagreed with the model."""
+    with _lock:
+        _DISABLED.add((name, version))
+        _COUNTS['mismatches'] += 1
+
+
+def is_disabled(name: str, version: str) -> bool:
+    return (name, version) in _DISABLED
+
+
+def count(**amounts: int):
+    with _lock:
+        _COUNTS.update(amounts)
+
+
+def stats() -> dict:
+    with _lock:
+        return {
+            key: _COUNTS[key]
+            for key in ('predictions', 'fallbacks', 'checks', 'mismatches')
+        }
+
+
+def clear():
+    with _lock:
+        _DISABLED.clear()
+        _COUNTS.clear()
@@ -0,0 +1,221 @@
+import collections
+import hashlib
+import math
+import threading
+import time
+import typing
+
+# What happens when a request claims an idempotency key
+CLAIMED = 'claimed'  # the request may learn from the event
+DUPLICATE = 'duplicate'  # the event has already been learnt from
+IN_FLIGHT = 'in_flight'  # another request is learning from the event
+
+
+class BloomFilter:
+    """Set of keys which can give false positives but no false negatives, in constant space.
+
+    Parameters:
+        capacity: Number of keys the filter is meant to hold.
+        error_rate: Probability of a false positive once `capacity` keys have been added.
+
+    >>> bloom = BloomFilter(capacity=100)
+    >>> bloom.add('a')
+    >>> 'a' in bloom, 'b' in bloom
+    (True, False)
+
+    """
+
+    def __init__(self, capacity: int, error_rate=1e-6):
+        self.n_bits = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.n_hashes = max(round(self.n_bits / capacity * math.log(2)), 1)
+        self.n_keys = 0
+        self._bits = bytearray((self.n_bits + 7) // 8)
+
+    def _positions(self, key: str) -> typing.Iterator[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+        for i in range(self.n_hashes):
+            yield (h1 + i * h2) % self.n_bits
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.n_keys += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class RecentKeys:
+    """Remembers keys for at least `window` seconds, within a bounded amount of memory.
+
+    The most recent keys are stored exactly. Every key is also added to a Bloom filter, which is
+    replaced by a new one every `window` seconds. The previous Bloom filter is kept around, so that
+    a key is remembered for between `window` and twice `window` seconds.
+
+    A request claims a key before it learns from the event, so that a retry which arrives while the
+    event is being learnt from is turned away. The key is then either added once the event has been
+    learnt from, or released if learning failed. The keys are only known to the current process.
+
+    Parameters:
+        window: Number of seconds during which a key is remembered.
+        capacity: Number of keys expected per window.
+        error_rate: Probability of a key being mistaken for one that was added.
+        exact_size: Number of recent keys which are stored exactly.
+
+    >>> keys = RecentKeys(window=60)
+    >>> keys.claim(42), keys.claim(42)
+    ('claimed', 'in_flight')
+    >>> keys.add(42)
+    >>> keys.claim('42'), keys.claim(43)
+    ('duplicate', 'claimed')
+
+    """
+
+    def __init__(self, window: float, capacity=100_000, error_rate=1e-6, exact_size=10_000):
+        self.window = window
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.exact_size = exact_size
+        self.duplicates = 0
+        self._exact: typing.OrderedDict[str, float] = collections.OrderedDict()
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous: typing.Optional[BloomFilter] = None
+        self._in_flight: typing.Set[str] = set()
+        self._rotated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _rotate(self, now: float):
+        if now - self._rotated_at >= self.window:
+            self._previous = self._current if now - self._rotated_at < 2 * self.window else None
+            self._current = BloomFilter(self.capacity, self.error_rate)
+            self._rotated_at = now
+        while self._exact and next(iter(self._exact.values())) < now - self.window:
+            self._exact.popitem(last=False)
+
+    def claim(self, key) -> str:
+        """Reserve a key for a request which is about to learn from its event. Returns `CLAIMED`,
+        `DUPLICATE`, or `IN_FLIGHT`."""
+        key = str(key)
+        with self._lock:
+            if self._contains(key):
+                self.duplicates += 1
+                return DUPLICATE
+            if key in self._in_flight:
+                return IN_FLIGHT
+            self._in_flight.add(key)
+            return CLAIMED
+
+    def release(self, key):
+        """Give up a claimed key, because its event couldn't be learnt from."""
+        with self._lock:
+            self._in_flight.discard(str(key))
+
+    def add(self, key):
+        """Record that the event of a key has been learnt from."""
+        key = str(key)
+        with self._lock:
+            now = time.monotonic()
+            self._rotate(now)
+            self._in_flight.discard(key)
+            self._exact[key] = now
+            self._exact.move_to_end(key)
+            if len(self._exact) > self.exact_size:
+                self._exact.popitem(last=False)
+            self._current.add(key)
+
+    def _contains(self, key: str) -> bool:
+        self._rotate(time.monotonic())
+        return (
+            key in self._exact or
+            key in self._current or
+            (self._previous is not None and key in self._previous)
+        )
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return self._contains(str(key))
+
+    def stats(self) -> dict:
+        return {
+            'duplicates': self.duplicates,
+            'keys': self._current.n_keys,
+            'memory_size': len(self._current._bits) * 2
+        }
+
+
+class SharedRecentKeys:
+    """Remembers keys for `window` seconds in Redis, so that they are shared by every process.
+
+    A key is claimed with `SET NX`, which only one request can do. The claim expires after
+    `claim_timeout` seconds, in case the process which made it stops before adding or releasing
+    the key. Once the event has been learnt from, the key is kept for `window` seconds.
+
+    Parameters:
+        r: A Redis client.
+        window: Number of seconds during which a key is remembered.
+        claim_timeout: Number of seconds after which an unfinished claim is given up.
+
+    """
+
+    _IN_FLIGHT = b'in-flight'
+    _DONE = b'done'
+
+    def __init__(self, r, window: float, claim_timeout=60):
+        self.r = r
+        self.window = window
+        self.claim_timeout = claim_timeout
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(key) -> str:
+        return f'idempotency/{key}'
+
+    def claim(self, key) -> str:
+        while True:
+            if self.r.set(self._key(key), self._IN_FLIGHT, nx=True, ex=self.claim_timeout):
+                return CLAIMED
+            state = self.r.get(self._key(key))
+            if state == self._DONE:
+                with self._lock:
+                    self.duplicates += 1
+                return DUPLICATE
+            if state == self._IN_FLIGHT:
+                return IN_FLIGHT
+            # The key expired in the meantime, so it can be claimed again
+
+    def release(self, key):
+        self.r.delete(self._key(key))
+
+    def add(self, key):
+        self.r.set(self._key(key), self._DONE, ex=max(math.ceil(self.window), 1))
+
+    def stats(self) -> dict:
+        return {'duplicates': self.duplicates}
+
+
+_RECENT_KEYS: typing.Optional[typing.Union[RecentKeys, SharedRecentKeys]] = None
+_lock = threading.Lock()
+
+
+def recent_keys(config, r=None) -> typing.Optional[typing.Union[RecentKeys, SharedRecentKeys]]:
+    """Return the idempotency keys, or `None` if they're not recorded. The keys are stored in Redis
+    if a Redis client `r` is given, and are otherwise only known to the current process."""
+    global _RECENT_KEYS
+    window = float(config['IDEMPOTENCY_WINDOW'])
+    if not window:
+        return None
+    with _lock:
+        if _RECENT_KEYS is None:
+            if r is not None:
+                _RECENT_KEYS = SharedRecentKeys(r, window)
+            else:
+                _RECENT_KEYS = RecentKeys(window, capacity=int(config['IDEMPOTENCY_CAPACITY']))
+        return _RECENT_KEYS
+
+
+def clear():
+    global _RECENT_KEYS
+    with _lock:
+        _RECENT_KEYS = None
@@ -0,0 +1,271 @@
+import collections
+import copy
+import itertools
+import math
+import time
+import typing
+
+from river import datasets
+from river import stats
+from river.metrics.base import ClassificationMetric
+from river.metrics.base import Metric
+from river.metrics.confusion import ConfusionMatrix
+import dill
+
+from . import events
+from . import flavors
+
+
+def update_metrics(metrics: list, y_true, y_pred):
+    """Update a list of metrics with a ground truth and a prediction."""
+    for metric in metrics:
+        # If the metrics requires labels but the prediction is a dict, then we need to retrieve the
+        # predicted label with the highest probability
+        if (
+            isinstance(metric, ClassificationMetric) and
+            metric.requires_labels and
+            isinstance(y_pred, dict)
+        ):
+            # At this point prediction is a dict, but it might be empty because no training data
+            # has been seen
+            if len(y_pred) == 0:
+                continue
+            pred = max(y_pred, key=y_pred.__getitem__)
+            metric.update(y_true=y_true, y_pred=pred)
+        else:
+            metric.update(y_true=y_true, y_pred=y_pred)
+
+
+def merge_metrics(metrics: list, others: list):
+    """Add the state of `others` to `metrics`, as if `metrics` had seen the samples of `others`.
+
+    The metrics are expected to be of the same kinds and in the same order. The metrics that are
+    used by chantilly keep track of a running mean or of a confusion matrix, both of which can be
+    merged.
+
+    """
+    seen: typing.Set[int] = set()
+    for metric, other in zip(metrics, others):
+        _merge(metric, other, seen)
+
+
+def _merge(obj, other, seen: set):
+
+    # Some metrics share their state, such as F1 with the precision and recall it contains
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+
+    if isinstance(obj, stats.Mean):
+        obj += other  # this modifies obj in-place
+    elif isinstance(obj, ConfusionMatrix):
+        n_samples = obj.n_samples + other.n_samples
+        for y_true, row in other.data.items():
+            for y_pred, weight in row.items():
+                obj.update(y_true, y_pred, weight)
+        obj.n_samples = n_samples
+    else:
+        for attr, value in vars(obj).items():
+            if isinstance(value, (stats.Mean, ConfusionMatrix, Metric)):
+                _merge(value, getattr(other, attr), seen)
+
+
+class Bucket:
+    """The state of the metrics over a slice of a window."""
+
+    def __init__(self, metrics: list, key: int, t: float):
+        self.metrics = metrics
+        self.key = key
+        self.t = t
+        self.n = 0
+
+
+class Window:
+    """Metrics computed over the most recent samples.
+
+    The window is divided into a fixed number of buckets, each of which holds the state of the
+    metrics over the samples it has received. The oldest bucket is dropped once it leaves the
+    window. Therefore, the memory footprint of a window doesn't depend on the number of samples it
+    contains, but the window moves by a whole bucket at a time: it contains between
+    `size - size / n_buckets` and `size` samples, and covers between `period - period / n_buckets`
+    and `period` seconds.
+
+    Parameters:
+        metrics: The metrics to compute, which are copied for each bucket.
+        size: Maximum number of samples in the window.
+        period: Maximum age of the samples in the window, in seconds.
+        n_buckets: Number of buckets which the window is divided into.
+
+    """
+
+    def __init__(self, metrics: list, size: typing.Optional[int] = None,
+                 period: typing.Optional[float] = None, n_buckets: int = 10):
+        self.template = metrics
+        self.size = size
+        self.period = period
+        self.capacity = math.ceil(size / n_buckets) if size is not None else None
+        self.width = period / n_buckets if period is not None else None
+        self.buckets: typing.Deque[Bucket] = collections.deque()
+
+    @property
+    def n_samples(self) -> int:
+        return sum(bucket.n for bucket in self.buckets)
+
+    @property
+    def metrics(self) -> list:
+        """The metrics over the samples which are in the window."""
+        metrics = copy.deepcopy(self.template)
+        for bucket in self.buckets:
+            merge_metrics(metrics, bucket.metrics)
+        return metrics
+
+    def _key(self, t: float) -> int:
+        return int(t // self.width) if self.width is not None else 0
+
+    def update(self, y_true, y_pred, t: float):
+        key = self._key(t)
+        if (
+            not self.buckets or
+            self.buckets[-1].key != key or
+            (self.capacity is not None and self.buckets[-1].n >= self.capacity)
+        ):
+            self.buckets.append(Bucket(copy.deepcopy(self.template), key=key, t=t))
+        bucket = self.buckets[-1]
+        update_metrics(bucket.metrics, y_true, y_pred)
+        bucket.t = max(bucket.t, t)
+        bucket.n += 1
+        self.expire(t)
+
+    def expire(self, t: float):
+        """Drop the buckets which have left the window at time `t`."""
+        while self.buckets and (
+            (self.size is not None and self.n_samples > self.size) or
+            (self.period is not None and self.width is not None and
+             self.buckets[0].key * self.width <= t - self.period)
+        ):
+            self.buckets.popleft()
+
+    def merge(self, other: 'Window'):
+        """Add the buckets of another window. The most recent buckets of both windows are kept.
+
+        When the window is bounded in time, the buckets which cover the same interval are merged
+        together.
+
+        """
+        buckets: typing.Dict[typing.Tuple[int, int], Bucket] = {}
+        for i, bucket in enumerate(itertools.chain(self.buckets, other.buckets)):
+            # Buckets which only bound the number of samples are never merged with each other
+            key = (bucket.key, 0 if self.period is not None else i)
+            if key in buckets:
+                merged = buckets[key]
+                merge_metrics(merged.metrics, bucket.metrics)
+                merged.t = max(merged.t, bucket.t)
+                merged.n += bucket.n
+            else:
+                buckets[key] = Bucket(copy.deepcopy(bucket.metrics), key=bucket.key, t=bucket.t)
+                buckets[key].n = bucket.n
+        self.buckets = collections.deque(
+            sorted(buckets.values(), key=lambda bucket: (bucket.key, bucket.t))
+        )
+        if self.buckets:
+            self.expire(max(bucket.t for bucket in self.buckets))
+
+
+class Monitor:
+    """Keeps track of the metrics over all time, as well as over a window of the most recent
+    samples and over a window of the most recent seconds.
+
+    Parameters:
+        metrics: A function which returns a fresh list of metrics.
+        window_size: Number of samples in the `size` window.
+        window_period: Number of seconds in the `period` window.
+
+    """
+
+    windows = ('all', 'size', 'period')
+
+    def __init__(self, metrics: typing.Callable[[], list], window_size: int, window_period: float):
+        self.all = metrics()
+        self.size = Window(metrics(), size=window_size)
+        self.period = Window(metrics(), period=window_period)
+
+    def update(self, y_true, y_pred, t: typing.Optional[float] = None):
+        t = time.time() if t is None else t
+        update_metrics(self.all, y_true, y_pred)
+        self.size.update(y_true, y_pred, t)
+        self.period.update(y_true, y_pred, t)
+
+    def merge(self, other: 'Monitor'):
+        """Add the state of another monitor, such as one which belongs to another worker."""
+        merge_metrics(self.all, other.all)
+        self.size.merge(other.size)
+        self.period.merge(other.period)
+
+    def get(self, window='all') -> dict:
+        if window == 'all':
+            metrics = self.all
+        elif window == 'size':
+            metrics = self.size.metrics
+        elif window == 'period':
+            self.period.expire(time.time())
+            metrics = self.period.metrics
+        else:
+            raise ValueError(f"Unknown window '{window}'")
+        return {metric.__class__.__name__: metric.get() for metric in metrics}
+
+
+def progressive_validation(model, flavor: flavors.Flavor, samples: typing.Iterable) -> dict:
+    """Evaluate a model by making a prediction for each sample before learning from it.
+
+    The time spent in the prediction and learning functions is measured separately, which allows
+    reporting the throughput of each one.
+
+    """
+
+    metrics = flavor.default_metrics()
+    pred_func = getattr(model, flavor.pred_func)
+    n = predict_ns = learn_ns = 0
+
+    for x, y in samples:
+
+        # The model might modify the features in-place, as is the case when chantilly is running
+        x_copy = copy.deepcopy(x)
+        tic = time.perf_counter_ns()
+        y_pred = pred_func(x=x_copy)
+        predict_ns += time.perf_counter_ns() - tic
+
+        update_metrics(metrics, y_true=y, y_pred=y_pred)
+
+        tic = time.perf_counter_ns()
+        model.learn_one(x=x, y=y)
+        learn_ns += time.perf_counter_ns() - tic
+
+        n += 1
+
+    return {
+        'n_samples': n,
+        'metrics': {metric.__class__.__name__: metric.get() for metric in metrics},
+        'predict_throughput': n / predict_ns * 1e9 if predict_ns else 0.,
+        'learn_throughput': n / learn_ns * 1e9 if learn_ns else 0.
+    }
+
+
+def _evaluate(blob: bytes, flavor: str, directory: typing.Optional[str] = None,
+              source: typing.Optional[str] = None, dataset: typing.Optional[str] = None,
+              limit: typing.Optional[int] = None) -> dict:
+    """Same as `progressive_validation` but with serialized models and picklable arguments, in
+    order to be run in a separate process."""
+
+    if dataset is not None:
+        samples = iter(getattr(datasets, dataset)())
+    else:
+        samples = (
+            (event['features'], event['ground_truth'])
+            for event in events.read(directory, model=source)
+        )
+
+    return progressive_validation(
+        model=dill.loads(blob),
+        flavor=flavors.allowed_flavors()[flavor],
+        samples=itertools.islice(samples, limit)
+    )
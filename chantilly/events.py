@@ -0,0 +1,155 @@
+import atexit
+import contextlib
+import glob
+import gzip
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import typing
+
+import dill
+import flask
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+
+class EventLog:
+    """Append-only log of learning events.
+
+    The log is a directory of gzip-compressed JSON lines files, which we call segments. A new
+    segment is started once the current one contains `segment_size` events. Each process writes to
+    its own segments, therefore several processes can share the same directory. The compressor is
+    flushed after each event, which means that a segment can be read while it is being written to.
+
+    Parameters:
+        directory: Where to store the segments.
+        segment_size: Maximum number of events per segment.
+
+    """
+
+    _instances: dict = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, directory, segment_size=100_000):
+        self.directory = directory
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        self._segment = None
+        self._pid = None
+        self._n_events = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def open(cls, directory, **kwargs) -> 'EventLog':
+        """Return the process-wide log associated with `directory`, creating it if necessary."""
+        with cls._instances_lock:
+            if directory not in cls._instances:
+                cls._instances[directory] = cls(directory, **kwargs)
+            return cls._instances[directory]
+
+    def append(self, event: dict):
+        line = (json.dumps(event) + '\n').encode()
+        with self._lock:
+            # A forked process must not write to the segment of its parent
+            if self._segment is None or self._pid != os.getpid() or self._n_events >= self.segment_size:
+                self._rotate()
+            self._segment.write(line)
+            self._segment.flush()
+            self._n_events += 1
+
+    def _rotate(self):
+        if self._segment is not None and self._pid == os.getpid():
+            self._segment.close()
+        self._pid = os.getpid()
+        self._n_events = 0
+        name = f'{time.time_ns():020d}-{self._pid}.jsonl.gz'
+        self._segment = gzip.open(os.path.join(self.directory, name), 'ab')
+
+    def close(self):
+        with self._lock:
+            if self._segment is not None and self._pid == os.getpid():
+                self._segment.close()
+            self._segment = None
+
+
+@atexit.register
+def _close_event_logs():
+    for log in list(EventLog._instances.values()):
+        log.close()
+
+
+def get_event_log() -> typing.Optional[EventLog]:
+    """Return the event log of the current app, or `None` if events are not being logged."""
+    directory = flask.current_app.config.get('EVENT_LOG_DIR')
+    if not directory:
+        return None
+    return EventLog.open(
+        directory,
+        segment_size=int(flask.current_app.config['EVENT_LOG_SEGMENT_SIZE'])
+    )
+
+
+def _read_segment(path):
+    with gzip.open(path, 'rt') as f:
+        # The last segment of a process which is still running doesn't have a gzip trailer
+        with contextlib.suppress(EOFError):
+            for line in f:
+                if line.endswith('\n'):
+                    yield json.loads(line)
+
+
+def read(directory, model: typing.Optional[str] = None) -> typing.Iterator[dict]:
+    """Iterate over the events of a log in chronological order.
+
+    Parameters:
+        directory: Where the segments are stored.
+        model: Only the events pertaining to this model are returned if specified.
+
+    """
+    segments = sorted(glob.glob(os.path.join(glob.escape(directory), '*.jsonl.gz')))
+    events = heapq.merge(*map(_read_segment, segments), key=lambda event: event['t'])
+    if model is not None:
+        events = (event for event in events if event['model'] == model)
+    return events
+
+
+def learn(model, events: typing.Iterable[dict], batch_size=1):
+    """Train a model on a stream of events.
+
+    `learn_many` is used if the model implements it and `batch_size` is higher than 1. Note that
+    learning from mini-batches is not strictly equivalent to learning from one event at a time.
+
+    """
+
+    events = iter(events)
+
+    if batch_size > 1 and hasattr(model, 'learn_many') and pd is not None:
+        while True:
+            batch = list(itertools.islice(events, batch_size))
+            if not batch:
+                return model
+            # Text features can't be put in a DataFrame
+            if not all(isinstance(event['features'], dict) for event in batch):
+                for event in batch:
+                    model.learn_one(event['features'], event['ground_truth'])
+                continue
+            model.learn_many(
+                pd.DataFrame([event['features'] for event in batch]),
+                pd.Series([event['ground_truth'] for event in batch])
+            )
+
+    for event in events:
+        model.learn_one(event['features'], event['ground_truth'])
+    return model
+
+
+def _learn_from_log(blob: bytes, directory: str, source: str, batch_size: int) -> bytes:
+    """Same as `learn` but with serialized models, in order to be run in a separate process."""
+    model = dill.loads(blob)
+    learn(model, read(directory, model=source), batch_size=batch_size)
+    return dill.dumps(model)
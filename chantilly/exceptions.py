@@ -3,6 +3,7 @@ from . import flavors
 
 class InvalidUsage(Exception):
     status_code = 400
+    headers: dict = {}
 
     def __init__(self, message, status_code=None, payload=None):
         super().__init__()
@@ -28,7 +29,36 @@ class UnknownFlavor(Exception):
         super().__init__(message, *args, **kwargs)
 
 
+class StorageLocked(Exception):
+
+    def __init__(self, path, *args, **kwargs):
+        message = (
+            f"'{path}' is already used by another process. The memory storage backend can only be "
+            'used by a single process.'
+        )
+        super().__init__(message, *args, **kwargs)
+
+
 class FlavorNotSet(InvalidUsage):
 
     def __init__(self, *args, **kwargs):
         super().__init__(message='No flavor has been set.', *args, **kwargs)
+
+
+class ConcurrentUpdate(InvalidUsage):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(
+            message='The model was updated by someone else too many times, please retry.',
+            status_code=409,
+            *args, **kwargs
+        )
+
+
+class Overloaded(InvalidUsage):
+    """Raised when a request is turned away because the server is too busy. The client is told
+    after how many seconds it may try again."""
+
+    def __init__(self, message, status_code=503, retry_after=1, *args, **kwargs):
+        super().__init__(message=message, status_code=status_code, *args, **kwargs)
+        self.headers = {'Retry-After': str(retry_after)}
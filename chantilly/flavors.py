@@ -3,6 +3,8 @@ import typing
 
 from river import metrics
 
+from . import immutable
+
 
 def allowed_flavors():
     return {f().name: f() for f in [RegressionFlavor, BinaryFlavor, MultiClassFlavor]}
@@ -26,6 +28,19 @@ class Flavor(abc.ABC):
     def pred_func(self) -> str:
         """The name of the required prediction function."""
 
+    @abc.abstractproperty
+    def sample_target(self) -> typing.Any:
+        """A made-up target, which is used to find out how a model behaves."""
+
+    def mutating_methods(self, model: typing.Any) -> typing.List[str]:
+        """Return the methods of a model which modify the features they are given."""
+        x = {'x': 1.}
+        return [
+            method
+            for method, kwargs in ((self.pred_func, {}), ('learn_one', {'y': self.sample_target}))
+            if immutable.probe(model, method, x, **kwargs)
+        ]
+
 
 class RegressionFlavor(Flavor):
 
@@ -46,6 +61,10 @@ class RegressionFlavor(Flavor):
     def pred_func(self):
         return 'predict_one'
 
+    @property
+    def sample_target(self):
+        return 0.
+
 
 class BinaryFlavor(Flavor):
 
@@ -72,6 +91,10 @@ class BinaryFlavor(Flavor):
     def pred_func(self):
         return 'predict_proba_one'
 
+    @property
+    def sample_target(self):
+        return True
+
 
 class MultiClassFlavor(Flavor):
 
@@ -100,3 +123,7 @@ class MultiClassFlavor(Flavor):
     @property
     def pred_func(self):
         return 'predict_proba_one'
+
+    @property
+    def sample_target(self):
+        return 0
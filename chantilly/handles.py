@@ -0,0 +1,197 @@
+"""Storage handles which are kept open by each process, instead of being opened for each request.
+
+A handle is dropped by the child process after a fork, so that processes which are forked by a
+server such as gunicorn open their own. Backends which can't be used by several requests at once,
+such as shelve, are lent to one request at a time, and processes take turns by locking a file.
+
+"""
+import os
+import threading
+import typing
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore
+
+
+class SharedHandle:
+    """A storage backend which is opened once and then reused.
+
+    If `lock_path` is given, the backend is lent to one request at a time, across threads and
+    processes. The file at `lock_path` is locked while a request uses the backend. It holds a
+    counter which is incremented each time a process writes its changes at the end of a request.
+    The backend is reopened when the counter shows that another process has written changes since,
+    so that the changes are seen.
+
+    Parameters:
+        open: Function which opens the backend. It may be `None` for a handle which is only
+            meant to be closed.
+        lock_path: Path of the lock file. The backend is used by every request at once if this is
+            `None`, which is for backends which are safe to share.
+
+    """
+
+    def __init__(self, open: typing.Optional[typing.Callable],
+                 lock_path: typing.Optional[str] = None):
+        self._open = open
+        self.lock_path = lock_path
+        self.db = None
+        self.generation = -1
+        self.n_opens = 0
+        self.n_syncs = 0
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._lock_file: typing.Optional[typing.IO] = None
+
+    def _locked_file(self) -> typing.IO:
+        """Return the lock file, which is open while the other processes are locked out."""
+        if self._lock_file is None:
+            raise RuntimeError('the other processes are not locked out')
+        return self._lock_file
+
+    def _read_generation(self) -> int:
+        lock_file = self._locked_file()
+        lock_file.seek(0)
+        return int(lock_file.read() or 0)
+
+    def _bump_generation(self):
+        generation = self._read_generation() + 1
+        lock_file = self._locked_file()
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(generation))
+        lock_file.flush()
+        self.generation = generation
+
+    def _lock_out(self):
+        """Lock out the other threads, as well as the other processes unless the current thread
+        has already done so."""
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth > 1:
+            return
+        try:
+            if self._lock_file is None:
+                self._lock_file = open(self.lock_path, 'a+')
+            if fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        except BaseException:
+            self._depth -= 1
+            self._lock.release()
+            raise
+
+    def _unlock(self):
+        if self._depth == 1 and fcntl is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._depth -= 1
+        self._lock.release()
+
+    def acquire(self):
+        """Return the backend, which has to be given back with `release`."""
+
+        if self.lock_path is None:
+            with self._lock:
+                if self.db is None:
+                    self.db = self._open()
+                    self.n_opens += 1
+                return self.db
+
+        self._lock_out()
+        if self._depth > 1:
+            return self.db
+
+        try:
+            generation = self._read_generation()
+            if self.db is None or generation != self.generation:
+                # There are no pending changes to lose, because they are written upon release
+                if self.db is not None:
+                    self.db.close()
+                self.db = self._open()
+                self.n_opens += 1
+                self.generation = generation
+        except BaseException:
+            self._unlock()
+            raise
+        return self.db
+
+    def release(self):
+        """Give back the backend. This is a sync point: the changes made to the backend are
+        written, and the other processes are told about them."""
+
+        if self.lock_path is None:
+            return
+
+        try:
+            if self._depth == 1 and self.db is not None and self.db.sync():
+                self._bump_generation()
+                self.n_syncs += 1
+        finally:
+            self._unlock()
+
+    def close(self, cleanup: typing.Optional[typing.Callable] = None):
+        """Close the backend once no other thread is using it. `cleanup` is then called while the
+        other processes are locked out, and they reopen the backend afterwards."""
+
+        if self.lock_path is None:
+            with self._lock:
+                if self.db is not None:
+                    self.db.close()
+                    self.db = None
+                if cleanup is not None:
+                    cleanup()
+            return
+
+        with self._lock:
+            self._lock_out()
+            try:
+                if self.db is not None:
+                    self.db.close()
+                    self.db = None
+                if cleanup is not None:
+                    cleanup()
+                self._bump_generation()
+            finally:
+                self._unlock()
+            if not self._depth and self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def stats(self) -> dict:
+        return {'opens': self.n_opens, 'syncs': self.n_syncs}
+
+
+_HANDLES: typing.Dict[typing.Hashable, SharedHandle] = {}
+_lock = threading.Lock()
+
+
+def get(key: typing.Hashable, open: typing.Callable,
+        lock_path: typing.Optional[str] = None) -> SharedHandle:
+    """Return the handle of the current process which is identified by `key`, creating it if
+    necessary."""
+    with _lock:
+        if key not in _HANDLES:
+            _HANDLES[key] = SharedHandle(open, lock_path=lock_path)
+        return _HANDLES[key]
+
+
+def discard(key: typing.Hashable, lock_path: typing.Optional[str] = None,
+            cleanup: typing.Optional[typing.Callable] = None):
+    """Close a handle and forget about it. The other processes are told to reopen their handle even
+    if the current process doesn't have one. See `SharedHandle.close` for `cleanup`."""
+    with _lock:
+        handle = _HANDLES.pop(key, None)
+    if handle is None:
+        handle = SharedHandle(open=None, lock_path=lock_path)
+    handle.close(cleanup)
+
+
+def _forget_after_fork():
+    """The handles of the parent process are left alone, as they may be in use by its threads."""
+    global _HANDLES, _lock
+    _HANDLES = {}
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_after_fork)
@@ -0,0 +1,93 @@
+import collections
+import threading
+import time
+import typing
+
+
+class History:
+    """Time series of metric values, stored at several resolutions.
+
+    Each resolution is a ring buffer of buckets. A bucket holds the last value recorded during the
+    period of time it covers. Fine resolutions have a short retention whereas coarse ones go back
+    further in time. The amount of memory used is thus fixed, regardless of the number of updates.
+
+    Parameters:
+        tiers: Pairs of (resolution in seconds, number of buckets).
+
+    >>> history = History(tiers=[(1, 3), (10, 3)])
+    >>> for t in range(25):
+    ...     history.record({'MAE': t / 10}, t=t)
+    >>> history.query(resolution=1)
+    {'resolution': 1, 'metrics': {'MAE': [[22, 2.2], [23, 2.3], [24, 2.4]]}}
+    >>> history.query(start=5)
+    {'resolution': 10, 'metrics': {'MAE': [[0, 0.9], [10, 1.9], [20, 2.4]]}}
+
+    """
+
+    def __init__(self, tiers=((1, 3600), (60, 1440), (3600, 720))):
+        self.tiers = sorted(tiers)
+        self._series: typing.Dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, values: dict, model: typing.Optional[str] = None,
+               t: typing.Optional[float] = None):
+        """Record the current value of some metrics, either globally or for a given model."""
+        t = time.time() if t is None else t
+        with self._lock:
+            for metric, value in values.items():
+                try:
+                    series = self._series[model, metric]
+                except KeyError:
+                    series = self._series[model, metric] = {
+                        resolution: collections.deque(maxlen=capacity)
+                        for resolution, capacity in self.tiers
+                    }
+                for resolution, buckets in series.items():
+                    start = int(t // resolution * resolution)
+                    if buckets and buckets[-1][0] == start:
+                        buckets[-1][1] = value
+                    else:
+                        buckets.append([start, value])
+
+    def query(self, model: typing.Optional[str] = None, start: typing.Optional[float] = None,
+              end: typing.Optional[float] = None,
+              resolution: typing.Optional[float] = None) -> dict:
+        """Return the values of each metric between `start` and `end`.
+
+        The finest resolution which is at least as coarse as the requested `resolution` and which
+        goes back far enough to cover `start` is used.
+
+        """
+
+        with self._lock:
+            series = {
+                metric: tiers
+                for (series_model, metric), tiers in self._series.items()
+                if series_model == model
+            }
+
+            candidates = [r for r, _ in self.tiers if resolution is None or r >= resolution]
+            if not candidates:
+                candidates = [self.tiers[-1][0]]
+            chosen = candidates[-1]
+            for r in candidates:
+                oldest = min((tiers[r][0][0] for tiers in series.values() if tiers[r]), default=None)
+                if start is None or oldest is None or oldest <= start:
+                    chosen = r
+                    break
+
+            return {
+                'resolution': chosen,
+                'metrics': {
+                    metric: [
+                        list(bucket) for bucket in tiers[chosen]
+                        if (start is None or bucket[0] + chosen > start) and
+                        (end is None or bucket[0] <= end)
+                    ]
+                    for metric, tiers in series.items()
+                }
+            }
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
@@ -0,0 +1,91 @@
+import copy
+import typing
+
+
+class FeaturesMutated(TypeError):
+    """Raised when a model attempts to modify the features it was given."""
+
+    def __init__(self):
+        super().__init__('The features are read-only.')
+
+
+class ReadOnlyFeatures(dict):
+    """Dictionary of features which can't be modified.
+
+    This is a subclass of `dict`, which means models can use it as they would use a dictionary. The
+    copies that are made of it are regular dictionaries, which can therefore be modified.
+
+    >>> x = ReadOnlyFeatures({'a': 1})
+    >>> x['b'] = 2
+    Traceback (most recent call last):
+    ...
+    chantilly.immutable.FeaturesMutated: The features are read-only.
+    >>> y = x.copy()
+    >>> y['b'] = 2
+    >>> y
+    {'a': 1, 'b': 2}
+
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise FeaturesMutated
+
+    __setitem__ = __delitem__ = __ior__ = _read_only  # type: ignore
+    clear = pop = popitem = setdefault = update = _read_only  # type: ignore
+
+    def copy(self):
+        return dict(self)
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+def freeze(features):
+    """Make features read-only. Only dictionaries need to be wrapped, as strings are immutable."""
+    if isinstance(features, dict) and not isinstance(features, ReadOnlyFeatures):
+        return ReadOnlyFeatures(features)
+    return features
+
+
+def probe(model, method: str, features: dict, **kwargs) -> bool:
+    """Find out whether or not a method of a model modifies its input.
+
+    The method is called on a copy of the model with read-only features. A method which fails is
+    assumed to modify its input, as copying the features is always safe.
+
+    """
+    try:
+        getattr(copy.deepcopy(model), method)(x=ReadOnlyFeatures(features), **kwargs)
+    except Exception:
+        return True
+    return False
+
+
+def call(model, method: str, features, mutates: typing.Optional[typing.Container[str]] = None,
+         on_mutation: typing.Optional[typing.Callable[[str], typing.Any]] = None, **kwargs):
+    """Call a method of a model, copying the features only if the method modifies them.
+
+    The methods which modify their input are given by `mutates`, as found out by `probe` when the
+    model was uploaded. The features are always copied if this isn't known. A method might still
+    modify its input for some features only, in which case it is called again with a copy of the
+    features, once `on_mutation` has been called with its name so that it can be recorded. Note
+    that the first call might have partially updated the model, for instance if a pipeline step
+    learns before a later step modifies the features.
+
+    """
+    if isinstance(features, ReadOnlyFeatures) and (mutates is None or method in mutates):
+        features = copy.deepcopy(features)
+    try:
+        return getattr(model, method)(x=features, **kwargs)
+    except FeaturesMutated:
+        if not isinstance(features, ReadOnlyFeatures):
+            raise
+        if on_mutation is not None:
+            on_mutation(method)
+        return getattr(model, method)(x=copy.deepcopy(features), **kwargs)
@@ -0,0 +1,275 @@
+import collections
+import sys
+import threading
+import time
+import typing
+
+import dill
+
+
+def sizeof(obj) -> int:
+    """Estimate the memory footprint of an object, including the objects it refers to.
+
+    >>> sizeof([1, 2]) > sys.getsizeof([1, 2])
+    True
+
+    """
+
+    seen = set()
+    size = 0
+    stack = [obj]
+
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+            stack.extend(obj)
+        if hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+        for slot in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, slot):
+                stack.append(getattr(obj, slot))
+
+    return size
+
+
+class Entry:
+
+    __slots__ = ('model', 'version', 'memory_size', 'serialized_size', 'dirty', 'dirty_since')
+
+    def __init__(self, model, version, memory_size, serialized_size):
+        self.model = model
+        self.version = version
+        self.memory_size = memory_size
+        self.serialized_size = serialized_size
+        self.dirty = False
+        self.dirty_since = None
+
+
+class Usage:
+
+    __slots__ = ('hits', 'misses', 'load_ns', 'memory_size', 'serialized_size')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.load_ns = 0
+        self.memory_size = 0
+        self.serialized_size = 0
+
+
+class ModelManager:
+    """Keeps the most useful models deserialized, within a memory budget.
+
+    A model which is requested is loaded from the storage backend unless it is resident and its
+    version matches the one in the storage backend. Once the models which are resident take up more
+    than `budget` bytes, the least recently used ones, or the least frequently used ones, are
+    evicted. The memory footprint of a model is measured when it is loaded, and is then
+    extrapolated from the size of its serialized form each time it is stored.
+
+    A resident model is shared by the requests of the process. Therefore, a request has to hold the
+    lock of a model from the moment it gets the model until it has put it back. Models which are
+    locked by a request are neither evicted nor written to the storage backend by other requests.
+
+    With `write_back`, models that are stored are only written to the storage backend when they are
+    evicted, or when they've been waiting for more than `flush_interval` seconds. This saves a lot of
+    serialization, but is only correct when a single process is running.
+
+    Parameters:
+        budget: Number of bytes the resident models may take up.
+        policy: Either 'lru' or 'lfu'.
+        write_back: Whether to delay the writes to the storage backend.
+        flush_interval: Maximum number of seconds a write may be delayed by.
+
+    """
+
+    def __init__(self, budget: int, policy='lru', write_back=False, flush_interval=10.):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError(f"Unknown eviction policy '{policy}'")
+        self.budget = budget
+        self.policy = policy
+        self.write_back = write_back
+        self.flush_interval = flush_interval
+        self.memory_size = 0  # the total footprint of the resident models
+        self._entries: typing.OrderedDict[str, Entry] = collections.OrderedDict()
+        self._dirty: typing.OrderedDict[str, None] = collections.OrderedDict()  # oldest first
+        self._usage: typing.Dict[str, Usage] = collections.defaultdict(Usage)
+        self._model_locks: typing.Dict[str, threading.RLock] = {}
+        self._lock = threading.RLock()
+
+    def lock(self, name: str) -> threading.RLock:
+        """Return the lock of a model."""
+        with self._lock:
+            return self._model_locks.setdefault(name, threading.RLock())
+
+    def get(self, db, name: str, version: typing.Optional[str]):
+        """Return a model, loading it from the storage backend if necessary."""
+
+        with self._lock:
+            usage = self._usage[name]
+            entry = self._entries.get(name)
+            if entry is not None and (entry.dirty or entry.version == version):
+                self._entries.move_to_end(name)
+                usage.hits += 1
+                return entry.model
+
+        tic = time.perf_counter_ns()
+        blob = db.get_raw(f'models/{name}')
+        model = dill.loads(blob)
+        load_ns = time.perf_counter_ns() - tic
+
+        with self._lock:
+            usage.misses += 1
+            usage.load_ns += load_ns
+            self._admit(db, name, Entry(model, version, sizeof(model), len(blob)))
+        return model
+
+    def put(self, db, name: str, model, version: typing.Optional[str],
+            blob: typing.Optional[bytes] = None):
+        """Store a model, both in memory and in the storage backend. `blob` is to be provided if the
+        model has already been written to the storage backend."""
+
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry.model is not model:
+                previous, entry = entry, Entry(model, version, sizeof(model), 0)
+                if previous is not None and previous.dirty:
+                    entry.dirty, entry.dirty_since = True, previous.dirty_since
+            entry.version = version
+            self._admit(db, name, entry)
+
+            if blob is not None:
+                self._written(name, entry, blob)
+            elif self.write_back:
+                entry.dirty = True
+                if entry.dirty_since is None:
+                    entry.dirty_since = time.monotonic()
+                    self._dirty[name] = None
+            else:
+                self._write(db, name, entry)
+
+            # The models which have been waiting for the longest are at the front of the queue
+            if self.write_back:
+                now = time.monotonic()
+                for other in list(self._dirty):
+                    if now - self._entries[other].dirty_since <= self.flush_interval:
+                        break
+                    self._try_write(db, other)
+
+    def holds(self, name: str, model, version: typing.Optional[str]) -> bool:
+        """Whether `model` is the resident version `version` of a model."""
+        with self._lock:
+            entry = self._entries.get(name)
+            return entry is not None and entry.model is model and entry.version == version
+
+    def discard(self, name: str):
+        with self._lock:
+            self._drop(name)
+            self._usage.pop(name, None)
+
+    def revert(self, name: str):
+        """Drop a resident model which was modified without being put back, so that it is loaded
+        from the storage backend the next time. With `write_back`, the modifications which haven't
+        been written yet are lost as well."""
+        with self._lock:
+            self._drop(name)
+
+    def flush(self, db, names: typing.Optional[typing.Iterable[str]] = None):
+        """Write the dirty models to the storage backend, or only the given ones. Models which are
+        locked by another request are skipped."""
+        with self._lock:
+            for name in list(self._dirty if names is None else names):
+                if name in self._dirty:
+                    self._try_write(db, name)
+
+    def _try_write(self, db, name) -> bool:
+        lock = self.lock(name)
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            self._write(db, name, self._entries[name])
+        finally:
+            lock.release()
+        return True
+
+    def _write(self, db, name, entry):
+        blob = dill.dumps(entry.model)
+        db.set_raw(f'models/{name}', blob)
+        self._written(name, entry, blob)
+
+    def _written(self, name, entry, blob):
+        memory_size = entry.memory_size
+        if entry.serialized_size:
+            memory_size = int(entry.memory_size * len(blob) / entry.serialized_size)
+        if self._entries.get(name) is entry:
+            self.memory_size += memory_size - entry.memory_size
+            self._dirty.pop(name, None)
+        entry.memory_size = memory_size
+        entry.serialized_size = len(blob)
+        entry.dirty = False
+        entry.dirty_since = None
+
+    def _drop(self, name) -> typing.Optional[Entry]:
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self.memory_size -= entry.memory_size
+            self._dirty.pop(name, None)
+        return entry
+
+    def _admit(self, db, name, entry):
+        previous = self._entries.get(name)
+        if previous is not entry:
+            if previous is not None:
+                self.memory_size -= previous.memory_size
+            self._entries[name] = entry
+            self.memory_size += entry.memory_size
+        self._entries.move_to_end(name)
+        usage = self._usage[name]
+        usage.memory_size = entry.memory_size
+        usage.serialized_size = entry.serialized_size
+
+        # Evict models until the budget is respected, but always keep the model being admitted, as
+        # well as the models which are locked by other requests
+        if self.memory_size <= self.budget:
+            return
+        victims = [other for other in self._entries if other != name]
+        if self.policy == 'lfu':
+            victims.sort(key=lambda other: self._usage[other].hits + self._usage[other].misses)
+        for victim in victims:
+            lock = self.lock(victim)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                evicted = self._drop(victim)
+                if evicted is not None and evicted.dirty:
+                    self._write(db, victim, evicted)
+            finally:
+                lock.release()
+            if self.memory_size <= self.budget:
+                break
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'budget': self.budget,
+                'memory_size': self.memory_size,
+                'models': {
+                    name: {
+                        'resident': name in self._entries,
+                        'hits': usage.hits,
+                        'misses': usage.misses,
+                        'hit_rate': usage.hits / (usage.hits + usage.misses or 1),
+                        'mean_load_duration': usage.load_ns // (usage.misses or 1),
+                        'memory_size': usage.memory_size,
+                        'serialized_size': usage.serialized_size
+                    }
+                    for name, usage in sorted(self._usage.items())
+                }
+            }
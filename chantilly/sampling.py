@@ -0,0 +1,109 @@
+import collections
+import random
+import threading
+import typing
+
+STRATEGIES = ('none', 'uniform', 'balanced', 'adaptive')
+
+
+class Sampler:
+    """Decides which labelled samples a model learns from, so as to keep up with the labels.
+
+    - 'uniform': each sample is kept with probability `rate`.
+    - 'balanced': the samples of each class are kept with a probability which is inversely
+        proportional to the frequency of the class, so that the model sees as many samples of each
+        class. The probabilities are scaled by `rate`. Samples are kept uniformly if the
+        ground truths aren't classes.
+    - 'adaptive': every sample is kept as long as at most `max_backlog` learning requests are
+        being processed or waiting. Beyond that, the probability decreases in proportion to the
+        backlog, without going under `rate`.
+
+    Parameters:
+        strategy: One of 'uniform', 'balanced', or 'adaptive'.
+        rate: The sampling rate, which is a minimum in the adaptive case.
+        max_backlog: The backlog beyond which the adaptive strategy starts sampling.
+        classes: Whether or not the ground truths are classes.
+        seed: Random seed, for reproducibility.
+
+    >>> sampler = Sampler('uniform', rate=.5, seed=42)
+    >>> sum(sampler.keep(y=1) for _ in range(1000))
+    480
+
+    """
+
+    def __init__(self, strategy: str, rate=1., max_backlog=4, classes=False,
+                 seed: typing.Optional[int] = None):
+        if strategy not in STRATEGIES[1:]:
+            raise ValueError(f"Unknown sampling strategy '{strategy}'")
+        self.strategy = strategy
+        self.rate = rate
+        self.max_backlog = max_backlog
+        self.classes = classes
+        self.seen = 0
+        self.kept = 0
+        self._counts: typing.Counter = collections.Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def probability(self, y, backlog=0) -> float:
+        """Return the probability with which a sample is kept."""
+
+        if self.strategy == 'adaptive':
+            if backlog <= self.max_backlog:
+                return 1.
+            return max(self.rate, self.max_backlog / backlog)
+
+        if self.strategy == 'balanced' and self.classes and self._counts[y]:
+            mean_count = self.seen / len(self._counts)
+            return min(1., self.rate * mean_count / self._counts[y])
+
+        return self.rate
+
+    def keep(self, y, backlog=0) -> bool:
+        """Decide whether a sample is learnt from."""
+        with self._lock:
+            self.seen += 1
+            if self.classes:
+                self._counts[y] += 1
+            keep = self._rng.random() < self.probability(y, backlog)
+            self.kept += keep
+            return keep
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                'strategy': self.strategy,
+                'seen': self.seen,
+                'kept': self.kept,
+                'rate': self.kept / (self.seen or 1)
+            }
+            if self.strategy == 'balanced' and self.classes:
+                stats['class_rates'] = {str(y): self.probability(y) for y in sorted(self._counts)}
+            return stats
+
+
+_SAMPLER: typing.Optional[Sampler] = None
+_lock = threading.Lock()
+
+
+def get_sampler(config, flavor) -> typing.Optional[Sampler]:
+    """Return the sampler of the current process, or `None` if every sample is learnt from."""
+    global _SAMPLER
+    strategy = config['LEARN_SAMPLING']
+    if strategy == 'none':
+        return None
+    with _lock:
+        if _SAMPLER is None:
+            _SAMPLER = Sampler(
+                strategy,
+                rate=float(config['LEARN_SAMPLING_RATE']),
+                max_backlog=int(config['LEARN_SAMPLING_BACKLOG']),
+                classes=flavor.name in ('binary', 'multiclass')
+            )
+        return _SAMPLER
+
+
+def clear():
+    global _SAMPLER
+    with _lock:
+        _SAMPLER = None
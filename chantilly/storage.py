@@ -1,8 +1,20 @@
 import abc
+import atexit
+import bisect
 import contextlib
+import copy
+import dbm
+import glob
 import os
 import random
 import shelve
+import socket
+import struct
+import threading
+import time
+import typing
+import uuid
+import zlib
 
 import river.base
 import river.metrics
@@ -10,13 +22,23 @@ import river.stats
 import river.utils
 import dill
 import flask
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore
 try:
     import redis
 except ImportError:
     pass
 
+from . import averaging
+from . import columns
+from . import compiling
+from . import evaluation
 from . import exceptions
 from . import flavors
+from . import handles
+from . import residency
 
 
 class StorageBackend(abc.ABC):
@@ -48,20 +70,131 @@ class StorageBackend(abc.ABC):
     def close(self):
         """Do something when the app shuts down."""
 
+    # Whether the objects which are retrieved are shared by every request of the process, instead of
+    # being deserialized each time
+    shares_objects = False
+
+    def lock(self, key: str) -> typing.ContextManager:
+        """Return the lock to hold while an object is retrieved, modified, and stored, so that the
+        requests of the process don't overwrite each other's modifications. A shared object must
+        not be modified, nor serialized, by a request which doesn't hold it."""
+        with _KEY_LOCKS_LOCK:
+            return _KEY_LOCKS.setdefault(key, threading.RLock())
+
+    def revert(self, key: str):
+        """Undo the modifications made to a shared object since it was last stored, such as the
+        ones made by an update which failed partway. There is nothing to undo when objects are not
+        shared, as the modifications are then made to a copy."""
+
     def get(self, key, default=None):
         try:
             return self[key]
         except KeyError:
             return default
 
+    def get_raw(self, key) -> bytes:
+        """Retrieve the serialized form of an object."""
+        return dill.dumps(self[key])
+
+    def set_raw(self, key, blob: bytes):
+        """Store an object which has already been serialized with dill."""
+        self[key] = dill.loads(blob)
+
+    def raw_size(self, key) -> int:
+        """Return the number of bytes an object takes up once serialized."""
+        return len(self.get_raw(key))
+
+    # An index is a sorted set of strings, which allows listing some objects without going through
+    # every key. By default it is stored as a sorted list under the `index/<name>` key.
+
+    def index_add(self, index: str, member: str):
+        members = self.get(f'index/{index}', [])
+        i = bisect.bisect_left(members, member)
+        if i == len(members) or members[i] != member:
+            members.insert(i, member)
+            self[f'index/{index}'] = members
+
+    def index_remove(self, index: str, member: str):
+        members = self.get(f'index/{index}', [])
+        i = bisect.bisect_left(members, member)
+        if i < len(members) and members[i] == member:
+            del members[i]
+            self[f'index/{index}'] = members
+
+    def index_range(self, index: str, start=0, stop=None) -> typing.List[str]:
+        """Return the members of an index whose rank is between `start` and `stop`."""
+        return self.get(f'index/{index}', [])[start:stop]
+
+    def incr(self, key: str, amounts: typing.Dict[str, float]):
+        """Increment some counters, which are stored together under a key."""
+        counters = self.get(key, {})
+        for field, amount in amounts.items():
+            counters[field] = counters.get(field, 0) + amount
+        self[key] = counters
+
+    def counters(self, key: str) -> typing.Dict[str, float]:
+        return self.get(key, {})
+
+    def sync(self) -> bool:
+        """Write the pending changes to disk. Returns whether or not there were any."""
+        return False
+
+    def transaction(self, keys: typing.List[str], fn: typing.Callable, retries=0):
+        """Run `fn` in isolation from the other writes to `keys`.
+
+        `fn` is given an object with the same reading and writing methods as the backend. If one
+        of the `keys` is modified by someone else while `fn` is running, then `fn`'s writes are
+        discarded and `fn` is run again, at most `retries` times. Returns the output of `fn` along
+        with the number of retries. By default, transactions are serialized with a lock, which is
+        enough when a single process is using the database.
+
+        """
+        with _TRANSACTION_LOCK:
+            return fn(self), 0
+
+
+_TRANSACTION_LOCK = threading.RLock()
+_KEY_LOCKS: typing.Dict[str, threading.RLock] = {}
+_KEY_LOCKS_LOCK = threading.Lock()
+
 
 class ShelveBackend(shelve.DbfilenameShelf, StorageBackend):  # type: ignore
     """Storage backend based on the shelve module from the standard library.
 
-    This should mainly be used for development and testing, but not production.
+    This should mainly be used for development and testing, but not production. The changes are
+    written to disk when `sync` is called, which is at the end of each request.
 
     """
 
+    dirty = False
+
+    def __setitem__(self, key, obj):
+        super().__setitem__(key, obj)
+        self.dirty = True
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.dirty = True
+
+    def get_raw(self, key):
+        return self.dict[key.encode(self.keyencoding)]
+
+    def set_raw(self, key, blob):
+        self.cache.pop(key, None)
+        self.dict[key.encode(self.keyencoding)] = blob
+        self.dirty = True
+
+    def sync(self):
+        if not self.dirty:
+            return False
+        super().sync()
+        self.dirty = False
+        return True
+
+    def close(self):
+        super().close()
+        self.dirty = False
+
 
 class RedisBackend(StorageBackend):
 
@@ -77,46 +210,491 @@ class RedisBackend(StorageBackend):
     def __delitem__(self, key):
         self.r.delete(key)
 
+    def get_raw(self, key):
+        return self.r[key]
+
+    def set_raw(self, key, blob):
+        self.r[key] = blob
+
+    def raw_size(self, key):
+        return self.r.strlen(key)
+
+    def __contains__(self, key):
+        return bool(self.r.exists(key))
+
     def __iter__(self):
         for key in self.r.scan_iter():
             yield key.decode()
 
+    # Indexes are stored as sorted sets where every score is 0, which orders them lexicographically
+
+    def index_add(self, index, member):
+        self.r.zadd(f'index/{index}', {member: 0})
+
+    def index_remove(self, index, member):
+        self.r.zrem(f'index/{index}', member)
+
+    def index_range(self, index, start=0, stop=None):
+        members = self.r.zrange(f'index/{index}', start, -1 if stop is None else stop - 1)
+        return [member.decode() for member in members]
+
+    # Counters are stored in a hash, which allows incrementing them atomically without reading them
+
+    def incr(self, key, amounts):
+        pipe = self.r.pipeline(transaction=False)
+        for field, amount in amounts.items():
+            if isinstance(amount, int):
+                pipe.hincrby(key, field, amount)
+            else:
+                pipe.hincrbyfloat(key, field, amount)
+        pipe.execute()
+
+    def counters(self, key):
+        counters = {}
+        for field, value in self.r.hgetall(key).items():
+            try:
+                counters[field.decode()] = int(value)
+            except ValueError:
+                counters[field.decode()] = float(value)
+        return counters
+
+    # Transactions are optimistic: the keys are watched, and the writes are only applied if none of
+    # the keys has been modified in the meantime
+
+    def transaction(self, keys, fn, retries=0):
+        with self.r.pipeline() as pipe:
+            for attempt in range(retries + 1):
+                try:
+                    pipe.watch(*keys)
+                    tx = RedisTransaction(pipe)
+                    result = fn(tx)
+                    pipe.multi()
+                    for key, blob in tx.writes.items():
+                        if blob is None:
+                            pipe.delete(key)
+                        else:
+                            pipe.set(key, blob)
+                    pipe.execute()
+                    return result, attempt
+                except redis.WatchError:
+                    continue
+        raise exceptions.ConcurrentUpdate
+
     def close(self):
         return
 
 
+class RedisTransaction:
+    """Reads go straight to Redis, whereas writes are buffered until the transaction is executed."""
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.writes: typing.Dict[str, typing.Optional[bytes]] = {}  # None stands for a deletion
+
+    def get_raw(self, key):
+        blob = self.pipe.get(key)
+        if blob is None:
+            raise KeyError(key)
+        return blob
+
+    def get(self, key, default=None):
+        try:
+            return dill.loads(self.get_raw(key))
+        except KeyError:
+            return default
+
+    def set_raw(self, key, blob):
+        self.writes[key] = blob
+
+    def __setitem__(self, key, obj):
+        self.writes[key] = dill.dumps(obj)
+
+    def __delitem__(self, key):
+        self.writes[key] = None
+
+
+class MemoryBackend(StorageBackend):
+    """Storage backend which keeps every object in the memory of the process.
+
+    Reads don't involve any deserialization, which makes this backend as fast as a dictionary.
+    Durability is obtained by appending every mutation to a log file. The log is fsynced in groups,
+    every `fsync_interval` milliseconds, by a background thread. Setting `fsync_interval` to 0
+    fsyncs after every mutation. Once `compact_every` mutations have been logged, the log is
+    compacted into a snapshot by another background thread. The snapshot is loaded and the tail of
+    the log is replayed on top of it when the backend is created.
+
+    The backend is meant to be shared by every request handled by a process, which is why it
+    should be obtained with `MemoryBackend.open`. It can't be used by several processes on top of
+    the same files: a lock file is held while the backend is open, and `StorageLocked` is raised
+    if another process, such as another worker of the same server, holds it. The objects are
+    shared too, which is why each key has a lock that has to be held while its object is modified.
+    An object which is modified but not stored again is reverted to the state it was in when it
+    was last logged.
+
+    Parameters:
+        path: Prefix of the snapshot and log files.
+        fsync_interval: Number of milliseconds between two fsyncs of the log.
+        compact_every: Number of logged mutations after which the log is compacted.
+
+    """
+
+    shares_objects = True
+
+    _RECORD = struct.Struct('>cIII')  # operation, checksum, key length, value length
+    _SET = b'S'
+    _DEL = b'D'
+
+    _instances: dict = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path, fsync_interval=100, compact_every=10_000):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+
+        self._lock = threading.RLock()
+        self._data = {}  # deserialized objects, which are populated lazily
+        self._blobs = {}  # serialized objects, which are what gets written to the snapshot
+        self._dirty = False
+        self._n_logged = 0
+        self._stop = threading.Event()
+        self._compact = threading.Event()
+
+        self._lock_file = open(f'{path}.lock', 'a')
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._generation = self._restore()
+            self._log = open(self._log_path(self._generation), 'ab')
+        except BlockingIOError:
+            self._lock_file.close()
+            raise exceptions.StorageLocked(path)
+        except BaseException:
+            self._lock_file.close()
+            raise
+
+        self._compactor = threading.Thread(target=self._compact_loop, daemon=True)
+        self._compactor.start()
+        if self.fsync_interval:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    @classmethod
+    def open(cls, path, **kwargs) -> 'MemoryBackend':
+        """Return the process-wide backend associated with `path`, creating it if necessary."""
+        with cls._instances_lock:
+            if path not in cls._instances:
+                cls._instances[path] = cls(path, **kwargs)
+            return cls._instances[path]
+
+    @classmethod
+    def drop(cls, path):
+        """Shut down the backend associated with `path` and remove its files."""
+        with cls._instances_lock:
+            db = cls._instances.pop(path, None)
+        if db is not None:
+            db.shutdown()
+        files = glob.glob(glob.escape(path) + '.snapshot*') + glob.glob(glob.escape(path) + '.log.*')
+        for file in files + [f'{path}.lock']:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(file)
+
+    def __setitem__(self, key, obj):
+        with self._lock:
+            blob = dill.dumps(obj)
+            self._append(self._SET, key, blob)
+            self._data[key] = obj
+            self._blobs[key] = blob
+
+    def __getitem__(self, key):
+        with self._lock:
+            try:
+                return self._data[key]
+            except KeyError:
+                obj = self._data[key] = dill.loads(self._blobs[key])
+                return obj
+
+    def revert(self, key):
+        # The object is deserialized again from its logged form the next time it is retrieved
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self._blobs:
+                raise KeyError(key)
+            self._append(self._DEL, key, b'')
+            self._data.pop(key, None)
+            del self._blobs[key]
+
+    def __contains__(self, key):
+        return key in self._blobs
+
+    def get_raw(self, key):
+        return self._blobs[key]
+
+    def set_raw(self, key, blob):
+        with self._lock:
+            self._append(self._SET, key, blob)
+            self._data.pop(key, None)
+            self._blobs[key] = blob
+
+    def raw_size(self, key):
+        return len(self._blobs[key])
+
+    def index_add(self, index, member):
+        with self._lock:
+            super().index_add(index, member)
+
+    def index_remove(self, index, member):
+        with self._lock:
+            super().index_remove(index, member)
+
+    def incr(self, key, amounts):
+        with self._lock:
+            super().incr(key, amounts)
+
+    def transaction(self, keys, fn, retries=0):
+        with self._lock:
+            return fn(self), 0
+
+    def __iter__(self):
+        with self._lock:
+            keys = list(self._blobs)
+        yield from keys
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def close(self):
+        """The backend outlives requests, so there is nothing to do at the end of each one."""
+
+    def shutdown(self):
+        """Stop the background threads and make sure every mutation is on disk."""
+        self._stop.set()
+        self._compact.set()
+        with self._lock:
+            self._sync()
+            self._log.close()
+            self._lock_file.close()
+
+    # Log
+
+    def _log_path(self, generation):
+        return f'{self.path}.log.{generation:08d}'
+
+    def _append(self, op, key, value):
+        key = key.encode()
+        self._log.write(self._RECORD.pack(op, zlib.crc32(key + value), len(key), len(value)))
+        self._log.write(key)
+        self._log.write(value)
+        self._dirty = True
+        if not self.fsync_interval:
+            self._sync()
+        self._n_logged += 1
+        if self._n_logged >= self.compact_every:
+            self._n_logged = 0
+            self._compact.set()
+
+    def _sync(self):
+        if self._dirty and not self._log.closed:
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._dirty = False
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.fsync_interval / 1000):
+            with self._lock:
+                self._sync()
+
+    def _replay(self, path):
+        """Apply the records of a log file. A truncated or corrupted tail is ignored."""
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(self._RECORD.size)
+                if len(header) < self._RECORD.size:
+                    return
+                op, checksum, key_len, value_len = self._RECORD.unpack(header)
+                key, value = f.read(key_len), f.read(value_len)
+                if len(key) < key_len or len(value) < value_len or zlib.crc32(key + value) != checksum:
+                    return
+                if op == self._SET:
+                    self._blobs[key.decode()] = value
+                else:
+                    self._blobs.pop(key.decode(), None)
+
+    # Snapshot
+
+    def _restore(self) -> int:
+        """Load the snapshot and replay the logs which are more recent. Returns a fresh generation
+        number for the log that will be written to."""
+
+        generation = 0
+        with contextlib.suppress(FileNotFoundError):
+            with open(f'{self.path}.snapshot', 'rb') as f:
+                snapshot = dill.load(f)
+            generation = snapshot['generation']
+            self._blobs = snapshot['blobs']
+
+        logs = sorted(glob.glob(glob.escape(self.path) + '.log.*'))
+        for log in logs:
+            log_generation = int(log.rsplit('.', 1)[1])
+            if log_generation < generation:
+                os.remove(log)  # already part of the snapshot
+                continue
+            self._replay(log)
+            generation = log_generation + 1
+
+        return generation
+
+    def _compact_loop(self):
+        while True:
+            self._compact.wait()
+            self._compact.clear()
+            if self._stop.is_set():
+                return
+            self.compact()
+
+    def compact(self):
+        """Write the current state to a snapshot and discard the logs it supersedes."""
+
+        # Switch to a new log, so that mutations can go on while the snapshot is being written
+        with self._lock:
+            if self._stop.is_set():
+                return
+            self._sync()
+            self._log.close()
+            self._generation += 1
+            self._log = open(self._log_path(self._generation), 'ab')
+            blobs = dict(self._blobs)
+            generation = self._generation
+
+        tmp_path = f'{self.path}.snapshot.tmp'
+        with open(tmp_path, 'wb') as f:
+            dill.dump({'generation': generation, 'blobs': blobs}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, f'{self.path}.snapshot')
+
+        for log in glob.glob(glob.escape(self.path) + '.log.*'):
+            if int(log.rsplit('.', 1)[1]) < generation:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(log)
+
+
+@atexit.register
+def _shutdown_memory_backends():
+    for db in list(MemoryBackend._instances.values()):
+        db.shutdown()
+
+
+def _forget_memory_backends():
+    """A forked process doesn't inherit the background threads of the backends, and therefore
+    opens its own backends instead of using those of its parent."""
+    MemoryBackend._instances = {}
+    MemoryBackend._instances_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_memory_backends)
+
+
 # The following will make it so that shelve.open returns ShelveBackend instead of DbfilenameShelf
 shelve.DbfilenameShelf = ShelveBackend  # type: ignore
 
 
-def get_db() -> StorageBackend:
-    if 'db' not in flask.g:
+def open_db(config) -> StorageBackend:
+    """Open the storage backend described by a configuration."""
+
+    backend = config['STORAGE_BACKEND']
+
+    if backend == 'shelve':
+        return open_shelf(config['SHELVE_PATH'])
 
-        backend = flask.current_app.config['STORAGE_BACKEND']
+    if backend == 'redis':
+        return RedisBackend(
+            host=config['REDIS_HOST'],
+            port=int(config['REDIS_PORT']),
+            db=int(config['REDIS_DB'])
+        )
 
-        if backend == 'shelve':
-            flask.g.db = shelve.open(flask.current_app.config['SHELVE_PATH'])
+    if backend == 'memory':
+        return MemoryBackend.open(
+            config['MEMORY_PATH'],
+            fsync_interval=int(config['MEMORY_FSYNC_INTERVAL']),
+            compact_every=int(config['MEMORY_COMPACT_EVERY'])
+        )
 
-        elif backend == 'redis':
-            flask.g.db = RedisBackend(
-                host=flask.current_app.config['REDIS_HOST'],
-                port=int(flask.current_app.config['REDIS_PORT']),
-                db=int(flask.current_app.config['REDIS_DB'])
-            )
+    raise ValueError(f'Unknown storage backend: {backend}')
 
-        else:
-            raise ValueError(f'Unknown storage backend: {backend}')
 
+def open_shelf(path: str) -> ShelveBackend:
+    """Open a shelf. gdbm's own lock is not taken, because it prevents several processes from
+    keeping the shelf open, which they do while taking turns with a lock of their own."""
+    if dbm.whichdb(path) is None:
+        shelve.open(path).close()
+    # shelve.open returns a ShelveBackend, which stands in for DbfilenameShelf
+    shelf = shelve.open(path, flag='cu' if dbm.whichdb(path) == 'dbm.gnu' else 'c')
+    return typing.cast(ShelveBackend, shelf)
+
+
+def _shelf_files(path: str) -> typing.List[str]:
+    """Return the files of a shelf, which depend on the dbm implementation."""
+    return [path + suffix for suffix in ('', '.db', '.dat', '.dir', '.bak')]
+
+
+def db_handle(config) -> typing.Optional[handles.SharedHandle]:
+    """Return the handle of the current process to the storage backend, or `None` for the memory
+    backend, which is already shared by the requests of the process."""
+
+    backend = config['STORAGE_BACKEND']
+
+    if backend == 'shelve':
+        path = config['SHELVE_PATH']
+        return handles.get(
+            ('shelve', path),
+            open=lambda: open_db(config),
+            lock_path=f'{path}.lock'
+        )
+
+    if backend == 'redis':
+        key = ('redis', config['REDIS_HOST'], int(config['REDIS_PORT']), int(config['REDIS_DB']))
+        return handles.get(key, open=lambda: open_db(config))
+
+    return None
+
+
+def get_db() -> StorageBackend:
+    """Return the storage backend, which is borrowed from the process for the rest of the app
+    context instead of being opened."""
+    if 'db' not in flask.g:
+        handle = db_handle(flask.current_app.config)
+        if handle is None:
+            flask.g.db = open_db(flask.current_app.config)
+        else:
+            flask.g.db = handle.acquire()
+            flask.g.db_handle = handle
     return flask.g.db
 
 
 def close_db(e=None):
     db = flask.g.pop('db', None)
+    handle = flask.g.pop('db_handle', None)
 
-    if db is not None:
+    if handle is not None:
+        handle.release()
+    elif db is not None:
         db.close()
 
 
+def release_db():
+    """Give back the storage backend before waiting on other requests, if they can't use it in the
+    meantime. It is borrowed again by `get_db` when it is needed."""
+    handle = flask.g.get('db_handle')
+    if handle is not None and handle.lock_path is not None:
+        close_db()
+
+
 def drop_db():
     """This function's responsability is to wipe out a database.
 
@@ -125,12 +703,26 @@ def drop_db():
 
     """
 
+    global _MODEL_MANAGER
+    _MODEL_MANAGER = None
+
+    # The replicas of the process are not to be merged into the database once it is gone
+    averaging.clear()
+
     backend = flask.current_app.config['STORAGE_BACKEND']
 
+    # The database can't be in use by the current app context while it is being wiped out
+    close_db()
+
     if backend == 'shelve':
         path = flask.current_app.config['SHELVE_PATH']
-        with contextlib.suppress(FileNotFoundError):
-            os.remove(f'{path}.db')
+
+        def remove_files():
+            for file in _shelf_files(path):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(file)
+
+        handles.discard(('shelve', path), lock_path=f'{path}.lock', cleanup=remove_files)
 
     elif backend == 'redis':
         r = redis.Redis(
@@ -140,6 +732,9 @@ def drop_db():
         )
         r.flushdb()
 
+    elif backend == 'memory':
+        MemoryBackend.drop(flask.current_app.config['MEMORY_PATH'])
+
 
 def set_flavor(flavor: str):
 
@@ -152,29 +747,199 @@ def set_flavor(flavor: str):
 
     db = get_db()
     db['flavor'] = flavor
+    db['indexed'] = True  # the database is empty, so there is nothing to index
 
-    init_metrics()
     init_stats()
 
 
+def redis_client() -> typing.Optional['redis.Redis']:
+    """Return the Redis client of the storage backend, or `None` if the backend isn't Redis."""
+    db = get_db()
+    return db.r if isinstance(db, RedisBackend) else None
+
+
+def worker_id() -> str:
+    """Identify the current process, which may be one of several serving the same database."""
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+# When this process last recorded that it is alive, and last looked for workers which aren't
+_HEARTBEAT_AT = _RETIRED_AT = 0.
+
+
+def heartbeat():
+    """Record that the current worker is alive. This is only written every tenth of
+    `WORKER_TIMEOUT`."""
+    global _HEARTBEAT_AT
+    now = time.time()
+    if now - _HEARTBEAT_AT < float(flask.current_app.config['WORKER_TIMEOUT']) / 10:
+        return
+    _HEARTBEAT_AT = now
+    get_db()[f'heartbeat@{worker_id()}'] = now
+
+
+def retire_workers():
+    """Fold the metrics of the workers which haven't been alive for `WORKER_TIMEOUT` seconds into
+    the metrics which don't belong to any worker. Worker IDs change each time a process restarts,
+    which would otherwise leave more and more metrics to merge. This is only done every tenth of
+    `WORKER_TIMEOUT`."""
+
+    global _RETIRED_AT
+    timeout = float(flask.current_app.config['WORKER_TIMEOUT'])
+    now = time.time()
+    if now - _RETIRED_AT < timeout / 10:
+        return
+    _RETIRED_AT = now
+
+    db = get_db()
+    keys = [_metrics_key()] + [_metrics_key(name) for name in model_names()]
+    for worker in db.index_range('workers'):
+        if worker == worker_id() or now - db.get(f'heartbeat@{worker}', 0.) < timeout:
+            continue
+        for key in keys:
+            _fold_metrics(db, key, f'{key}@{worker}')
+        db.index_remove('workers', worker)
+        with contextlib.suppress(KeyError):
+            del db[f'heartbeat@{worker}']
+
+
+def _fold_metrics(db, key: str, partial_key: str):
+
+    def attempt(tx):
+        partial = tx.get(partial_key)
+        if partial is None:
+            return
+        metrics = tx.get(key)
+        if metrics is None:
+            metrics = partial
+        else:
+            metrics.merge(partial)
+        tx[key] = metrics
+        del tx[partial_key]
+
+    retries = int(flask.current_app.config['MODEL_UPDATE_RETRIES'])
+    with db.lock(key), db.lock(partial_key):
+        db.transaction([key, partial_key], attempt, retries=retries)
+
+
+# Counts and durations are summed over every worker in the database, whereas the exponentially
+# weighted means can't be merged and are therefore specific to each worker
+_EWM: typing.Dict[str, river.stats.EWMean] = {}
+
+
 def init_stats():
+    global _HEARTBEAT_AT, _RETIRED_AT
+    _EWM.clear()
+    _HEARTBEAT_AT = _RETIRED_AT = 0.
+
+
+def record_call(endpoint: str, duration: int, n_calls=1):
+    """Record the duration of calls to an endpoint, in nanoseconds. `n_calls` is the number of
+    calls made in a batch, in which case they each take a share of the duration."""
+    db = get_db()
+    db.incr('counters', {f'{endpoint}_calls': n_calls, f'{endpoint}_duration': duration})
+    if n_calls:
+        _EWM.setdefault(endpoint, river.stats.EWMean(.3)).update(duration / n_calls)
+
+
+def get_stats(endpoint: str) -> dict:
     db = get_db()
-    db['stats'] = {
-        'learn_mean': river.stats.Mean(),
-        'learn_ewm': river.stats.EWMean(.3),
-        'predict_mean': river.stats.Mean(),
-        'predict_ewm': river.stats.EWMean(.3),
+    counters = db.counters('counters')
+    n_calls = counters.get(f'{endpoint}_calls', 0)
+    ewm = _EWM.get(endpoint)
+    return {
+        'n_calls': n_calls,
+        'mean_duration': counters.get(f'{endpoint}_duration', 0) / (n_calls or 1),
+        'ewm_duration': ewm.get() if ewm is not None else 0.
     }
 
-def init_metrics():
+
+def _metrics_key(name: typing.Optional[str] = None) -> str:
+    return 'metrics' if name is None else f'metrics/{name}'
+
+
+def get_worker_metrics(name: typing.Optional[str] = None) -> evaluation.Monitor:
+    """Return the metrics of the current worker, either global or for a given model.
+
+    Each worker updates its own metrics, so that workers don't overwrite each other's updates. The
+    metrics of every worker are merged when they are read with `get_metrics`.
+
+    """
+    db = get_db()
+    try:
+        return db[f'{_metrics_key(name)}@{worker_id()}']
+    except KeyError:
+        try:
+            flavor = db['flavor']
+        except KeyError:
+            raise exceptions.FlavorNotSet
+        db.index_add('workers', worker_id())
+        return make_monitor(flavor)
+
+
+def set_worker_metrics(metrics: evaluation.Monitor, name: typing.Optional[str] = None):
+    db = get_db()
+    db[f'{_metrics_key(name)}@{worker_id()}'] = metrics
+
+
+def update_worker_metrics(y_true, y_pred, name: typing.Optional[str] = None) -> dict:
+    """Update the metrics of the current worker with a sample, and return their values."""
+    db = get_db()
+    heartbeat()
+    with db.lock(f'{_metrics_key(name)}@{worker_id()}'):
+        metrics = get_worker_metrics(name)
+        metrics.update(y_true=y_true, y_pred=y_pred)
+        set_worker_metrics(metrics, name)
+        return metrics.get()
+
+
+def get_metrics(name: typing.Optional[str] = None) -> evaluation.Monitor:
+    """Return the metrics of every worker merged together, either global or for a given model."""
 
     db = get_db()
     try:
         flavor = db['flavor']
     except KeyError:
         raise exceptions.FlavorNotSet
+    retire_workers()
+
+    # The metrics which don't belong to any worker are included, such as the ones of the workers
+    # which have been retired, or the ones stored before metrics were kept for each worker. Shared
+    # metrics are copied, as they may be updated by other requests while they're being read.
+    key = _metrics_key(name)
+    partials = []
+    for k in [key] + [f'{key}@{w}' for w in db.index_range('workers')]:
+        with db.lock(k):
+            partial = db.get(k)
+            if partial is not None:
+                partials.append(copy.deepcopy(partial) if db.shares_objects else partial)
+
+    # There is nothing to merge if a single worker has been updating the metrics
+    if len(partials) == 1:
+        return partials[0]
+
+    metrics = make_monitor(flavor)
+    for partial in partials:
+        metrics.merge(partial)
+    return metrics
+
+
+def drop_metrics(name: str):
+    """Delete the metrics of a model, for every worker."""
+    db = get_db()
+    key = _metrics_key(name)
+    for k in [key] + [f'{key}@{w}' for w in db.index_range('workers')]:
+        with contextlib.suppress(KeyError):
+            del db[k]
 
-    db['metrics'] = flavor.default_metrics()
+
+def make_monitor(flavor: flavors.Flavor) -> evaluation.Monitor:
+    config = flask.current_app.config
+    return evaluation.Monitor(
+        metrics=flavor.default_metrics,
+        window_size=int(config['METRICS_WINDOW_SIZE']),
+        window_period=float(config['METRICS_WINDOW_PERIOD'])
+    )
 
 
 def add_model(model: river.base.Estimator, name: str = None) -> str:
@@ -188,14 +953,395 @@ def add_model(model: river.base.Estimator, name: str = None) -> str:
             if f'models/{name}' not in db:
                 break
 
-    db[f'models/{name}'] = model
+    # The metrics, the metadata, and the feature index of a model which is being replaced are not
+    # relevant anymore
+    drop_metrics(name)
+    for key in (f'meta/{name}', f'columns/{name}'):
+        with contextlib.suppress(KeyError):
+            del db[key]
+
+    # Whether or not the model modifies the features it is given is found out once and for all, so
+    # that the features are only copied for the models which need it
+    flavor = db.get('flavor')
+    mutates = flavor.mutating_methods(model) if flavor is not None else None
+
+    store_model(name, model)
+    meta = db[f'meta/{name}']
+    meta['mutates'] = mutates
+    db[f'meta/{name}'] = meta
+    db.index_add('models', name)
 
     return name
 
 
 def delete_model(name: str):
     db = get_db()
-    del db['models/{name}']
+    del db[f'models/{name}']
+    manager = model_manager()
+    if manager is not None:
+        manager.discard(name)
+    drop_metrics(name)
+    with contextlib.suppress(KeyError):
+        del db[f'meta/{name}']
+    with contextlib.suppress(KeyError):
+        del db[f'compiled/{name}']
+    with contextlib.suppress(KeyError):
+        del db[f'columns/{name}']
+    db.index_remove('models', name)
+
+
+def model_version(name: str) -> typing.Optional[str]:
+    """Return an opaque token which changes each time a model is updated or replaced."""
+    db = get_db()
+    try:
+        return db[f'meta/{name}']['version']
+    except KeyError:
+        return None
+
+
+def model_generation(name: str) -> typing.Optional[str]:
+    """Return an opaque token which changes each time a model is replaced, but not when it is
+    updated."""
+    db = get_db()
+    return db.get(f'meta/{name}', {}).get('generation')
+
+
+def bump_model_version(name: str, version: typing.Optional[str] = None) -> str:
+    """Record that a model has been updated, along with its new version."""
+    db = get_db()
+    meta = _bump_meta(db.get(f'meta/{name}'), version, size=db.raw_size(f'models/{name}'))
+    db[f'meta/{name}'] = meta
+    return meta['version']
+
+
+def mutating_methods(name: str) -> typing.Optional[typing.List[str]]:
+    """Return the methods of a model which modify the features they are given, or `None` if this
+    isn't known."""
+    db = get_db()
+    return db.get(f'meta/{name}', {}).get('mutates')
+
+
+def record_mutation(name: str, method: str):
+    """Record that a method of a model modifies the features it is given."""
+    db = get_db()
+
+    def attempt(tx):
+        meta = tx.get(f'meta/{name}')
+        mutates = (meta or {}).get('mutates')
+        if meta is None or mutates is None or method in mutates:
+            return
+        meta['mutates'] = mutates + [method]
+        tx[f'meta/{name}'] = meta
+
+    retries = int(flask.current_app.config['MODEL_UPDATE_RETRIES'])
+    db.transaction([f'meta/{name}'], attempt, retries=retries)
+
+
+def _bump_meta(meta: typing.Optional[dict], version: typing.Optional[str], size: int) -> dict:
+    now = time.time()
+    if meta is None:
+        meta = {'created': now, 'generation': uuid.uuid4().hex, 'n_updates': 0}
+    else:
+        meta['n_updates'] = meta.get('n_updates', 0) + 1
+    meta['version'] = version or uuid.uuid4().hex
+    meta['updated'] = now
+    meta['size'] = size
+    return meta
+
+
+def model_meta(name: str) -> dict:
+    """Return the metadata of a model: when it was created and last updated, how many times it has
+    been updated, and how many bytes it takes up in the storage backend."""
+    db = get_db()
+    meta = db.get(f'meta/{name}', {})
+    return {
+        'name': name,
+        'created': meta.get('created'),
+        'updated': meta.get('updated'),
+        'n_updates': meta.get('n_updates'),
+        'size': meta.get('size')
+    }
+
+
+_MODEL_MANAGER = None
+
+
+def model_manager() -> typing.Optional[residency.ModelManager]:
+    """Return the process-wide model manager, or `None` if models are not kept in memory."""
+    global _MODEL_MANAGER
+    config = flask.current_app.config
+    budget = int(config['MODEL_MEMORY_BUDGET'])
+    if not budget:
+        return None
+    if _MODEL_MANAGER is None:
+        _MODEL_MANAGER = residency.ModelManager(
+            budget=budget,
+            policy=config['MODEL_EVICTION_POLICY'],
+            write_back=config['MODEL_WRITE_BACK'],
+            flush_interval=float(config['MODEL_FLUSH_INTERVAL'])
+        )
+    return _MODEL_MANAGER
+
+
+def model_lock(name: str) -> typing.ContextManager:
+    """Return the lock to hold from the moment a model is checked out until it is committed, when
+    the model is shared by the requests of the process, which is the case when the model manager
+    keeps it in memory. Otherwise each request modifies its own copy of the model, and nothing has
+    to be locked."""
+    db = get_db()
+    manager = model_manager()
+    if manager is not None:
+        return manager.lock(name)
+    if db.shares_objects:
+        return db.lock(f'models/{name}')
+    return contextlib.nullcontext()
+
+
+def revert_model(name: str):
+    """Undo the modifications made to a checked out model, which is not going to be committed."""
+    db = get_db()
+    db.revert(f'models/{name}')
+    manager = model_manager()
+    if manager is not None:
+        manager.revert(name)
+
+
+def checkout_model(name: str) -> typing.Tuple[typing.Any, typing.Optional[str]]:
+    """Retrieve a model along with its version, which is to be given to `commit_model` once the
+    model has been modified. A `KeyError` is raised if there is no model with the given name."""
+
+    db = get_db()
+    manager = model_manager()
+
+    # The version is read first, so that it can't be more recent than the model
+    version = model_version(name)
+    if manager is None:
+        return db[f'models/{name}'], version
+    return manager.get(db, name, version=version), version
+
+
+def checkout_replica(name: str) -> typing.Tuple[typing.Any, typing.Optional[str],
+                                                typing.Optional[str]]:
+    """Retrieve a model along with its version and its generation, which is what a replica is
+    forked from."""
+    generation = model_generation(name)
+    model, version = checkout_model(name)
+    return model, version, generation
+
+
+def load_raw_model(name: str) -> bytes:
+    """Retrieve a model in its serialized form, without deserializing it."""
+    db = get_db()
+    manager = model_manager()
+    if manager is not None:
+        with manager.lock(name):
+            manager.flush(db, names=[name])
+    return db.get_raw(f'models/{name}')
+
+
+def store_model(name: str, model, bump=True):
+    """Store a model. The version of the model is bumped unless `bump` is `False`, which is for
+    modifications that don't stem from learning, such as the ones made when predicting."""
+
+    db = get_db()
+    manager = model_manager()
+
+    # The version is bumped after the model is stored, so that the version never refers to a
+    # model which hasn't been stored yet
+    new_version = uuid.uuid4().hex
+    version = new_version if bump else model_version(name)
+    if manager is None:
+        db[f'models/{name}'] = model
+    else:
+        manager.put(db, name, model, version=version)
+    if bump:
+        store_compiled_model(name, model, new_version)
+        bump_model_version(name, version=new_version)
+
+
+def commit_model(name: str, model, based_on: typing.Optional[str],
+                 reapply: typing.Optional[typing.Callable] = None, bump=True,
+                 generation: typing.Optional[str] = None) -> bool:
+    """Store a model which was modified after being checked out at version `based_on`.
+
+    Several workers may modify the same model at the same time. If the model has been updated since
+    it was checked out, then the latest model is loaded and `reapply` is applied to it, which is
+    retried at most `MODEL_UPDATE_RETRIES` times. If `reapply` is not provided, the model is not
+    stored. If `generation` is provided, then the model is not stored either if it has been replaced
+    since it was checked out. Returns whether or not the model was stored.
+
+    """
+
+    db = get_db()
+    manager = model_manager()
+
+    # When a single process is assumed, the model is shared by the requests of the process, and
+    # therefore already contains the updates of the other requests
+    if db.shares_objects or (manager is not None and manager.write_back):
+        store_model(name, model, bump=bump)
+        return True
+
+    new_version = uuid.uuid4().hex
+    key = f'models/{name}'
+    conflicts = 0
+
+    def attempt(tx):
+        nonlocal conflicts
+        meta = tx.get(f'meta/{name}')
+        version = (meta or {}).get('version')
+        if generation is not None and (meta or {}).get('generation') != generation:
+            return None
+        latest = model
+        # A model kept in memory by the manager is shared by the requests of the process, in which
+        # case it is up to date if it is the latest version that has been stored
+        if version != based_on and not (
+            manager is not None and manager.holds(name, model, version)
+        ):
+            conflicts += 1
+            if reapply is None:
+                return None
+            try:
+                latest = dill.loads(tx.get_raw(key))
+            except KeyError:  # the model has been deleted
+                return None
+            reapply(latest)
+        blob = dill.dumps(latest)
+        tx.set_raw(key, blob)
+        if bump:
+            tx[f'meta/{name}'] = _bump_meta(meta, new_version, size=len(blob))
+            version = new_version
+        return latest, blob, version
+
+    retries = n_retries = int(flask.current_app.config['MODEL_UPDATE_RETRIES'])
+    try:
+        result, n_retries = db.transaction([key, f'meta/{name}'], attempt, retries=retries)
+    finally:
+        # Conflicts are only counted for learning, as predictions are dropped when they conflict
+        if bump and (conflicts or n_retries):
+            db.incr('counters', {'update_conflicts': conflicts, 'update_retries': n_retries})
+
+    if result is None:
+        return False
+    latest, blob, version = result
+    if bump:
+        store_compiled_model(name, latest, version)
+    if manager is not None:
+        manager.put(db, name, latest, version=version, blob=blob)
+    return True
+
+
+def store_compiled_model(name: str, model, version: str):
+    """Store the compiled form of a version of a model, if compiled models are enabled and the
+    model can be compiled. A compiled form which doesn't match the model anymore is removed."""
+
+    if not flask.current_app.config['COMPILED_MODELS']:
+        return
+
+    db = get_db()
+    compiled = compiling.compile_model(model)
+    if compiled is None:
+        with contextlib.suppress(KeyError):
+            del db[f'compiled/{name}']
+        return
+    db[f'compiled/{name}'] = {'version': version, 'model': compiled}
+
+
+def load_compiled_model(name: str) -> typing.Tuple[typing.Optional[compiling.CompiledLinearModel],
+                                                   typing.Optional[str]]:
+    """Return the compiled form of a model along with its version, or `None` if there is no
+    compiled form of the current version of the model."""
+    db = get_db()
+    entry = db.get(f'compiled/{name}')
+    if entry is None or entry['version'] != model_version(name):
+        return None, None
+    return entry['model'], entry['version']
+
+
+def merge_replica(name: str, replica: averaging.Replica, weight: float):
+    """Merge the updates of a replica into the shared model, and start the replica over from the
+    result. The updates are applied again if the shared model has been updated in the meantime.
+    They are dropped if the shared model has been replaced since the replica was forked, as they
+    don't apply to the new model, or if they can't be merged for any other reason."""
+
+    with model_lock(name):
+
+        if replica.generation == model_generation(name):
+            try:
+                merged = copy.deepcopy(replica.base)
+                replica.merge_into(merged, weight)
+                commit_model(
+                    name, merged,
+                    based_on=replica.version,
+                    reapply=lambda latest: replica.merge_into(latest, weight),
+                    generation=replica.generation
+                )
+            except Exception as e:
+                flask.current_app.logger.warning(
+                    f'The updates of the replica of {name} were dropped: {e!r}'
+                )
+
+        # The replica starts over even if its updates were dropped, so that it doesn't fail again
+        try:
+            replica.reset(*checkout_replica(name))
+        except KeyError:  # the model has been deleted
+            averaging.forget(name)
+
+
+def merge_replicas(weight: float, idle_for: float = 0.):
+    """Merge the replicas of the process which have learnt something and which were forked at least
+    `idle_for` seconds ago."""
+    for name, replica in averaging.replicas():
+        with replica.lock:
+            if replica.n_samples and time.monotonic() - replica.forked_at >= idle_for:
+                merge_replica(name, replica, weight)
+
+
+def feature_index(name: str) -> columns.FeatureIndex:
+    """Return the feature index of a model, which is read from the database the first time."""
+    db = get_db()
+    return columns.get_index(name, load=lambda name: db.get(f'columns/{name}', []))
+
+
+def store_feature_index(name: str, index: columns.FeatureIndex):
+    """Store the names of a feature index. The names indexed by other processes in the meantime are
+    kept, and the index adopts the stored order, so that every process gives the same column to a
+    feature."""
+
+    db = get_db()
+    key = f'columns/{name}'
+
+    def attempt(tx):
+        stored = tx.get(key) or []
+        known = set(stored)
+        new = [feature for feature in index.names if feature not in known]
+        if new:
+            tx[key] = stored + new
+        return stored + new
+
+    retries = int(flask.current_app.config['MODEL_UPDATE_RETRIES'])
+    names, _ = db.transaction([key], attempt, retries=retries)
+    index.rebase(names)
+
+
+def model_names(offset=0, limit=None) -> typing.List[str]:
+    """Return the sorted names of the stored models.
+
+    The names are read from an index, so that the other keys don't have to be scanned. Databases
+    created before the index existed are indexed the first time this is called.
+
+    """
+
+    db = get_db()
+
+    if 'indexed' not in db:
+        for key in list(db):
+            if key.startswith('models/'):
+                db.index_add('models', key.split('/', 1)[1])
+        db['indexed'] = True
+
+    if limit == 0:
+        return []
+    return db.index_range('models', offset, None if limit is None else offset + limit)
 
 
 def _random_slug(rng=random) -> str:
@@ -0,0 +1,83 @@
+"""Compares learning with a single stream to learning with several processes whose replicas are
+periodically merged, which is what happens when PARALLEL_LEARNERS is set."""
+
+import argparse
+import concurrent.futures
+import copy
+import itertools
+import time
+
+from river import datasets
+from river import linear_model
+from river import metrics
+from river import preprocessing
+import dill
+
+from chantilly import averaging
+
+
+def make_model():
+    return preprocessing.StandardScaler() | linear_model.LinearRegression()
+
+
+def learn(blob: bytes, samples: list):
+    """Progressive validation of a replica over a partition of the samples."""
+    model = dill.loads(blob)
+    mae = metrics.MAE()
+    for x, y in samples:
+        mae.update(y, model.predict_one(x))
+        model.learn_one(x, y)
+    return dill.dumps(model), mae
+
+
+def single_stream(samples: list):
+    model = make_model()
+    mae = metrics.MAE()
+    tic = time.perf_counter()
+    for x, y in samples:
+        mae.update(y, model.predict_one(x))
+        model.learn_one(x, y)
+    return time.perf_counter() - tic, mae
+
+
+def parallel(samples: list, learners: int, merge_every: int):
+    model = make_model()
+    mae = metrics.MAE()
+    tic = time.perf_counter()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=learners) as pool:
+
+        # Each round, every learner goes through merge_every samples before the replicas are merged
+        round_size = learners * merge_every
+        for start in range(0, len(samples), round_size):
+            chunk = samples[start:start + round_size]
+            blob = dill.dumps(model)
+            partitions = [chunk[i::learners] for i in range(learners)]
+            results = pool.map(learn, itertools.repeat(blob), partitions)
+
+            merged = copy.deepcopy(model)
+            for replica_blob, replica_mae in results:
+                averaging.merge_delta(merged, model, dill.loads(replica_blob), weight=1 / learners)
+                mae._mean += replica_mae._mean
+            model = merged
+
+    return time.perf_counter() - tic, mae
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=200_000)
+    parser.add_argument('--learners', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--merge-every', type=int, default=5_000)
+    args = parser.parse_args()
+
+    samples = list(datasets.synth.Friedman(seed=42).take(args.samples))
+
+    duration, mae = single_stream(samples)
+    print(f'{"learners":>8}  {"samples/s":>10}  {"MAE":>8}')
+    print(f'{1:>8}  {len(samples) / duration:>10,.0f}  {mae.get():>8.4f}')
+
+    for learners in args.learners:
+        duration, mae = parallel(samples, learners, args.merge_every)
+        print(f'{learners:>8}  {len(samples) / duration:>10,.0f}  {mae.get():>8.4f}')
@@ -11,7 +11,7 @@ LONG_DESCRIPTION_CONTENT_TYPE = 'text/markdown'
 URL = 'https://github.com/creme-ml/chantilly'
 EMAIL = 'maxhalford25@gmail.com'
 AUTHOR = 'Max Halford'
-REQUIRES_PYTHON = '>=3.7.0'
+REQUIRES_PYTHON = '>=3.11.0'
 
 # Import the README and use it as the long-description.
 with io.open(os.path.join(here, 'README.md'), encoding='utf-8') as f:
@@ -37,8 +37,7 @@ setup(
         'License :: OSI Approved :: BSD License',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.7',
-        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.11',
         'Programming Language :: Python :: Implementation :: CPython',
         'Programming Language :: Python :: Implementation :: PyPy'
     ],
@@ -49,16 +48,20 @@ setup(
     zip_safe=False,
     install_requires=[
         'cerberus>=1.3.2',
-        'river>=0.9.0',
+        'river>=0.26.1',
         'dill>=0.3.1.1',
+        'numpy>=1.18',
         'Flask>=1.1.1'
     ],
     extras_require={
         'redis': ['redis>=3.5'],
+        'zstd': ['zstandard>=0.15'],
+        'client': ['httpx>=0.23'],
         'dev': [
             'flake8>=3.7.9',
             'mypy>=0.770',
             'pytest>=5.3.5',
+            'pytest-benchmark>=3.2',
             'pytest-cov>=2.8.1'
         ]
     },
@@ -0,0 +1,27 @@
+import pickle
+
+from river import datasets
+from river import linear_model
+from river import preprocessing
+import pytest
+
+
+@pytest.fixture(scope='session')
+def samples():
+    return list(datasets.Phishing())
+
+
+@pytest.fixture
+def phishing(client, samples):
+    """A logistic regression which has learnt from the phishing dataset, served by chantilly."""
+    client.post('/api/init', json={'flavor': 'binary'})
+    model = preprocessing.StandardScaler() | linear_model.LogisticRegression()
+    for x, y in samples:
+        model.learn_one(x, y)
+    client.post('/api/model/phishing', data=pickle.dumps(model))
+
+
+def pytest_benchmark_update_json(config, benchmarks, output_json):
+    """The timings of each round are left out of saved runs, only the statistics are compared."""
+    for bench in output_json['benchmarks']:
+        bench['stats'].pop('data', None)
@@ -0,0 +1,50 @@
+import itertools
+import time
+
+from river import linear_model
+import flask
+
+from chantilly import api
+from chantilly import storage
+
+
+def test_predict(benchmark, client, phishing, samples):
+    xs = itertools.cycle(x for x, _ in samples)
+    benchmark(lambda: client.post('/api/predict', json={'features': next(xs)}))
+
+
+def test_predict_with_id(benchmark, client, phishing, samples):
+    xs = itertools.cycle(x for x, _ in samples)
+    ids = itertools.count()
+    benchmark(lambda: client.post('/api/predict', json={'features': next(xs), 'id': next(ids)}))
+
+
+def test_learn(benchmark, client, phishing, samples):
+    events = itertools.cycle(samples)
+
+    def learn():
+        x, y = next(events)
+        client.post('/api/learn', json={'features': x, 'ground_truth': y})
+
+    benchmark(learn)
+
+
+def test_list_models(benchmark, app, client, phishing):
+
+    # Many models, as well as many pending predictions which aren't models
+    with app.app_context():
+        db = storage.get_db()
+        for i in range(500):
+            storage.add_model(linear_model.LogisticRegression(), name=f'model-{i:03d}')
+        for i in range(5000):
+            db[f'#{i}'] = {'model': 'phishing', 'features': {}, 'prediction': {}}
+
+    r = benchmark(lambda: client.get('/api/models', query_string={'limit': 100}))
+    assert len(r.json['models']) == 100
+
+
+def test_after_request(benchmark, app, phishing):
+    with app.test_request_context('/api/predict', method='POST'):
+        flask.request.started_at = time.perf_counter_ns()
+        flask.g.admitted = True
+        benchmark(api.after_request_func, flask.Response())
@@ -0,0 +1,51 @@
+from river import compose
+from river import feature_extraction
+from river import linear_model
+from river import naive_bayes
+from river import preprocessing
+from river import tree
+import dill
+import pytest
+
+
+def logistic_regression():
+    return preprocessing.StandardScaler() | linear_model.LogisticRegression()
+
+
+def hoeffding_tree():
+    return tree.HoeffdingTreeClassifier()
+
+
+def one_hot_and_scaling():
+    return (
+        compose.Select('empty_server_form_handler', 'popup_window', 'https')
+        | preprocessing.OneHotEncoder()
+    ) + preprocessing.StandardScaler() | linear_model.LogisticRegression()
+
+
+def text_classifier():
+    return (
+        compose.FuncTransformer(lambda x: ' '.join(f'{k}_{round(v, 1)}' for k, v in x.items()))
+        | feature_extraction.TFIDF()
+        | naive_bayes.MultinomialNB()
+    )
+
+
+PIPELINES = [logistic_regression, hoeffding_tree, one_hot_and_scaling, text_classifier]
+
+
+@pytest.fixture(params=PIPELINES, ids=[pipeline.__name__ for pipeline in PIPELINES])
+def model(request, samples):
+    model = request.param()
+    for x, y in samples:
+        model.learn_one(x, y)
+    return model
+
+
+def test_dumps(benchmark, model):
+    benchmark(dill.dumps, model)
+
+
+def test_loads(benchmark, model):
+    blob = dill.dumps(model)
+    benchmark(dill.loads, blob)
@@ -0,0 +1,39 @@
+"""Benchmarks of the storage backends, which the `app` fixture is parametrized with."""
+import itertools
+
+from river import linear_model
+from river import preprocessing
+import dill
+import pytest
+
+from chantilly import storage
+
+
+@pytest.fixture
+def db(app, samples):
+    with app.app_context():
+        model = preprocessing.StandardScaler() | linear_model.LogisticRegression()
+        for x, y in samples:
+            model.learn_one(x, y)
+        db = storage.get_db()
+        db.set_raw('models/phishing', dill.dumps(model))
+        yield db
+
+
+def test_get_raw(benchmark, db):
+    benchmark(db.get_raw, 'models/phishing')
+
+
+def test_set_raw(benchmark, db):
+    blob = db.get_raw('models/phishing')
+    benchmark(db.set_raw, 'models/phishing', blob)
+
+
+def test_set_item(benchmark, db, samples):
+    ids = itertools.count()
+    x, _ = samples[0]
+    benchmark(lambda: db.__setitem__(f'#{next(ids)}', {'features': x, 'prediction': .5}))
+
+
+def test_incr(benchmark, db):
+    benchmark(db.incr, 'counters', {'predict_calls': 1, 'predict_duration': 1000})
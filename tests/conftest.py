@@ -1,3 +1,4 @@
+import os
 import uuid
 
 from chantilly import create_app
@@ -5,13 +6,23 @@ from chantilly import storage
 import pytest
 
 
+# The benchmarks are only collected when asked for
+collect_ignore = []
+
+
 def pytest_addoption(parser):
     parser.addoption('--redis', action='store_true', help='redis storage backend')
+    parser.addoption('--bench', action='store_true', help='run the benchmarks')
+
+
+def pytest_configure(config):
+    if not config.getoption('bench'):
+        collect_ignore.append('benchmarks')
 
 
 def pytest_generate_tests(metafunc):
 
-    backends = ['shelve']
+    backends = ['shelve', 'memory']
 
     if metafunc.config.getoption('redis'):
         backends.append('redis')
@@ -28,6 +39,12 @@ def app(request):
             'TESTING': True,
             'SHELVE_PATH': str(uuid.uuid4())
         }
+    elif request.param == 'memory':
+        config = {
+            'TESTING': True,
+            'STORAGE_BACKEND': 'memory',
+            'MEMORY_PATH': str(uuid.uuid4())
+        }
     elif request.param == 'redis':
         config = {
             'SECRET_KEY': 'dev',
@@ -43,6 +60,8 @@ def app(request):
 
     with app.app_context():
         storage.drop_db()
+    if request.param == 'shelve':
+        os.remove(f"{config['SHELVE_PATH']}.lock")
 
 
 @pytest.fixture
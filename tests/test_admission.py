@@ -0,0 +1,46 @@
+import threading
+import time
+
+import pytest
+
+from chantilly import admission
+from chantilly import exceptions
+
+
+def test_latency_window_batch():
+
+    window = admission.LatencyWindow()
+    window.record(1)
+    window.record(.1, n=9)
+    assert window.quantile(.9) == .1
+    assert window.quantile(.99) == 1
+
+
+def test_limiter():
+
+    limiter = admission.Limiter()
+    limiter.acquire(limit=1, queue_size=1, timeout=1, retry_after=1)
+
+    # The queue is full
+    waiter = threading.Thread(
+        target=limiter.acquire,
+        kwargs={'limit': 1, 'queue_size': 1, 'timeout': 1, 'retry_after': 1}
+    )
+    waiter.start()
+    while not limiter.waiting:
+        time.sleep(.001)
+    with pytest.raises(exceptions.Overloaded) as excinfo:
+        limiter.acquire(limit=1, queue_size=1, timeout=1, retry_after=1)
+    assert excinfo.value.status_code == 429
+
+    # The waiting request is admitted once the slot is released
+    limiter.release()
+    waiter.join()
+    assert limiter.in_flight == 1
+
+    # A request which waits for too long is turned away
+    with pytest.raises(exceptions.Overloaded) as excinfo:
+        limiter.acquire(limit=1, queue_size=1, timeout=.01, retry_after=2)
+    assert excinfo.value.status_code == 503
+    assert excinfo.value.headers == {'Retry-After': '2'}
+    assert limiter.rejected == 2
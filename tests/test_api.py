@@ -1,6 +1,10 @@
+import gzip
 import json
+import math
 import pickle
 import pytest
+import threading
+import time
 import uuid
 
 import river
@@ -9,6 +13,11 @@ from river import linear_model
 from river import preprocessing
 import flask
 
+from chantilly import admission
+from chantilly import api
+from chantilly import averaging
+from chantilly import dedup
+from chantilly import exceptions
 from chantilly import storage
 
 
@@ -134,6 +143,33 @@ def test_delete_model(client, app, regression):
         assert 'models/healthy-banana' not in storage.get_db()
 
 
+def test_get_model_conditional(client, app, regression, lin_reg):
+
+    r = client.get('/api/model/lin-reg')
+    assert r.status_code == 200
+    assert r.headers['Content-Type'] == 'application/octet-stream'
+    etag = r.headers['ETag']
+
+    r = client.get('/api/model/lin-reg', headers={'If-None-Match': etag})
+    assert r.status_code == 304
+    assert r.get_data() == b''
+
+    # Learning changes the version of the model, and thus its ETag
+    client.post('/api/learn', json={'features': {'x': 1}, 'ground_truth': 2})
+    r = client.get('/api/model/lin-reg', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert r.headers['ETag'] != etag
+    assert pickle.loads(r.get_data())['LinearRegression'].intercept != 0
+
+    assert client.get('/api/model/zugzug').status_code == 404
+
+
+def test_get_model_gzip(client, app, regression, lin_reg):
+    r = client.get('/api/model/lin-reg', headers={'Accept-Encoding': 'gzip'})
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert isinstance(pickle.loads(gzip.decompress(r.get_data())), river.compose.Pipeline)
+
+
 def test_models(client, app, regression):
 
     model = linear_model.LinearRegression()
@@ -144,6 +180,34 @@ def test_models(client, app, regression):
     assert r.json == {'default': 'barney-stinson', 'models': ['barney-stinson', 'ted-mosby']}
 
 
+def test_models_pagination(client, app, regression):
+
+    model = linear_model.LinearRegression()
+    for name in ['a', 'b', 'c', 'd']:
+        client.post(f'/api/model/{name}', data=pickle.dumps(model))
+
+    assert client.get('/api/models?limit=2').json['models'] == ['a', 'b']
+    assert client.get('/api/models?offset=2&limit=10').json['models'] == ['c', 'd']
+    assert client.get('/api/models?limit=0').json['models'] == []
+
+    client.delete('/api/model/b')
+    assert client.get('/api/models?offset=1').json['models'] == ['c', 'd']
+
+    r = client.get('/api/models?offset=-1')
+    assert r.status_code == 400
+
+
+def test_models_details(client, app, regression, lin_reg):
+
+    client.post('/api/learn', json={'features': {'x': 1}, 'ground_truth': 2})
+
+    meta, = client.get('/api/models?details=true').json['models']
+    assert meta['name'] == 'lin-reg'
+    assert meta['n_updates'] == 1
+    assert meta['size'] > 0
+    assert meta['created'] <= meta['updated']
+
+
 def test_predict_no_model(client, app, regression):
     r = client.post('/api/predict',
         data=json.dumps({'features': {}}),
@@ -275,6 +339,84 @@ def test_learn_model_name(client, app, regression, lin_reg):
     assert r.status_code == 201
 
 
+def test_batch_predict(client, app, regression, lin_reg):
+    r = client.post('/api/batch/predict',
+        data=json.dumps({'items': [
+            {'features': {'x': 1}, 'id': 'a'},
+            {'features': {'x': 2}},
+            {'features': {'x': 3}, 'model': 'healthy-banana'}
+        ]}),
+        content_type='application/json'
+    )
+    assert r.status_code == 200
+    assert r.json['results'] == [
+        {'status': 201, 'model': 'lin-reg', 'prediction': 0},
+        {'status': 200, 'model': 'lin-reg', 'prediction': 0},
+        {'status': 400, 'message': "No model named 'healthy-banana'."}
+    ]
+
+    stats = client.get('/api/stats').json
+    assert stats['predict']['n_calls'] == 3
+
+    # Each item counts as one prediction towards the latency percentiles
+    window = admission._LATENCIES['predict']
+    assert len(window._durations) == 3
+    assert len({duration for _, duration in window._durations}) == 1
+
+
+def test_batch_predict_invalid_item(client, app, regression, lin_reg, monkeypatch):
+
+    batches = []
+    make_predictions = api.make_predictions
+
+    def record(model_name, batch):
+        batches.append(batch)
+        return make_predictions(model_name, batch)
+
+    monkeypatch.setattr(api, 'make_predictions', record)
+    r = client.post('/api/batch/predict', json={'items': [
+        {'features': {'x': 1}},
+        {'features': {'x': 2}, 'id': [1]},
+        {'features': {'x': 3}}
+    ]})
+    assert r.status_code == 200
+    assert [result['status'] for result in r.json['results']] == [200, 400, 200]
+    assert 'id' in r.json['results'][1]['message']
+
+    # The invalid item isn't predicted along with the others
+    assert batches == [[{'x': 1}, {'x': 3}]]
+
+
+def test_batch_learn(client, app, regression, lin_reg):
+    client.post('/api/predict',
+        data=json.dumps({'features': {'x': 1}, 'id': 'a'}),
+        content_type='application/json'
+    )
+    r = client.post('/api/batch/learn',
+        data=json.dumps({'items': [
+            {'id': 'a', 'ground_truth': 1},
+            {'features': {'x': 2}, 'ground_truth': 2},
+            {'features': {'x': 3}}
+        ]}),
+        content_type='application/json'
+    )
+    assert r.status_code == 200
+    assert r.json['results'] == [
+        {'status': 201},
+        {'status': 201},
+        {'status': 400, 'message': {'ground_truth': ['required field']}}
+    ]
+
+    stats = client.get('/api/stats').json
+    assert stats['learn']['n_calls'] == 3
+
+
+def test_batch_no_items(client, app, regression, lin_reg):
+    r = client.post('/api/batch/predict', data=json.dumps({}), content_type='application/json')
+    assert r.status_code == 400
+    assert r.json == {'message': {'items': ['required field']}}
+
+
 def test_stats_no_flavor(client, app):
     r = client.get('/api/stats')
     assert r.status_code == 400
@@ -298,7 +440,8 @@ def test_stats(client, app, regression):
             'mean_duration': 0.0,
             'mean_duration_human': '0ns',
             'n_calls': 0
-        }
+        },
+        'updates': {'conflicts': 0, 'retries': 0}
     }
 
 
@@ -329,3 +472,683 @@ def test_metrics_no_flavor(client, app):
 def test_metrics_with_flavor(client, app, regression):
     r = client.get('/api/metrics')
     assert len(r.json) > 0
+
+
+def test_metrics_unknown_model(client, app, regression):
+    r = client.get('/api/metrics?model=healthy-banana')
+    assert r.status_code == 400
+    assert r.json == {'message': "No model named 'healthy-banana'."}
+
+
+def test_metrics_per_model(client, app, regression):
+
+    model = linear_model.LinearRegression()
+    client.post('/api/model/ted-mosby', data=pickle.dumps(model))
+    client.post('/api/model/barney-stinson', data=pickle.dumps(model))
+
+    client.post('/api/learn', json={'features': {'x': 1}, 'ground_truth': 2, 'model': 'ted-mosby'})
+
+    assert client.get('/api/metrics?model=ted-mosby').json['MAE'] == 2
+    assert client.get('/api/metrics?model=barney-stinson').json['MAE'] == 0
+    assert client.get('/api/metrics').json['MAE'] == 2
+
+
+def test_shadow_mode(client, app, regression):
+
+    app.config['SHADOW_MODE'] = True
+
+    client.post('/api/model/ted-mosby', data=pickle.dumps(linear_model.LinearRegression()))
+    client.post('/api/model/barney-stinson', data=pickle.dumps(linear_model.LinearRegression()))
+
+    ted = linear_model.LinearRegression()
+    barney = linear_model.LinearRegression()
+
+    for i, (x, y) in enumerate(datasets.TrumpApproval().take(10)):
+
+        r = client.post('/api/predict', json={'id': i, 'features': x})
+        assert r.json['model'] == 'barney-stinson'
+        assert r.json['prediction'] == barney.predict_one(x)
+        client.post('/api/learn', json={'id': i, 'ground_truth': y})
+
+        # Every model learns from the event, not just the default one
+        barney.learn_one(x, y)
+        ted.learn_one(x, y)
+
+    with app.app_context():
+        db = storage.get_db()
+        assert db['models/barney-stinson'].weights == barney.weights
+        assert db['models/ted-mosby'].weights == ted.weights
+
+    barney_mae = client.get('/api/metrics?model=barney-stinson').json['MAE']
+    ted_mae = client.get('/api/metrics?model=ted-mosby').json['MAE']
+    assert barney_mae == ted_mae > 0
+
+
+def test_shadow_mode_failed_commit(client, app, regression, monkeypatch):
+
+    app.config['SHADOW_MODE'] = True
+
+    client.post('/api/model/ted-mosby', data=pickle.dumps(linear_model.LinearRegression()))
+    client.post('/api/model/barney-stinson', data=pickle.dumps(linear_model.LinearRegression()))
+
+    commit_model = storage.commit_model
+
+    def flaky_commit_model(name, *args, **kwargs):
+        if name == 'ted-mosby':
+            raise exceptions.ConcurrentUpdate
+        return commit_model(name, *args, **kwargs)
+
+    # A challenger which can't be stored doesn't make the requests fail
+    monkeypatch.setattr(storage, 'commit_model', flaky_commit_model)
+    r = client.post('/api/predict', json={'id': 1, 'features': {'x': 1}})
+    assert r.status_code == 201
+    r = client.post('/api/learn', json={'id': 1, 'ground_truth': 2})
+    assert r.status_code == 201
+
+    barney = linear_model.LinearRegression()
+    barney.learn_one({'x': 1}, 2)
+    with app.app_context():
+        db = storage.get_db()
+        assert db['models/barney-stinson'].weights == barney.weights
+        assert db['models/ted-mosby'].weights == {}
+    assert client.get('/api/metrics?model=barney-stinson').json['MAE'] == 2
+    assert client.get('/api/metrics?model=ted-mosby').json['MAE'] == 0
+
+
+def test_metrics_unknown_window(client, app, regression):
+    r = client.get('/api/metrics?window=fortnight')
+    assert r.status_code == 400
+    assert r.json == {'message': "Unknown window 'fortnight'. Allowed windows are 'all', 'size', 'period'."}
+
+
+def test_metrics_windows(client, app, regression, lin_reg):
+
+    app.config['METRICS_WINDOW_SIZE'] = 2
+    client.post('/api/init', json={'flavor': 'regression'})
+    client.post('/api/model/lin-reg', data=pickle.dumps(linear_model.LinearRegression()))
+
+    for y in (10, 2, 4):
+        client.post('/api/learn', json={'features': {}, 'ground_truth': y})
+
+    # The model doesn't have any features, so it's only learning an intercept
+    errors = []
+    model = linear_model.LinearRegression()
+    for y in (10, 2, 4):
+        errors.append(abs(y - model.predict_one({})))
+        model.learn_one({}, y)
+
+    assert math.isclose(client.get('/api/metrics').json['MAE'], sum(errors) / 3)
+    assert math.isclose(client.get('/api/metrics?window=size').json['MAE'], sum(errors[1:]) / 2)
+    assert math.isclose(client.get('/api/metrics?window=period').json['MAE'], sum(errors) / 3)
+    assert math.isclose(
+        client.get('/api/metrics?model=lin-reg&window=size').json['MAE'],
+        sum(errors[1:]) / 2
+    )
+
+
+def test_metrics_history_no_flavor(client, app):
+    r = client.get('/api/metrics/history')
+    assert r.json == {'message': 'No flavor has been set.'}
+
+
+def test_metrics_history(client, app, regression, lin_reg, monkeypatch):
+
+    # The metrics of every worker are merged before being recorded
+    for i, y in enumerate((1, 2)):
+        monkeypatch.setattr(storage, 'worker_id', lambda: f'worker-{i}')
+        client.post('/api/learn', json={'features': {}, 'ground_truth': y})
+        api._REPORTED_AT.clear()
+
+    history = client.get('/api/metrics/history').json
+    assert history['resolution'] == 1
+    assert sorted(history['metrics']) == ['MAE', 'RMSE', 'SMAPE']
+    t, mae = history['metrics']['MAE'][-1]
+    assert mae == client.get('/api/metrics').json['MAE']
+
+    history = client.get('/api/metrics/history?model=lin-reg&resolution=60').json
+    assert history['resolution'] == 60
+    assert history['metrics']['MAE'][-1][1] == mae
+
+    history = client.get(f'/api/metrics/history?start={t + 1}').json
+    assert history['metrics']['MAE'] == []
+
+
+def test_features(client, app, regression):
+
+    r = client.post('/api/features', json={'features': {'ikea': {'x': 1}, 'lidl': {'x': 2}}})
+    assert r.status_code == 201
+    assert r.json == {'n_entities': 2}
+
+    assert client.get('/api/features/ikea').json == {'x': 1}
+    assert client.get('/api/features/aldi').status_code == 404
+
+    assert client.delete('/api/features/ikea').status_code == 204
+    assert client.get('/api/features/ikea').status_code == 404
+
+
+def test_features_bad_payload(client, app, regression):
+    r = client.post('/api/features', json={'features': {'ikea': 42}})
+    assert r.status_code == 400
+
+
+def test_predict_with_feature_store(client, app, regression, lin_reg):
+
+    client.post('/api/features', json={'features': {'ikea': {'x': 1}}})
+
+    for _ in range(3):
+        client.post('/api/learn', json={'features': 'ikea', 'ground_truth': 2})
+
+    model = preprocessing.StandardScaler() | linear_model.LinearRegression()
+    for _ in range(3):
+        model.learn_one({'x': 1}, 2)
+
+    r = client.post('/api/predict', json={'features': 'ikea', 'id': 1})
+    assert r.json['prediction'] == model.predict_one({'x': 1})
+
+    # The stored features are the ones which were used for the prediction
+    client.post('/api/features', json={'features': {'ikea': {'x': 3}}})
+    with app.app_context():
+        assert storage.get_db()['#1']['features'] == {'x': 1}
+    r = client.post('/api/predict', json={'features': 'ikea'})
+    assert r.json['prediction'] == model.predict_one({'x': 3})
+
+
+def test_prediction_cache(client, app, regression, lin_reg):
+
+    app.config['PREDICTION_CACHE_SIZE'] = 10
+
+    predict = lambda x: client.post('/api/predict', json={'features': x}).json['prediction']
+
+    p1 = predict({'x': 1, 'y': 2})
+    assert predict({'y': 2, 'x': 1}) == p1
+    predict({'x': 2, 'y': 2})
+    assert client.get('/api/stats').json['prediction_cache'] == {'hits': 1, 'misses': 2, 'size': 2}
+
+    # Learning bumps the version of the model, which invalidates the cached predictions
+    client.post('/api/learn', json={'features': {'x': 1, 'y': 2}, 'ground_truth': 5})
+    assert predict({'x': 1, 'y': 2}) != p1
+    assert client.get('/api/stats').json['prediction_cache']['misses'] == 3
+
+
+def test_prediction_batches(client, app, regression, lin_reg):
+
+    for i in range(5):
+        client.post('/api/learn', json={'features': {'x': i}, 'ground_truth': 2 * i})
+    expected = [
+        client.post('/api/predict', json={'features': {'x': i}}).json['prediction']
+        for i in range(8)
+    ]
+
+    app.config['PREDICTION_BATCH_WAIT'] = .05
+    predictions = [None] * 8
+
+    def predict(i):
+        r = app.test_client().post('/api/predict', json={'features': {'x': i}})
+        predictions[i] = r.json['prediction']
+
+    threads = [threading.Thread(target=predict, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert predictions == expected
+    batches = client.get('/api/stats').json['prediction_batches']
+    assert batches['n_batches'] * batches['mean_batch_size'] == 8
+
+    # Requests join a batch even when the storage backend is lent to one request at a time
+    assert batches['mean_batch_size'] > 1
+
+    r = client.post('/api/predict', json={'features': {'x': 1}, 'model': 'healthy-banana'})
+    assert r.status_code == 400
+    assert r.json == {'message': "No model named 'healthy-banana'."}
+
+
+def test_admission_concurrency(client, app, regression, lin_reg):
+
+    app.config['PREDICT_CONCURRENCY'] = 1
+    app.config['ADMISSION_QUEUE_SIZE'] = 0
+    app.config['RETRY_AFTER'] = 3
+
+    r = client.post('/api/predict', json={'features': {'x': 1}})
+    assert r.status_code == 200
+
+    # Another request is being processed
+    limiter = admission._LIMITERS['predict']
+    limiter.acquire(limit=1, queue_size=0, timeout=0, retry_after=3)
+    try:
+        r = client.post('/api/predict', json={'features': {'x': 1}})
+    finally:
+        limiter.release()
+    assert r.status_code == 429
+    assert r.headers['Retry-After'] == '3'
+
+    stats = client.get('/api/stats').json
+    assert stats['predict']['n_calls'] == 1
+    assert stats['admission']['predict']['rejected'] == 1
+    assert stats['admission']['predict']['in_flight'] == 0
+
+
+def test_admission_latency_slo(client, app, regression, lin_reg):
+
+    app.config['LATENCY_SLO'] = 1e-9
+
+    learn = lambda: client.post('/api/learn', json={'features': {'x': 1}, 'ground_truth': 1})
+
+    # Learning is turned away once predictions are slower than the objective
+    assert learn().status_code == 201
+    assert client.post('/api/predict', json={'features': {'x': 1}}).status_code == 200
+    r = learn()
+    assert r.status_code == 503
+    assert r.headers['Retry-After'] == '1'
+    assert client.post('/api/predict', json={'features': {'x': 1}}).status_code == 200
+
+    stats = client.get('/api/stats').json
+    assert stats['learn']['n_calls'] == 1
+    assert stats['admission']['learn']['rejected'] == 1
+
+
+def test_learn_sampling(client, app, regression, lin_reg):
+
+    app.config['LEARN_SAMPLING'] = 'uniform'
+    app.config['LEARN_SAMPLING_RATE'] = 0
+
+    for i in range(3):
+        client.post('/api/learn', json={'features': {'x': i}, 'ground_truth': i})
+
+    # The metrics are updated, but the model doesn't learn
+    assert client.get('/api/metrics').json['MAE'] == 1
+    with app.app_context():
+        model = storage.get_db()['models/lin-reg']
+        assert not model['StandardScaler'].counts
+
+    stats = client.get('/api/stats').json
+    assert stats['learn_sampling'] == {'strategy': 'uniform', 'seen': 3, 'kept': 0, 'rate': 0}
+
+
+def test_idempotent_learn(client, app, regression, lin_reg):
+
+    app.config['IDEMPOTENCY_WINDOW'] = 60
+
+    # The ID of the prediction is used as the idempotency key
+    client.post('/api/predict', json={'features': {'x': 1}, 'id': 42})
+    assert client.post('/api/learn', json={'id': 42, 'ground_truth': 1}).status_code == 201
+    r = client.post('/api/learn', json={'id': 42, 'ground_truth': 1})
+    assert r.status_code == 200
+    assert r.json == {'duplicate': True}
+
+    # The key may also be given in a header, or in the payload
+    payload = {'features': {'x': 2}, 'ground_truth': 2}
+    headers = {'Idempotency-Key': 'abc'}
+    assert client.post('/api/learn', json=payload, headers=headers).status_code == 201
+    assert client.post('/api/learn', json=payload, headers=headers).status_code == 200
+    payload['idempotency_key'] = 'def'
+    assert client.post('/api/learn', json=payload).status_code == 201
+    assert client.post('/api/learn', json=payload).status_code == 200
+
+    # Events without a key are always learnt from
+    del payload['idempotency_key']
+    assert client.post('/api/learn', json=payload).status_code == 201
+    assert client.post('/api/learn', json=payload).status_code == 201
+
+    with app.app_context():
+        model = storage.get_db()['models/lin-reg']
+        assert model['StandardScaler'].counts['x'] == 5
+    assert client.get('/api/stats').json['idempotency']['duplicates'] == 3
+
+
+def test_idempotent_learn_in_flight(client, app, regression, lin_reg):
+
+    app.config['IDEMPOTENCY_WINDOW'] = 60
+    payload = {'features': {'x': 1}, 'ground_truth': 1, 'idempotency_key': 'abc'}
+
+    # A retry which arrives while the event is being learnt from is turned away
+    recent_keys = dedup.recent_keys(app.config)
+    recent_keys.claim('abc')
+    assert client.post('/api/learn', json=payload).status_code == 409
+
+    # The key is released if learning fails, so that the client can retry
+    recent_keys.release('abc')
+    assert client.post('/api/learn', json={**payload, 'model': 'nope'}).status_code == 400
+    assert client.post('/api/learn', json=payload).status_code == 201
+    assert client.post('/api/learn', json=payload).status_code == 200
+
+
+def test_resident_models(client, app, regression, lin_reg):
+
+    app.config['MODEL_MEMORY_BUDGET'] = 10 ** 9
+
+    for _ in range(3):
+        client.post('/api/learn', json={'features': {'x': 1, 'y': 2}, 'ground_truth': 5})
+
+    # The model is loaded once, after which it stays in memory
+    usage = client.get('/api/stats').json['models']['models']['lin-reg']
+    assert usage['resident']
+    assert usage['misses'] == 1
+    assert usage['hits'] == 2
+
+    # The stored model is the one that has learnt
+    with app.app_context():
+        model = storage.get_db()['models/lin-reg']
+    assert model['LinearRegression'].intercept != 0
+
+
+def test_metrics_several_workers(client, app, regression, lin_reg, monkeypatch):
+
+    # Each worker keeps its own metrics, which are merged when they are read
+    for i, y in enumerate((1, 2, 3, 4)):
+        monkeypatch.setattr(storage, 'worker_id', lambda: f'worker-{i % 2}')
+        client.post('/api/learn', json={'features': {}, 'ground_truth': y})
+
+    with app.app_context():
+        assert storage.get_db().index_range('workers') == ['worker-0', 'worker-1']
+
+    # The metrics are the same as if a single worker had seen every sample
+    model = preprocessing.StandardScaler() | linear_model.LinearRegression()
+    mae = river.metrics.MAE()
+    for y in (1, 2, 3, 4):
+        mae.update(y, model.predict_one({}))
+        model.learn_one({}, y)
+    assert math.isclose(client.get('/api/metrics').json['MAE'], mae.get())
+    assert math.isclose(client.get('/api/metrics?model=lin-reg').json['MAE'], mae.get())
+    assert client.get('/api/stats').json['learn']['n_calls'] == 4
+
+
+def test_retire_workers(client, app, regression, lin_reg, monkeypatch):
+
+    app.config['WORKER_TIMEOUT'] = 0
+    for i, y in enumerate((1, 2, 3, 4)):
+        monkeypatch.setattr(storage, 'worker_id', lambda: f'worker-{i % 2}')
+        client.post('/api/learn', json={'features': {}, 'ground_truth': y})
+    mae = client.get('/api/metrics?model=lin-reg').json['MAE']
+
+    # The metrics of the workers which have stopped are folded into the ones of no worker in
+    # particular, without changing the merged metrics
+    monkeypatch.setattr(storage, 'worker_id', lambda: 'worker-2')
+    assert client.get('/api/metrics?model=lin-reg').json['MAE'] == mae
+    with app.app_context():
+        db = storage.get_db()
+        assert db.index_range('workers') == []
+        assert 'metrics/lin-reg@worker-0' not in db
+        assert 'metrics/lin-reg' in db
+
+
+def test_concurrent_learn(client, app, regression, lin_reg):
+
+    def learn_one(model):
+        model.learn_one({'x': 1}, 2)
+
+    with app.app_context():
+
+        if storage.get_db().shares_objects:
+            pytest.skip('the requests of a process share the same model')
+
+        # Two workers check out the same version of the model
+        model_a, version_a = storage.checkout_model('lin-reg')
+        model_b, version_b = storage.checkout_model('lin-reg')
+
+        learn_one(model_a)
+        assert storage.commit_model('lin-reg', model_a, based_on=version_a, reapply=learn_one)
+
+        # The second update is applied again on top of the first one, instead of overwriting it
+        learn_one(model_b)
+        assert storage.commit_model('lin-reg', model_b, based_on=version_b, reapply=learn_one)
+        model = storage.get_db()['models/lin-reg']
+        assert model['StandardScaler'].counts['x'] == 2
+
+        # Without a way to apply the update again, the model is left as it is. This is what
+        # happens with predictions, which therefore don't count as conflicts.
+        assert not storage.commit_model('lin-reg', model_b, based_on=version_b, bump=False)
+
+    assert client.get('/api/stats').json['updates']['conflicts'] == 1
+
+
+def test_conflict_leaves_metrics(client, app, regression, lin_reg, monkeypatch):
+
+    def commit_model(*args, **kwargs):
+        raise exceptions.ConcurrentUpdate
+
+    # The client is told to retry, so the sample mustn't be counted yet
+    monkeypatch.setattr(storage, 'commit_model', commit_model)
+    r = client.post('/api/learn', json={'features': {'x': 1}, 'ground_truth': 1})
+    assert r.status_code == 409
+    assert client.get('/api/metrics').json['MAE'] == 0
+
+    monkeypatch.undo()
+    r = client.post('/api/learn', json={'features': {'x': 1}, 'ground_truth': 1})
+    assert r.status_code == 201
+    assert client.get('/api/metrics').json['MAE'] == 1
+
+
+def test_threads_share_a_model(client, app, regression, lin_reg):
+
+    n_threads, n_samples = 8, 50
+    errors = []
+
+    def work(i):
+        c = app.test_client()
+        for j in range(n_samples):
+            x = {f'x{k}': float(i + j + k) for k in range(20)}
+            try:
+                for r in (
+                    c.post('/api/learn', json={'features': x, 'ground_truth': float(i)}),
+                    c.post('/api/predict', json={'features': x})
+                ):
+                    if r.status_code >= 400:
+                        errors.append(r.json)
+            except Exception as e:
+                errors.append(repr(e))
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Every update made it to the model, and the metrics saw every sample
+    assert errors == []
+    with app.app_context():
+        model = storage.get_db()['models/lin-reg']
+        metrics = storage.get_metrics('lin-reg')
+    assert model['StandardScaler'].counts['x0'] == n_threads * n_samples
+    assert metrics.all[0]._mean.n == n_threads * n_samples
+
+
+class Flaky:
+    """Regression model which fails halfway through learning from a negative target."""
+
+    def __init__(self):
+        self.n = 0
+
+    def predict_one(self, x):
+        return 0.
+
+    def learn_one(self, x, y):
+        self.n += 1
+        if y < 0:
+            raise ValueError('negative target')
+        return self
+
+
+def test_failed_learn(client, app, regression):
+
+    client.post('/api/model/flaky', data=pickle.dumps(Flaky()))
+
+    for y, status_code in ((1, 201), (-1, 400), (1, 201)):
+        r = client.post('/api/learn', json={'features': {'x': 1}, 'ground_truth': y})
+        assert r.status_code == status_code
+
+    # The update which failed left no trace, even when the model is shared by every request
+    with app.app_context():
+        assert storage.checkout_model('flaky')[0].n == 2
+
+
+def test_parallel_learning(client, app, regression, lin_reg):
+
+    app.config['PARALLEL_LEARNERS'] = 1
+    app.config['MERGE_INTERVAL'] = 3600
+
+    client.post('/api/learn', json={'features': {'x': 1}, 'ground_truth': 2})
+    client.post('/api/learn', json={'features': {'x': 2}, 'ground_truth': 4})
+
+    # The replica hasn't been merged yet
+    with app.app_context():
+        assert storage.get_db()['models/lin-reg']['LinearRegression'].intercept == 0
+
+    app.config['MERGE_INTERVAL'] = 0
+    client.post('/api/learn', json={'features': {'x': 3}, 'ground_truth': 6})
+
+    # With a single learner, merging the replica is the same as learning with the model
+    model = preprocessing.StandardScaler() | linear_model.LinearRegression()
+    for x, y in ((1, 2), (2, 4), (3, 6)):
+        model.learn_one({'x': x}, y)
+    with app.app_context():
+        merged = storage.get_db()['models/lin-reg']
+    assert math.isclose(merged['LinearRegression'].intercept, model['LinearRegression'].intercept)
+    assert math.isclose(
+        merged['LinearRegression']._weights['x'],
+        model['LinearRegression']._weights['x']
+    )
+
+
+def test_idle_replicas_are_merged(client, app, regression, lin_reg):
+
+    app.config['PARALLEL_LEARNERS'] = 1
+    app.config['MERGE_INTERVAL'] = .1
+
+    client.post('/api/learn', json={'features': {'x': 1}, 'ground_truth': 2})
+    with app.app_context():
+        assert storage.get_db()['models/lin-reg']['StandardScaler'].counts == {}
+
+    # The replica is merged even though the process doesn't learn anymore
+    time.sleep(.5)
+    with app.app_context():
+        assert storage.get_db()['models/lin-reg']['StandardScaler'].counts == {'x': 1}
+
+
+def test_replicas_are_merged_at_exit(client, app, regression, lin_reg):
+
+    app.config['PARALLEL_LEARNERS'] = 1
+    app.config['MERGE_INTERVAL'] = 3600
+
+    client.post('/api/learn', json={'features': {'x': 1}, 'ground_truth': 2})
+    averaging._merge_at_exit()
+    with app.app_context():
+        assert storage.get_db()['models/lin-reg']['StandardScaler'].counts == {'x': 1}
+
+
+def test_replaced_model_drops_replica(client, app, regression, lin_reg):
+
+    app.config['PARALLEL_LEARNERS'] = 1
+    app.config['MERGE_INTERVAL'] = 3600
+    client.post('/api/learn', json={'features': {'x': 1}, 'ground_truth': 2})
+
+    # The model is replaced by another process, which this process doesn't hear about
+    with app.app_context():
+        storage.add_model(
+            preprocessing.StandardScaler() | linear_model.LinearRegression(),
+            name='lin-reg'
+        )
+
+    # The updates of the replica don't apply to the new model, so they are dropped
+    app.config['MERGE_INTERVAL'] = 0
+    r = client.post('/api/learn', json={'features': {'x': 2}, 'ground_truth': 4})
+    assert r.status_code == 201
+    with app.app_context():
+        assert storage.get_db()['models/lin-reg']['StandardScaler'].counts == {}
+
+    # The replica starts over from the new model
+    r = client.post('/api/learn', json={'features': {'x': 3}, 'ground_truth': 6})
+    assert r.status_code == 201
+    with app.app_context():
+        assert storage.get_db()['models/lin-reg']['StandardScaler'].counts == {'x': 1}
+
+
+def test_compiled_predictions(client, app, regression, lin_reg):
+
+    app.config['COMPILED_MODELS'] = True
+    app.config['COMPILED_CHECK_RATE'] = 1
+
+    # The model is compiled once it has been stored
+    for i in range(3):
+        client.post('/api/learn', json={'features': {'x': i}, 'ground_truth': i})
+    with app.app_context():
+        model = storage.get_db()['models/lin-reg']
+    expected = model.predict_one({'x': 2})
+
+    r = client.post('/api/predict', json={'features': {'x': 2}})
+    assert r.json['prediction'] == pytest.approx(expected, rel=1e-9)
+
+    # Features which aren't numbers are left to the model
+    r = client.post('/api/predict', json={'features': {'x': 'a'}})
+    assert r.status_code == 400
+
+    assert client.get('/api/stats').json['compiled_models'] == {
+        'predictions': 1, 'fallbacks': 1, 'checks': 1, 'mismatches': 0
+    }
+
+    # A compiled form which disagrees with the model stops being used
+    with app.app_context():
+        db = storage.get_db()
+        entry = db['compiled/lin-reg']
+        entry['model'].intercept += 1
+        db['compiled/lin-reg'] = entry
+
+    for _ in range(2):
+        r = client.post('/api/predict', json={'features': {'x': 2}})
+        assert r.json['prediction'] == pytest.approx(expected, rel=1e-9)
+
+    assert client.get('/api/stats').json['compiled_models'] == {
+        'predictions': 2, 'fallbacks': 1, 'checks': 2, 'mismatches': 1
+    }
+
+    # The compiled form is removed along with the model
+    client.delete('/api/model/lin-reg')
+    with app.app_context():
+        assert 'compiled/lin-reg' not in storage.get_db()
+
+
+def test_vectorized_batch_predictions(client, app, regression):
+
+    app.config['COMPILED_MODELS'] = True
+    app.config['COMPILED_CHECK_RATE'] = 1
+
+    names = [f'x{i}' for i in range(12)]
+    model = preprocessing.StandardScaler() | linear_model.LinearRegression()
+    for i in range(20):
+        model.learn_one({name: (i * j) % 7 for j, name in enumerate(names)}, i)
+    client.post('/api/model/wide', data=pickle.dumps(model))
+
+    items = [{'features': {name: i + j for j, name in enumerate(names)}} for i in range(5)]
+    items.append({'features': {'x1': 'a'}})
+    r = client.post('/api/batch/predict', json={'items': items})
+    results = r.json['results']
+
+    assert [result['status'] for result in results] == [200] * 5 + [400]
+    for item, result in zip(items, results):
+        if result['status'] == 200:
+            expected = model.predict_one(item['features'])
+            assert result['prediction'] == pytest.approx(expected, rel=1e-9)
+
+    stats = client.get('/api/stats').json
+    assert stats['compiled_models'] == {
+        'predictions': 5, 'fallbacks': 1, 'checks': 5, 'mismatches': 0
+    }
+    assert stats['feature_indexes'] == {'wide': {'size': 12, 'unseen_rate': 12 / 60}}
+
+    # The feature index is stored, so that it outlives the process
+    with app.app_context():
+        assert sorted(storage.get_db()['columns/wide']) == sorted(names)
+
+
+def test_batch_columns(client, app, regression, lin_reg):
+
+    r = client.post('/api/batch/columns', json={'items': [{'x': 1, 'y': 2}, {'z': 3.5}]})
+    assert r.json == {'names': ['x', 'y', 'z'], 'columns': [[1, None], [2, None], [None, 3.5]]}
+
+    # The columns stay in the same order
+    r = client.post('/api/batch/columns', json={'items': [{'z': 1, 'w': 2}]})
+    assert r.json == {'names': ['x', 'y', 'z', 'w'], 'columns': [[None], [None], [1], [2]]}
+
+    r = client.post('/api/batch/columns', json={'items': [{'x': 'a'}]})
+    assert r.status_code == 400
@@ -0,0 +1,39 @@
+import copy
+import math
+
+from river import datasets
+from river import linear_model
+from river import preprocessing
+
+from chantilly import averaging
+
+
+def test_merge_replicas():
+
+    model = preprocessing.StandardScaler() | linear_model.LinearRegression()
+    samples = list(datasets.TrumpApproval().take(100))
+    for x, y in samples[:50]:
+        model.learn_one(x, y)
+
+    # Two replicas learn from half of the remaining samples each
+    replicas = [copy.deepcopy(model), copy.deepcopy(model)]
+    for i, (x, y) in enumerate(samples[50:]):
+        replicas[i % 2].learn_one(x, y)
+
+    merged = copy.deepcopy(model)
+    for replica in replicas:
+        averaging.merge_delta(merged, model, replica, weight=.5)
+
+    # The weights are averaged
+    lin_regs = [replica['LinearRegression'] for replica in replicas]
+    for feature, weight in merged['LinearRegression']._weights.items():
+        assert math.isclose(weight, sum(lr._weights[feature] for lr in lin_regs) / 2)
+
+    # The statistics of the scaler are the same as if it had seen every sample
+    scaler = preprocessing.StandardScaler()
+    for x, _ in samples:
+        scaler.learn_one(x)
+    for feature in scaler.counts:
+        assert merged['StandardScaler'].counts[feature] == scaler.counts[feature]
+        assert math.isclose(merged['StandardScaler'].means[feature], scaler.means[feature])
+        assert math.isclose(merged['StandardScaler'].vars[feature], scaler.vars[feature])
@@ -0,0 +1,35 @@
+import threading
+import time
+
+from chantilly import batching
+
+
+def test_coalescer():
+
+    calls = []
+
+    def double(key, items):
+        calls.append(items)
+        time.sleep(.01)
+        return [ValueError(item) if item < 0 else key * item for item in items]
+
+    coalescer = batching.Coalescer(double, max_wait=.1, max_size=4)
+    results = {}
+
+    def submit(item):
+        try:
+            results[item] = coalescer.submit(2, item)
+        except ValueError as e:
+            results[item] = e
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(-1, 9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert isinstance(results.pop(-1), ValueError)
+    assert results == {i: 2 * i for i in range(9)}
+    assert sum(map(len, calls)) == 10
+    assert max(map(len, calls)) <= 4
+    assert coalescer.n_batches == len(calls)
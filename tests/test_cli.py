@@ -1,8 +1,10 @@
+import json
 import pickle
 import os
 import uuid
 
 from river import linear_model
+from river import preprocessing
 
 from chantilly import cli
 from chantilly import storage
@@ -30,3 +32,72 @@ def test_add_model(app):
 
     # Delete the pickle
     os.remove('tmp.pkl')
+
+
+def test_evaluate(app, tmp_path):
+    runner = app.test_cli_runner()
+
+    paths = []
+    for name, model in [
+        ('lin-reg', linear_model.LinearRegression()),
+        ('scaled-lin-reg', preprocessing.StandardScaler() | linear_model.LinearRegression())
+    ]:
+        paths.append(str(tmp_path / f'{name}.pkl'))
+        with open(paths[-1], 'wb') as f:
+            pickle.dump(model, f)
+
+    result = runner.invoke(cli.evaluate, [
+        *paths,
+        '--dataset', 'TrumpApproval',
+        '--limit', '50',
+        '--flavor', 'regression',
+        '--json'
+    ])
+    assert result.exit_code == 0, result.output
+
+    reports = json.loads(result.output)
+    assert sorted(reports) == ['lin-reg', 'scaled-lin-reg']
+    assert reports['lin-reg']['n_samples'] == 50
+    assert sorted(reports['lin-reg']['metrics']) == ['MAE', 'RMSE', 'SMAPE']
+    assert reports['lin-reg']['predict_throughput'] > 0
+
+
+def test_evaluate_no_flavor(app, tmp_path):
+    runner = app.test_cli_runner()
+    with open(tmp_path / 'model.pkl', 'wb') as f:
+        pickle.dump(linear_model.LinearRegression(), f)
+    result = runner.invoke(cli.evaluate, [str(tmp_path / 'model.pkl'), '--dataset', 'TrumpApproval'])
+    assert result.exit_code != 0
+    assert 'No flavor has been set.' in result.output
+
+
+def test_bench_storage(app, tmp_path):
+    runner = app.test_cli_runner()
+
+    with open(tmp_path / 'payload.json', 'w') as f:
+        json.dump({'features': {'x': 1, 'y': 2}, 'ground_truth': 3}, f)
+
+    result = runner.invoke(cli.bench_storage, [
+        '--backend', 'shelve',
+        '--backend', 'memory',
+        '--size', '100',
+        '--concurrency', '1',
+        '--concurrency', '2',
+        '--ops', '5',
+        '--payload', str(tmp_path / 'payload.json'),
+        '--json'
+    ])
+    assert result.exit_code == 0, result.output
+
+    rows = json.loads(result.output)
+    assert [(row['backend'], row['operation'], row['concurrency']) for row in rows] == [
+        ('shelve', 'set', 1), ('shelve', 'get', 1), ('shelve', 'iterate', 1),
+        ('shelve', 'delete', 1), ('shelve', 'learn', 1),
+        ('memory', 'set', 1), ('memory', 'get', 1), ('memory', 'iterate', 1),
+        ('memory', 'delete', 1), ('memory', 'learn', 1),
+        ('memory', 'set', 2), ('memory', 'get', 2), ('memory', 'iterate', 2),
+        ('memory', 'delete', 2), ('memory', 'learn', 2)
+    ]
+    assert rows[0]['n_ops'] == 5
+    assert rows[-1]['n_ops'] == 10
+    assert all(row['throughput'] > 0 for row in rows)
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+from river import linear_model
+from river import preprocessing
+import pytest
+from werkzeug import serving
+
+httpx = pytest.importorskip('httpx')
+
+from chantilly import client as chantilly_client  # noqa: E402
+
+
+@pytest.fixture
+def api(app):
+    transport = httpx.WSGITransport(app=app)
+    with chantilly_client.Client('http://testserver', transport=transport) as api:
+        api.init('regression')
+        api.upload_model(
+            preprocessing.StandardScaler() | linear_model.LinearRegression(),
+            name='lin-reg'
+        )
+        yield api
+
+
+def test_predict_learn(api):
+    assert api.predict({'x': 1}, id='a') == {'model': 'lin-reg', 'prediction': 0}
+    assert api.learn(2, id='a') == {}
+    assert api.predict({'x': 1})['prediction'] > 0
+
+
+def test_error(api):
+    with pytest.raises(chantilly_client.ChantillyError) as excinfo:
+        api.predict({'x': 1}, model='healthy-banana')
+    assert excinfo.value.status_code == 400
+    assert excinfo.value.message == "No model named 'healthy-banana'."
+
+
+def test_proxy_error():
+
+    def bad_gateway(request):
+        return httpx.Response(502, text='<html>Bad Gateway</html>')
+
+    transport = httpx.MockTransport(bad_gateway)
+    with chantilly_client.Client('http://testserver', transport=transport) as api:
+        with pytest.raises(chantilly_client.ChantillyError) as excinfo:
+            api.predict({'x': 1})
+    assert excinfo.value.status_code == 502
+    assert excinfo.value.message == '<html>Bad Gateway</html>'
+
+
+def test_batching(app):
+
+    transport = httpx.WSGITransport(app=app)
+    with chantilly_client.Client('http://testserver', transport=transport, batch_size=10,
+                                 batch_wait=.1) as api:
+        api.init('regression')
+        api.upload_model(preprocessing.StandardScaler() | linear_model.LinearRegression())
+
+        predictions = [api.predict({'x': i}, id=str(i)) for i in range(5)]
+        bad = api.predict({'x': 1}, model='healthy-banana')
+        learnings = [api.learn(i, id=str(i)) for i in range(5)]
+
+        assert [p.result()['prediction'] for p in predictions] == [0] * 5
+        assert [f.result() for f in learnings] == [{}] * 5
+        with pytest.raises(chantilly_client.ChantillyError):
+            bad.result()
+
+        # The calls were sent in a single batch of predictions followed by one of learning
+        stats = api.http.get('/api/stats').json()
+        assert stats['predict']['n_calls'] == 6
+        assert stats['learn']['n_calls'] == 5
+
+
+@pytest.fixture
+def server(app):
+    srv = serving.make_server('localhost', 0, app, threaded=True)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://localhost:{srv.server_port}'
+    srv.shutdown()
+
+
+def test_async_client(server):
+
+    async def run():
+        async with chantilly_client.AsyncClient(server, batch_size=10) as api:
+            await api.init('regression')
+            await api.upload_model(
+                preprocessing.StandardScaler() | linear_model.LinearRegression()
+            )
+            predictions = await asyncio.gather(*[
+                api.predict({'x': i}, id=str(i)) for i in range(5)
+            ])
+            await asyncio.gather(*[api.learn(i, id=str(i)) for i in range(5)])
+            return predictions, await api.metrics()
+
+    predictions, metrics = asyncio.run(run())
+    assert [p['prediction'] for p in predictions] == [0] * 5
+    assert metrics['MAE'] == 2
@@ -0,0 +1,45 @@
+import math
+
+from chantilly import columns
+
+
+def test_matrix():
+
+    index = columns.FeatureIndex(['b'])
+    matrix = index.matrix([
+        {'a': 1, 'b': 2.5},
+        'some text',
+        {'b': True},
+        {'a': 'x'},
+        {'a': math.nan},
+        {}
+    ])
+
+    assert index.names == ['b', 'a']
+    assert matrix.skipped == [1, 3, 4]
+    X = matrix.dense()
+    assert X.shape == (6, 2)
+    assert X[0].tolist() == [2.5, 1.]
+    assert X[2, 0] == 1.
+    assert all(math.isnan(v) for v in X[[1, 3, 4, 5]].ravel())
+
+
+def test_columns_are_stable():
+
+    index = columns.FeatureIndex()
+    index.matrix([{'a': 1, 'b': 2}])
+    index.matrix([{'c': 3, 'a': 4}])
+    assert index.positions == {'a': 0, 'b': 1, 'c': 2}
+
+    # The order of names indexed elsewhere comes first
+    matrix = index.matrix([{'a': 5}])
+    index.rebase(['d', 'a'])
+    assert index.names == ['d', 'a', 'b', 'c']
+    assert index.positions == {'d': 0, 'a': 1, 'b': 2, 'c': 3}
+    assert index.stats() == {'size': 4, 'unseen_rate': .6}
+
+    # Matrices which were built before keep their names
+    assert matrix.names == ['a', 'b', 'c']
+    names = index.names
+    index.rebase(['d'])
+    assert index.names is names
@@ -0,0 +1,103 @@
+import random
+
+from river import compose
+from river import datasets
+from river import linear_model
+from river import preprocessing
+import dill
+import pytest
+
+from chantilly import columns
+from chantilly import compiling
+
+
+@pytest.mark.parametrize('model', [
+    linear_model.LinearRegression(),
+    preprocessing.StandardScaler() | linear_model.LinearRegression(),
+    preprocessing.StandardScaler(with_std=False) | linear_model.LinearRegression()
+])
+def test_regression(model):
+
+    dataset = datasets.TrumpApproval()
+    for x, y in dataset.take(500):
+        model.learn_one(x, y)
+
+    # The compiled form survives a round trip through the storage
+    compiled = dill.loads(dill.dumps(compiling.compile_model(model)))
+    for x, _ in dataset:
+        x = {**x, 'unseen': 1.}
+        assert compiling.agree(compiled.predict(x), model.predict_one(x))
+
+
+@pytest.mark.parametrize('model', [
+    linear_model.LogisticRegression(),
+    preprocessing.StandardScaler() | linear_model.LogisticRegression()
+])
+def test_classification(model):
+
+    dataset = datasets.Phishing()
+    for x, y in dataset.take(500):
+        model.learn_one(x, y)
+
+    compiled = compiling.compile_model(model)
+    for x, _ in dataset:
+        assert compiling.agree(compiled.predict(x), model.predict_proba_one(x))
+
+
+def test_one_hot():
+
+    rng = random.Random(42)
+    samples = [
+        ({'shop': rng.choice('abc'), 'items': [rng.randint(0, 5) for _ in range(2)]}, rng.random())
+        for _ in range(500)
+    ]
+
+    model = preprocessing.OneHotEncoder() | linear_model.LinearRegression()
+    for x, y in samples[:250]:
+        model.learn_one(x, y)
+
+    compiled = compiling.compile_model(model)
+    for x, _ in samples:
+        assert compiling.agree(compiled.predict(x), model.predict_one(x))
+
+
+@pytest.mark.parametrize('model', [
+    preprocessing.MinMaxScaler() | linear_model.LinearRegression(),
+    preprocessing.StandardScaler(window_size=10) | linear_model.LinearRegression(),
+    preprocessing.OneHotEncoder(drop_first=True) | linear_model.LinearRegression(),
+    compose.Select('x') | preprocessing.StandardScaler() | linear_model.LinearRegression(),
+    linear_model.PARegressor()
+])
+def test_not_compiled(model):
+    assert compiling.compile_model(model) is None
+
+
+def test_not_numbers():
+
+    model = preprocessing.StandardScaler() | linear_model.LinearRegression()
+    model.learn_one({'x': 1.}, 1.)
+    compiled = compiling.compile_model(model)
+
+    with pytest.raises(compiling.NotCompilable):
+        compiled.predict({'x': 'a'})
+    with pytest.raises(compiling.NotCompilable):
+        compiled.predict('some text')
+
+
+def test_predict_many():
+
+    dataset = datasets.TrumpApproval()
+    model = preprocessing.StandardScaler() | linear_model.LinearRegression()
+    for x, y in dataset.take(500):
+        model.learn_one(x, y)
+    compiled = compiling.compile_model(model)
+
+    # The index has columns which the model doesn't know about, in a different order
+    index = columns.FeatureIndex(['unseen', *reversed(list(compiled.index))])
+    batch = [x for x, _ in dataset]
+    batch[1] = {'ordinal_date': 'a'}
+    preds = compiled.predict_many(index.matrix(batch), index.names)
+
+    assert preds[1] is None
+    for x, pred in zip(batch[2:], preds[2:]):
+        assert compiling.agree(pred, model.predict_one(x))
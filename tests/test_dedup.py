@@ -0,0 +1,77 @@
+import time
+
+from chantilly import dedup
+
+
+def test_bloom_filter_error_rate():
+    bloom = dedup.BloomFilter(capacity=1000, error_rate=.01)
+    for i in range(1000):
+        bloom.add(f'in-{i}')
+    assert all(f'in-{i}' in bloom for i in range(1000))
+    false_positives = sum(f'out-{i}' in bloom for i in range(10_000))
+    assert false_positives < 200
+
+
+def test_recent_keys_expire():
+
+    keys = dedup.RecentKeys(window=.05, exact_size=2)
+    for key in 'abc':
+        keys.add(key)
+
+    # The oldest key isn't stored exactly anymore, but the Bloom filter remembers it
+    assert list(keys._exact) == ['b', 'c']
+    assert 'a' in keys
+
+    # Keys are forgotten after at most two windows
+    time.sleep(.06)
+    assert 'a' in keys
+    time.sleep(.06)
+    assert 'a' not in keys
+
+
+def test_claims():
+
+    keys = dedup.RecentKeys(window=60)
+    assert keys.claim('a') == dedup.CLAIMED
+    assert keys.claim('a') == dedup.IN_FLIGHT
+
+    # A key whose event couldn't be learnt from can be claimed again
+    keys.release('a')
+    assert keys.claim('a') == dedup.CLAIMED
+    keys.add('a')
+    assert keys.claim('a') == dedup.DUPLICATE
+    assert keys.stats()['duplicates'] == 1
+
+
+class FakeRedis:
+    """Implements the few Redis commands used for idempotency keys, expiry aside."""
+
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+def test_shared_claims():
+
+    # Two processes share the same keys
+    r = FakeRedis()
+    a = dedup.SharedRecentKeys(r, window=60)
+    b = dedup.SharedRecentKeys(r, window=60)
+
+    assert a.claim('x') == dedup.CLAIMED
+    assert b.claim('x') == dedup.IN_FLIGHT
+    a.release('x')
+    assert b.claim('x') == dedup.CLAIMED
+    b.add('x')
+    assert a.claim('x') == dedup.DUPLICATE
@@ -0,0 +1,80 @@
+import math
+
+from river import metrics
+
+from chantilly import evaluation
+
+
+def test_window_size():
+    window = evaluation.Window([metrics.MAE()], size=2)
+    for i, y in enumerate((1, 2, 6)):
+        window.update(y_true=y, y_pred=0, t=i)
+    assert window.metrics[0].get() == 4
+
+
+def test_window_period():
+    window = evaluation.Window([metrics.MAE()], period=10)
+    window.update(y_true=1, y_pred=0, t=0)
+    window.update(y_true=3, y_pred=0, t=5)
+    assert window.metrics[0].get() == 2
+    window.expire(t=12)
+    assert window.metrics[0].get() == 3
+    window.expire(t=15)
+    assert window.metrics[0].get() == 0
+
+
+def test_window_classification():
+    window = evaluation.Window([metrics.Accuracy(), metrics.LogLoss()], size=1)
+    window.update(y_true=True, y_pred={True: .2, False: .8}, t=0)
+    window.update(y_true=True, y_pred={True: .9, False: .1}, t=1)
+    assert window.metrics[0].get() == 1
+
+
+def test_monitor_merge():
+
+    make_metrics = lambda: [metrics.Accuracy(), metrics.LogLoss(), metrics.F1()]
+    samples = [
+        (i % 3 == 0, {True: (i % 7) / 7, False: 1 - (i % 7) / 7})
+        for i in range(30)
+    ]
+
+    # Each worker sees every other sample
+    whole = evaluation.Monitor(make_metrics, window_size=5, window_period=10)
+    workers = [evaluation.Monitor(make_metrics, window_size=5, window_period=10) for _ in range(2)]
+    for t, (y_true, y_pred) in enumerate(samples):
+        whole.update(y_true, y_pred, t=t)
+        workers[t % 2].update(y_true, y_pred, t=t)
+
+    merged = evaluation.Monitor(make_metrics, window_size=5, window_period=10)
+    for worker in workers:
+        merged.merge(worker)
+
+    for window in ('all', 'size'):
+        for name, value in whole.get(window).items():
+            assert math.isclose(merged.get(window)[name], value)
+
+
+def test_window_footprint():
+
+    window = evaluation.Window([metrics.MAE()], size=1000, period=3600)
+    for t in range(100_000):
+        window.update(y_true=t % 10, y_pred=0, t=t / 100)
+
+    # The window holds a fixed number of buckets, whatever the number of samples
+    assert len(window.buckets) <= 11
+    assert 900 <= window.n_samples <= 1000
+    assert math.isclose(window.metrics[0].get(), 4.5, rel_tol=.01)
+
+
+def test_window_period_merge():
+
+    workers = [evaluation.Window([metrics.MAE()], period=10) for _ in range(2)]
+    for t in range(20):
+        workers[t % 2].update(y_true=t, y_pred=0, t=t)
+
+    # Buckets which cover the same interval are merged, and the stale ones are dropped
+    merged = evaluation.Window([metrics.MAE()], period=10)
+    for worker in workers:
+        merged.merge(worker)
+    assert [bucket.key for bucket in merged.buckets] == list(range(10, 20))
+    assert merged.metrics[0].get() == 14.5
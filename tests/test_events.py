@@ -0,0 +1,87 @@
+import json
+import os
+import pickle
+
+from river import datasets
+from river import linear_model
+from river import preprocessing
+import pytest
+
+from chantilly import cli
+from chantilly import events
+from chantilly import storage
+
+
+def test_log_segments(tmp_path):
+
+    log = events.EventLog(str(tmp_path), segment_size=3)
+    for i in range(10):
+        log.append({'t': i, 'model': 'a' if i % 2 else 'b', 'features': {'x': i}, 'ground_truth': i})
+
+    # The last segment is read while it is still being written to
+    assert len(os.listdir(tmp_path)) == 4
+    assert [event['t'] for event in events.read(str(tmp_path))] == list(range(10))
+    assert [event['t'] for event in events.read(str(tmp_path), model='a')] == [1, 3, 5, 7, 9]
+
+    log.close()
+    assert [event['t'] for event in events.read(str(tmp_path))] == list(range(10))
+
+
+@pytest.mark.parametrize('batch_size', [1, 4])
+def test_learn(tmp_path, batch_size):
+
+    log = events.EventLog(str(tmp_path))
+    for x, y in datasets.TrumpApproval().take(20):
+        log.append({'t': 0, 'model': 'a', 'features': x, 'ground_truth': y})
+    log.close()
+
+    model = events.learn(linear_model.LinearRegression(), events.read(str(tmp_path)), batch_size)
+    assert model.weights
+
+
+def test_learn_is_logged(client, app, tmp_path):
+
+    app.config['EVENT_LOG_DIR'] = str(tmp_path)
+
+    client.post('/api/init', json={'flavor': 'regression'})
+    client.post('/api/model/lin-reg', data=pickle.dumps(linear_model.LinearRegression()))
+    client.post('/api/predict', json={'id': 1, 'features': {'x': 1}})
+    client.post('/api/learn', json={'id': 1, 'ground_truth': 2})
+    client.post('/api/learn', json={'features': {'x': 3}, 'ground_truth': 4})
+
+    logged = [(e['model'], e['features'], e['ground_truth']) for e in events.read(str(tmp_path))]
+    assert logged == [('lin-reg', {'x': 1}, 2), ('lin-reg', {'x': 3}, 4)]
+
+
+def test_replay(client, app, tmp_path):
+
+    app.config['EVENT_LOG_DIR'] = str(tmp_path / 'events')
+
+    client.post('/api/init', json={'flavor': 'regression'})
+    client.post('/api/model/lin-reg', data=pickle.dumps(linear_model.LinearRegression()))
+    for x, y in datasets.TrumpApproval().take(30):
+        client.post('/api/learn', json={'features': x, 'ground_truth': y})
+
+    # Train two new models on the logged events
+    paths = []
+    for name in ('scaled', 'unscaled'):
+        model = linear_model.LinearRegression()
+        if name == 'scaled':
+            model = preprocessing.StandardScaler() | model
+        paths.append(str(tmp_path / f'{name}.pkl'))
+        with open(paths[-1], 'wb') as f:
+            pickle.dump(model, f)
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(cli.replay, [*paths, '--batch-size', '1', '--workers', '2'])
+    assert result.exit_code == 0, result.output
+
+    # Replaying one event at a time is equivalent to learning online
+    expected = linear_model.LinearRegression()
+    for x, y in datasets.TrumpApproval().take(30):
+        expected.learn_one(x, y)
+
+    with app.app_context():
+        db = storage.get_db()
+        assert db['models/unscaled'].weights == expected.weights
+        assert 'models/scaled' in db
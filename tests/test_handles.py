@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import uuid
+
+import pytest
+
+from chantilly import handles
+from chantilly import storage
+
+
+@pytest.fixture
+def path():
+    path = str(uuid.uuid4())
+    yield path
+    for file in storage._shelf_files(path) + [f'{path}.lock']:
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def shelf_handle(path):
+    return handles.SharedHandle(lambda: storage.open_shelf(path), lock_path=f'{path}.lock')
+
+
+def test_reuse(path):
+
+    handle = shelf_handle(path)
+    for i in range(3):
+        db = handle.acquire()
+        db['i'] = i
+        handle.release()
+
+    # The shelf is opened once, and is synced at the end of each use which modified it
+    db = handle.acquire()
+    assert db['i'] == 2
+    handle.release()
+    assert handle.stats() == {'opens': 1, 'syncs': 3}
+
+
+def test_changes_are_seen_by_other_handles(path):
+
+    # Two handles to the same shelf behave like two processes
+    a, b = shelf_handle(path), shelf_handle(path)
+    a.acquire()['x'] = 1
+    a.release()
+    assert b.acquire()['x'] == 1
+    b.release()
+
+    b.acquire()['x'] = 2
+    b.release()
+    assert a.acquire()['x'] == 2
+    a.release()
+    assert a.stats() == {'opens': 2, 'syncs': 1}
+
+
+def _learn(path, n):
+    handle = handles.get(('shelve', path), lambda: storage.open_shelf(path), f'{path}.lock')
+    for _ in range(n):
+        db = handle.acquire()
+        db['n'] = db.get('n', 0) + 1
+        handle.release()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='processes are not forked')
+def test_processes_take_turns(path):
+
+    # The parent has a handle, which the children don't inherit
+    _learn(path, 1)
+
+    ctx = multiprocessing.get_context('fork')
+    processes = [ctx.Process(target=_learn, args=(path, 50)) for _ in range(3)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    assert all(p.exitcode == 0 for p in processes)
+
+    handle = handles.get(('shelve', path), None)
+    assert handle.acquire()['n'] == 151
+    handle.release()
+    handles.discard(('shelve', path), lock_path=f'{path}.lock')
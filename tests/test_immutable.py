@@ -0,0 +1,152 @@
+import pickle
+
+from chantilly import flavors
+from chantilly import immutable
+from chantilly import storage
+
+
+class Mutator:
+    """Regression model which modifies its input."""
+
+    def __init__(self):
+        self.n = 0
+
+    def predict_one(self, x):
+        x['n'] = self.n
+        return float(self.n)
+
+    def learn_one(self, x, y):
+        x.pop('n', None)
+        self.n += 1
+        return self
+
+
+class Reader:
+    """Regression model which records the type of the features it is given."""
+
+    def __init__(self):
+        self.types = []
+
+    def predict_one(self, x):
+        self.types.append(type(x))
+        return 0.
+
+    def learn_one(self, x, y):
+        self.types.append(type(x))
+        return self
+
+
+class Sneaky:
+    """Regression model which starts modifying its input after its first update."""
+
+    def __init__(self):
+        self.n = 0
+
+    def predict_one(self, x):
+        return 0.
+
+    def learn_one(self, x, y):
+        if self.n:
+            x['seen'] = True
+        self.n += 1
+        return self
+
+
+class Picky:
+    """Regression model which only modifies some of its inputs."""
+
+    def __init__(self):
+        self.n = 0
+
+    def predict_one(self, x):
+        if 'bad' in x:
+            x.pop('bad')
+        return 0.
+
+    def learn_one(self, x, y):
+        if 'bad' in x:
+            x.pop('bad')
+        self.n += 1
+        return self
+
+
+def test_probe():
+    flavor = flavors.RegressionFlavor()
+    assert flavor.mutating_methods(Mutator()) == ['predict_one', 'learn_one']
+    assert flavor.mutating_methods(Reader()) == []
+    assert flavor.mutating_methods(Sneaky()) == []
+
+
+def test_call_mutator():
+    model = Mutator()
+    x = immutable.freeze({'a': 1})
+    mutates = ['predict_one', 'learn_one']
+    assert immutable.call(model, 'predict_one', x, mutates=mutates) == 0.
+    assert immutable.call(model, 'learn_one', x, mutates=mutates, y=1) is model
+    assert model.n == 1
+    assert x == {'a': 1}
+
+
+def test_call_reader():
+    model = Reader()
+    x = immutable.freeze({'a': 1})
+    immutable.call(model, 'predict_one', x, mutates=[])
+    immutable.call(model, 'predict_one', x)  # the features are copied when nothing is known
+    assert model.types == [immutable.ReadOnlyFeatures, dict]
+
+
+def test_unexpected_mutation():
+    model = Sneaky()
+    x = immutable.freeze({'a': 1})
+    immutable.call(model, 'learn_one', x, mutates=[], y=1)
+
+    # The method is called again with a copy of the features
+    mutations = []
+    immutable.call(model, 'learn_one', x, mutates=[], on_mutation=mutations.append, y=1)
+    assert mutations == ['learn_one']
+    assert model.n == 2
+    assert x == {'a': 1}
+
+
+def test_mutator_via_api(client, app):
+
+    client.post('/api/init', json={'flavor': 'regression'})
+    client.post('/api/model/mutator', data=pickle.dumps(Mutator()))
+
+    r = client.post('/api/predict', json={'id': 1, 'features': {'a': 1}})
+    assert r.json['prediction'] == 0.
+    r = client.post('/api/learn', json={'id': 1, 'ground_truth': 1})
+    assert r.status_code == 201
+
+    with app.app_context():
+        assert storage.get_db()['models/mutator'].n == 1
+
+
+def test_unexpected_mutation_via_api(client, app):
+
+    client.post('/api/init', json={'flavor': 'regression'})
+    client.post('/api/model/sneaky', data=pickle.dumps(Sneaky()))
+
+    # The update which modifies the features is made all the same
+    for _ in range(3):
+        r = client.post('/api/learn', json={'features': {'a': 1}, 'ground_truth': 1})
+        assert r.status_code == 201
+
+    with app.app_context():
+        assert storage.checkout_model('sneaky')[0].n == 3
+        assert storage.mutating_methods('sneaky') == ['learn_one']
+
+
+def test_mutation_which_depends_on_features(client, app):
+
+    client.post('/api/init', json={'flavor': 'regression'})
+    client.post('/api/model/picky', data=pickle.dumps(Picky()))
+    with app.app_context():
+        assert storage.mutating_methods('picky') == []
+
+    r = client.post('/api/learn', json={'features': {'a': 1, 'bad': 2}, 'ground_truth': 1})
+    assert r.status_code == 201
+
+    with app.app_context():
+        assert storage.checkout_model('picky')[0].n == 1
+        assert storage.mutating_methods('picky') == ['predict_one', 'learn_one']
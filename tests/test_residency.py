@@ -0,0 +1,127 @@
+import threading
+import time
+
+import dill
+
+from chantilly import residency
+
+
+class Backend(dict):
+
+    def get_raw(self, key):
+        return self[key]
+
+    def set_raw(self, key, blob):
+        self[key] = blob
+
+
+def make_db(n):
+    return Backend({f'models/{i}': dill.dumps(list(range(100))) for i in range(n)})
+
+
+def test_hits_and_misses():
+    db = make_db(1)
+    manager = residency.ModelManager(budget=10 ** 6)
+
+    model = manager.get(db, '0', version='a')
+    assert manager.get(db, '0', version='a') is model
+
+    # A different version means the model has been updated elsewhere
+    assert manager.get(db, '0', version='b') is not model
+
+    usage = manager.stats()['models']['0']
+    assert usage['hits'] == 1
+    assert usage['misses'] == 2
+
+
+def test_lru_eviction():
+    db = make_db(3)
+    size = residency.sizeof(list(range(100)))
+    manager = residency.ModelManager(budget=2 * size)
+
+    manager.get(db, '0', version=None)
+    manager.get(db, '1', version=None)
+    manager.get(db, '0', version=None)
+    manager.get(db, '2', version=None)
+
+    resident = {name for name, usage in manager.stats()['models'].items() if usage['resident']}
+    assert resident == {'0', '2'}
+
+
+def test_lfu_eviction():
+    db = make_db(3)
+    size = residency.sizeof(list(range(100)))
+    manager = residency.ModelManager(budget=2 * size, policy='lfu')
+
+    for _ in range(3):
+        manager.get(db, '0', version=None)
+    manager.get(db, '1', version=None)
+    manager.get(db, '1', version=None)
+    manager.get(db, '2', version=None)
+
+    resident = {name for name, usage in manager.stats()['models'].items() if usage['resident']}
+    assert resident == {'0', '2'}
+
+
+def test_write_back():
+    db = make_db(2)
+    size = residency.sizeof(list(range(100)))
+    manager = residency.ModelManager(budget=size, write_back=True, flush_interval=60)
+
+    model = manager.get(db, '0', version=None)
+    model.append(100)
+    manager.put(db, '0', model, version='a')
+    assert len(dill.loads(db['models/0'])) == 100
+
+    # The dirty model is written when it is evicted
+    manager.get(db, '1', version=None)
+    assert len(dill.loads(db['models/0'])) == 101
+
+
+def test_memory_size():
+    db = make_db(3)
+    size = residency.sizeof(list(range(100)))
+    manager = residency.ModelManager(budget=2 * size)
+
+    for name in ('0', '1', '2', '1'):
+        manager.get(db, name, version=None)
+    model = manager.get(db, '2', version='a')
+    manager.put(db, '2', model + [100], version='b')
+    manager.discard('1')
+
+    assert manager.memory_size == sum(entry.memory_size for entry in manager._entries.values())
+
+
+def test_locked_models_are_not_evicted():
+    db = make_db(2)
+    size = residency.sizeof(list(range(100)))
+    manager = residency.ModelManager(budget=size)
+
+    # The model is being used by another request, so the budget is exceeded for a while
+    manager.get(db, '0', version=None)
+    with manager.lock('0'):
+        thread = threading.Thread(target=manager.get, args=(db, '1', None))
+        thread.start()
+        thread.join()
+    assert set(manager._entries) == {'0', '1'}
+
+    manager.get(db, '1', version=None)
+    manager.put(db, '1', manager.get(db, '1', version=None), version='a')
+    assert set(manager._entries) == {'1'}
+
+
+def test_flush_interval():
+    db = make_db(2)
+    manager = residency.ModelManager(budget=10 ** 6, write_back=True, flush_interval=.05)
+
+    first = manager.get(db, '0', version=None)
+    first.append(100)
+    manager.put(db, '0', first, version='a')
+    assert len(dill.loads(db['models/0'])) == 100
+
+    # The models which have been dirty for too long are written when another model is stored
+    time.sleep(.1)
+    second = manager.get(db, '1', version=None)
+    manager.put(db, '1', second, version='b')
+    assert len(dill.loads(db['models/0'])) == 101
+    assert list(manager._dirty) == ['1']
@@ -0,0 +1,21 @@
+from chantilly import sampling
+
+
+def test_balanced():
+
+    sampler = sampling.Sampler('balanced', classes=True, seed=42)
+    for i in range(10_000):
+        sampler.keep(y=i % 10 == 0)
+
+    # The rare class is always kept, while the frequent one is kept 5 times out of 9
+    rates = sampler.stats()['class_rates']
+    assert rates['True'] == 1
+    assert abs(rates['False'] - 5 / 9) < 1e-9
+    assert abs(sampler.kept - (1000 + 9000 * 5 / 9)) < 100
+
+
+def test_adaptive():
+    sampler = sampling.Sampler('adaptive', rate=.1, max_backlog=4)
+    assert sampler.probability(y=None, backlog=3) == 1
+    assert sampler.probability(y=None, backlog=8) == .5
+    assert sampler.probability(y=None, backlog=100) == .1
@@ -0,0 +1,119 @@
+import os
+import uuid
+
+from river import linear_model
+import pytest
+
+from chantilly import columns
+from chantilly import exceptions
+from chantilly import storage
+
+
+@pytest.fixture
+def path():
+    path = str(uuid.uuid4())
+    yield path
+    storage.MemoryBackend.drop(path)
+
+
+def test_memory_lock(path):
+
+    db = storage.MemoryBackend(path)
+    with pytest.raises(exceptions.StorageLocked):
+        storage.MemoryBackend(path)
+    db.shutdown()
+
+    db = storage.MemoryBackend(path)
+    db.shutdown()
+
+
+def test_memory_restore(path):
+
+    db = storage.MemoryBackend(path)
+    db['a'] = 1
+    db['b'] = linear_model.LinearRegression()
+    db['c'] = 3
+    del db['c']
+    db.shutdown()
+
+    db = storage.MemoryBackend(path)
+    assert sorted(db) == ['a', 'b']
+    assert db['a'] == 1
+    assert isinstance(db['b'], linear_model.LinearRegression)
+    db.shutdown()
+
+
+def test_memory_compaction(path):
+
+    db = storage.MemoryBackend(path, fsync_interval=0, compact_every=1_000)
+    for i in range(10):
+        db[f'k{i}'] = i
+    db.compact()
+    db['k0'] = 42
+    del db['k1']
+    db.shutdown()
+
+    assert os.path.exists(f'{path}.snapshot')
+
+    db = storage.MemoryBackend(path)
+    assert len(db) == 9
+    assert db['k0'] == 42
+    assert 'k1' not in db
+    db.shutdown()
+
+
+def test_memory_truncated_log(path):
+
+    db = storage.MemoryBackend(path, fsync_interval=0)
+    db['a'] = 1
+    db['b'] = 2
+    db.shutdown()
+
+    # Simulate a crash in the middle of a write
+    log, = [f for f in os.listdir('.') if f.startswith(f'{path}.log.')]
+    with open(log, 'r+b') as f:
+        f.truncate(os.path.getsize(log) - 1)
+
+    db = storage.MemoryBackend(path)
+    assert list(db) == ['a']
+    db.shutdown()
+
+
+
+def test_model_index_migration(app):
+
+    with app.app_context():
+        storage.set_flavor('regression')
+        db = storage.get_db()
+
+        # Mimic a database which was created before the models were indexed
+        db['models/b'] = linear_model.LinearRegression()
+        db['models/a'] = linear_model.LinearRegression()
+        del db['indexed']
+
+        assert storage.model_names() == ['a', 'b']
+        assert db.index_range('models') == ['a', 'b']
+
+
+def test_stored_feature_order(app):
+
+    with app.app_context():
+        db = storage.get_db()
+
+        # Two processes index different names before either of them stores its index
+        first = columns.FeatureIndex()
+        second = columns.FeatureIndex()
+        first.matrix([{'a': 1, 'b': 2}])
+        second.matrix([{'c': 3, 'a': 4}])
+
+        storage.store_feature_index('m', first)
+        storage.store_feature_index('m', second)
+        assert db['columns/m'] == ['a', 'b', 'c']
+        assert second.names == ['a', 'b', 'c']
+
+        # The first process adopts the stored order the next time it stores new names
+        first.matrix([{'d': 5}])
+        storage.store_feature_index('m', first)
+        assert db['columns/m'] == ['a', 'b', 'c', 'd']
+        assert first.names == db['columns/m']
+        assert first.positions == {'a': 0, 'b': 1, 'c': 2, 'd': 3}